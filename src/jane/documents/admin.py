@@ -137,7 +137,7 @@ class DocumentAdmin(admin.ModelAdmin):
 
     def download_view(self, request, pk):
         document = self.get_object(request, pk)
-        response = HttpResponse(document.data,
+        response = HttpResponse(document.read_data(),
                                 content_type=document.content_type)
         response['Content-Disposition'] = \
             'attachment; filename="%s"' % (document.name)
@@ -187,7 +187,7 @@ class DocumentIndexAttachmentInline(admin.TabularInline):
     def format_small_preview_image(self, obj):
         if obj.content_type != "image/png":
             return b""
-        data = base64.b64encode(obj.data)
+        data = base64.b64encode(obj.read_data())
         return '<img height="50" src="data:image/png;base64,%s" />' % (
             data.decode())
     format_small_preview_image.allow_tags = True
@@ -286,7 +286,7 @@ class DocumentIndexAttachmentAdmin(admin.ModelAdmin):
     def format_preview_image(self, obj):
         if obj.content_type != "image/png":
             return b""
-        data = base64.b64encode(obj.data)
+        data = base64.b64encode(obj.read_data())
         return '<img height="500" src="data:image/png;base64,%s" />' % (
             data.decode())
     format_preview_image.allow_tags = True
@@ -295,7 +295,7 @@ class DocumentIndexAttachmentAdmin(admin.ModelAdmin):
     def format_small_preview_image(self, obj):
         if obj.content_type != "image/png":
             return b""
-        data = base64.b64encode(obj.data)
+        data = base64.b64encode(obj.read_data())
         return '<img height="50" src="data:image/png;base64,%s" />' % (
             data.decode())
     format_small_preview_image.allow_tags = True
@@ -312,7 +312,7 @@ class DocumentIndexAttachmentAdmin(admin.ModelAdmin):
 
     def download_view(self, request, pk):
         attachment = self.get_object(request, pk)
-        response = HttpResponse(attachment.data,
+        response = HttpResponse(attachment.read_data(),
                                 content_type=attachment.content_type)
         response['Content-Disposition'] = \
             'attachment; filename="%d"' % (attachment.id)
@@ -327,3 +327,20 @@ class DocumentIndexAttachmentAdmin(admin.ModelAdmin):
         return html % (url)
     format_data.short_description = 'Data'
     format_data.allow_tags = True
+
+
+@admin.register(models.DocumentIndexingJob)
+class DocumentIndexingJobAdmin(admin.ModelAdmin):
+    """
+    Jobs are created when uploading documents with JANE_ASYNC_INDEXING
+    enabled and processed by the process_indexing_queue command.
+    """
+    list_display = ['document', 'status', 'queued_at', 'started_at',
+                    'finished_at']
+    list_filter = ['status', 'queued_at']
+    readonly_fields = ['document', 'status', 'queued_at', 'started_at',
+                       'finished_at', 'error']
+
+    def has_add_permission(self, request, obj=None):  # @UnusedVariable
+        # disable ability to add rows
+        return False
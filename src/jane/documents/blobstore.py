@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed storage of document and attachment data outside of the
+database.
+
+If the ``JANE_BLOB_STORE`` setting is configured, the data of new documents
+and attachments is written to the blob store under its sha1 hash and the
+``data`` column of the row is left empty. Compressed data gets the extension
+of its encoding appended to the key. Identical data is only stored
+once. Unreferenced blobs are removed by the ``blob_store`` management
+command.
+"""
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+# Key suffixes of compressed blobs.
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def get_key(sha1, encoding=None):
+    """
+    Key of a blob given the sha1 hash of the uncompressed data and the
+    encoding it is stored with.
+    """
+    if encoding is None:
+        return sha1
+    return sha1 + EXTENSIONS[encoding]
+
+
+class BlobStore(object):
+    """
+    Interface of all blob stores. Blobs are identified by a key starting
+    with the sha1 hash of their uncompressed data, see ``get_key()``.
+    """
+    def exists(self, key):
+        raise NotImplementedError
+
+    def save(self, key, data):
+        """
+        Store the data. If a blob with that hash already exists, it is only
+        marked as recently used so that it is not garbage collected before
+        the new reference to it has been committed.
+        """
+        raise NotImplementedError
+
+    def open(self, key):
+        """
+        Open a blob as a binary file-like object.
+        """
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def list(self):
+        """
+        Iterate over ``(key, mtime)`` tuples of all stored blobs.
+        """
+        raise NotImplementedError
+
+    def path(self, key):
+        """
+        Path of a blob on the local file system or None if the store is not
+        backed by local files.
+        """
+        return None
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Stores each blob in a file named after its hash. Files are sharded into
+    subdirectories by the leading characters of the hash to keep the
+    directories reasonably small, e.g. ``ab/cd/abcd...``.
+
+    :param location: The root directory of the store.
+    :param depth: The number of subdirectory levels.
+    """
+    def __init__(self, location, depth=2):
+        self.location = os.path.abspath(location)
+        self.depth = depth
+
+    def path(self, key):
+        parts = [key[2 * _i:2 * _i + 2] for _i in range(self.depth)]
+        return os.path.join(self.location, *(parts + [key]))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, data):
+        path = self.path(key)
+        try:
+            # Deduplicated blobs might be unreferenced and old - touch them
+            # to protect them from collect_garbage().
+            os.utime(path)
+            return
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename it so concurrent readers
+        # never see partially written blobs.
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def open(self, key):
+        return open(self.path(key), "rb")
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        for root, _, files in os.walk(self.location):
+            for filename in files:
+                if filename.startswith(".tmp_"):
+                    continue
+                yield filename, os.path.getmtime(
+                    os.path.join(root, filename))
+
+
+_stores = {}
+
+
+def get_blob_store(required=False):
+    """
+    The blob store configured with the ``JANE_BLOB_STORE`` setting or None
+    if all data is stored in the database.
+
+    :param required: Raise if no blob store is configured.
+    """
+    config = settings.JANE_BLOB_STORE
+    if not config:
+        if required:
+            raise ValueError("JANE_BLOB_STORE is not configured.")
+        return None
+    config_key = json.dumps(config, sort_keys=True)
+    if config_key not in _stores:
+        _stores[config_key] = import_string(config["BACKEND"])(
+            **config.get("OPTIONS", {}))
+    return _stores[config_key]
+
+
+def open_blob(key):
+    return get_blob_store(required=True).open(key)
+
+
+def put(key, data):
+    """
+    Store data in the blob store if one is configured.
+
+    Returns the value of the ``data`` field of the model - None if the data
+    has been written to the blob store, otherwise the data itself.
+    """
+    store = get_blob_store()
+    if store is None:
+        return data
+    store.save(key, data)
+    return None
+
+
+def _get_stored_keys(queryset):
+    """
+    ``(pk, key)`` tuples of the documents or attachments in a queryset.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    if queryset.model is models.Document:
+        rows = queryset.values_list("pk", "sha1", "encoding")
+    else:
+        rows = queryset.values_list("pk", "sha1")
+    return ((_i[0], get_key(*_i[1:])) for _i in rows.iterator())
+
+
+def move_to_blob_store():
+    """
+    Move the data of all documents and attachments that are still stored in
+    the database to the blob store.
+
+    Returns the number of moved rows.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    store = get_blob_store(required=True)
+
+    count = 0
+    for model in (models.Document, models.DocumentIndexAttachment):
+        for pk, key in _get_stored_keys(model.objects.exclude(data=None)):
+            data = model.objects.filter(pk=pk).values_list(
+                "data", flat=True)[0]
+            store.save(key, data)
+            model.objects.filter(pk=pk).update(data=None)
+            count += 1
+    return count
+
+
+def collect_garbage(min_age=3600):
+    """
+    Delete all blobs not referenced by any document or attachment.
+
+    :param min_age: Only delete blobs older than this many seconds. Blobs are
+        written or touched before the transaction storing the referencing
+        row commits so recent blobs are kept.
+
+    Returns the number of deleted blobs.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    store = get_blob_store(required=True)
+
+    referenced = set()
+    for model in (models.Document, models.DocumentIndexAttachment):
+        referenced.update(_i[1] for _i in _get_stored_keys(
+            model.objects.filter(data=None)))
+
+    now = time.time()
+    count = 0
+    for key, mtime in store.list():
+        if key in referenced or now - mtime < min_age:
+            continue
+        store.delete(key)
+        count += 1
+    return count
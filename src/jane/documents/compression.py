@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed storage of document data.
+
+XML documents compress very well so with ``JANE_DOCUMENT_COMPRESSION`` set
+they are stored compressed, either in the database or in the blob store.
+The ``filesize`` and ``sha1`` of a document always refer to the
+uncompressed data. The encoding names are the HTTP content codings so
+compressed data can be sent to clients as it is.
+"""
+import gzip
+import io
+
+from django.conf import settings
+
+from jane.documents import blobstore
+
+# zstd is optional.
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+ENCODINGS = ("gzip", "zstd")
+
+
+def _check_encoding(encoding):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding '%s'. Must be one of: %s" % (
+            encoding, ", ".join(ENCODINGS)))
+    if encoding == "zstd" and zstandard is None:
+        raise ValueError("The 'zstandard' module is required for zstd "
+                         "compression.")
+
+
+def get_encoding():
+    """
+    The encoding new documents are stored with or None if they are stored
+    uncompressed.
+    """
+    encoding = settings.JANE_DOCUMENT_COMPRESSION
+    if encoding:
+        _check_encoding(encoding)
+    return encoding or None
+
+
+def compress(data, encoding):
+    if encoding is None:
+        return data
+    _check_encoding(encoding)
+    if encoding == "gzip":
+        return gzip.compress(data)
+    return zstandard.ZstdCompressor().compress(data)
+
+
+class _DecompressingReader(object):
+    """
+    Binary file-like object decompressing another one while reading.
+    Closing it also closes the underlying file.
+    """
+    def __init__(self, fh, encoding):
+        self.fh = fh
+        if encoding == "gzip":
+            self.reader = gzip.GzipFile(fileobj=fh, mode="rb")
+        else:
+            self.reader = zstandard.ZstdDecompressor().stream_reader(fh)
+
+    def read(self, size=-1):
+        return self.reader.read(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Only seeking forward is efficient.
+        return self.reader.seek(offset, whence)
+
+    def close(self):
+        self.reader.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_decompressed(fh, encoding):
+    """
+    Wrap a binary file-like object with data stored in the given encoding
+    to read the uncompressed data.
+    """
+    if encoding is None:
+        return fh
+    _check_encoding(encoding)
+    return _DecompressingReader(fh, encoding)
+
+
+def accepts_encoding(header, encoding):
+    """
+    Whether an ``Accept-Encoding`` header allows a certain encoding.
+    """
+    for item in (header or "").split(","):
+        parts = [_i.strip() for _i in item.split(";")]
+        if parts[0].lower() not in (encoding, "*"):
+            continue
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    if float(value) == 0:
+                        return False
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def recompress_documents():
+    """
+    Store all documents with the currently configured encoding, e.g. to
+    compress the documents uploaded before enabling compression.
+
+    Returns the number of changed documents.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    encoding = get_encoding()
+    if encoding is None:
+        queryset = models.Document.objects.exclude(encoding=None)
+    else:
+        queryset = models.Document.objects.exclude(encoding=encoding)
+
+    count = 0
+    for pk in queryset.values_list("pk", flat=True).iterator():
+        document = models.Document.objects.get(pk=pk)
+        data = compress(document.read_data(), encoding)
+        models.Document.objects.filter(pk=pk).update(
+            encoding=encoding, data=blobstore.put(
+                blobstore.get_key(document.sha1, encoding), data))
+        count += 1
+    return count
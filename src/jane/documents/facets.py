@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Maintained counts of the distinct values of certain index keys.
+
+Indexers list the keys in their ``facets`` attribute. Whenever indices are
+created, modified, or deleted the counts of their values are updated, so the
+distinct values of a key are known without scanning all indices. Null
+values are not counted.
+"""
+import collections
+import json
+
+from django.db import IntegrityError, connection, transaction
+
+from jane.documents import registry
+
+
+def get_facet_keys(document_type):
+    """
+    The facet keys of a document type.
+
+    :param document_type: The document type either as a
+        jane.documents.models.DocumentType instance or its name.
+    """
+    return registry.get_document_type_info(document_type).facets
+
+
+def count_values(indices, keys):
+    """
+    Count the values of the given keys in index dictionaries.
+
+    Returns a dictionary mapping ``(key, value)`` tuples to the counts.
+    """
+    counts = collections.Counter()
+    for index in indices:
+        for key in keys:
+            value = index.get(key)
+            if value is None:
+                continue
+            # The same text as returned by PostgreSQL's ->> operator.
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            counts[(key, value)] += 1
+    return counts
+
+
+def count_stored_values(queryset, keys):
+    """
+    Count the values of the given keys of the indices in a queryset in the
+    database.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    if not keys:
+        return collections.Counter()
+    sql, params = queryset.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT k, json->>k, COUNT(*) FROM {table}, unnest(%s) AS k "
+            "WHERE id IN ({sql}) AND json->>k IS NOT NULL "
+            "GROUP BY 1, 2".format(
+                table=models.DocumentIndex._meta.db_table, sql=sql),
+            [list(keys)] + list(params))
+        return collections.Counter(
+            {(_i[0], _i[1]): _i[2] for _i in cursor.fetchall()})
+
+
+def _apply(document_type_id, changes):
+    # Avoid circular imports.
+    from jane.documents import models
+
+    table = models.DocumentIndexFacet._meta.db_table
+    # Concurrent updates always lock the rows in the same order and thus
+    # cannot deadlock.
+    rows = sorted(changes.items())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM {table} WHERE document_type_id = %s "
+            "AND (key, value) IN ({pairs}) ORDER BY key, value "
+            "FOR UPDATE".format(
+                table=table, pairs=", ".join(["(%s, %s)"] * len(rows))),
+            [document_type_id] + [_j for (key, value), _ in rows
+                                  for _j in (key, value)])
+        cursor.execute(
+            "UPDATE {table} SET count = {table}.count + v.change "
+            "FROM (VALUES {values}) AS v(key, value, change) "
+            "WHERE {table}.document_type_id = %s AND {table}.key = v.key "
+            "AND {table}.value = v.value "
+            "RETURNING {table}.id, {table}.key, {table}.value, "
+            "{table}.count".format(
+                table=table, values=", ".join(
+                    ["(%s, %s, %s)"] * len(rows))),
+            [_j for (key, value), change in rows
+             for _j in (key, value, change)] + [document_type_id])
+        updated = cursor.fetchall()
+    # Values no longer present in any index.
+    models.DocumentIndexFacet.objects.filter(
+        pk__in=[_i[0] for _i in updated if _i[3] <= 0]).delete()
+    updated = set((_i[1], _i[2]) for _i in updated)
+    models.DocumentIndexFacet.objects.bulk_create([
+        models.DocumentIndexFacet(
+            document_type_id=document_type_id, key=key, value=value,
+            count=change)
+        for (key, value), change in rows
+        if (key, value) not in updated and change > 0])
+
+
+def update(document_type_id, added=None, removed=None):
+    """
+    Update the counts of a document type.
+
+    :param document_type_id: The name of the document type.
+    :param added: The counts of newly indexed values as returned by
+        ``count_values()`` or ``count_stored_values()``.
+    :param removed: The counts of no longer indexed values.
+    """
+    changes = collections.Counter(added or {})
+    changes.subtract(removed or {})
+    changes = {_k: _v for _k, _v in changes.items() if _v}
+    if not changes:
+        return
+
+    with transaction.atomic():
+        try:
+            # Another process might concurrently insert the same values.
+            with transaction.atomic():
+                _apply(document_type_id, changes)
+        except IntegrityError:
+            _apply(document_type_id, changes)
+
+
+def rebuild(document_type):
+    """
+    Recount all facets of a document type from its indices.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    if not isinstance(document_type, models.DocumentType):
+        document_type = models.DocumentType.objects.get(name=document_type)
+    counts = count_stored_values(
+        models.DocumentIndex._base_manager.filter(
+            document__document_type=document_type),
+        get_facet_keys(document_type))
+    with transaction.atomic():
+        models.DocumentIndexFacet.objects.filter(
+            document_type=document_type).delete()
+        models.DocumentIndexFacet.objects.bulk_create([
+            models.DocumentIndexFacet(
+                document_type=document_type, key=key, value=value,
+                count=count)
+            for (key, value), count in counts.items()])
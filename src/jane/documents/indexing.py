@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous indexing of documents.
+
+With ``JANE_ASYNC_INDEXING`` enabled, uploaded documents are validated and
+stored right away and an indexing job is queued in the database. The jobs
+are processed by the ``process_indexing_queue`` management command.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from jane.documents import models, signals
+
+
+def get_pending_jobs(limit=None):
+    """
+    Returns the ids of the pending jobs, oldest first.
+    """
+    jobs = models.DocumentIndexingJob.objects \
+        .filter(status=models.DocumentIndexingJob.PENDING) \
+        .order_by("queued_at") \
+        .values_list("pk", flat=True)
+    if limit is not None:
+        jobs = jobs[:limit]
+    return list(jobs)
+
+
+def requeue_stale_jobs(timeout=None):
+    """
+    Put jobs that have been running for too long back into the queue.
+
+    A worker that crashes while indexing never finishes its job, which
+    would thus stay running forever.
+
+    :param timeout: Maximum run time of a job in seconds. Defaults to the
+        ``JANE_INDEXING_JOB_TIMEOUT`` setting.
+
+    Returns the number of requeued jobs.
+    """
+    if timeout is None:
+        timeout = settings.JANE_INDEXING_JOB_TIMEOUT
+    Job = models.DocumentIndexingJob
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=timezone.now() - datetime.timedelta(seconds=timeout)) \
+        .update(status=Job.PENDING, started_at=None)
+
+
+def run_job(job_id):
+    """
+    Claim and run a single indexing job.
+
+    Any number of workers can call this concurrently - only the one that
+    manages to switch the job from pending to running will index the
+    document.
+
+    Returns the final status of the job or None if it has been claimed by
+    another worker.
+    """
+    Job = models.DocumentIndexingJob
+
+    claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+        status=Job.RUNNING, started_at=timezone.now(), finished_at=None,
+        error=None)
+    if not claimed:
+        return None
+
+    try:
+        document = models.Document.objects.select_related(
+            "document_type", "created_by", "modified_by").get(pk=job_id)
+        with transaction.atomic():
+            signals.index_document(sender=None, instance=document,
+                                   created=None)
+    except Exception as e:
+        status, error = Job.FAILED, "%s: %s" % (type(e).__name__, str(e))
+    else:
+        status, error = Job.DONE, None
+
+    # If the document has been modified in the meanwhile, the job is
+    # pending again and must not be marked as finished.
+    Job.objects.filter(pk=job_id, status=Job.RUNNING).update(
+        status=status, error=error, finished_at=timezone.now())
+    return status
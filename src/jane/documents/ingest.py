@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk ingestion of documents.
+
+Used by the ``upload_documents`` management command to import large
+archives of files. In contrast to
+:meth:`jane.documents.models.DocumentManager.add_or_modify_document` the
+files are read, validated, hashed, and indexed in a pool of worker processes
+and the results are written to the database in batches.
+"""
+import collections
+import multiprocessing
+import os
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from jane.documents import (blobstore, compression, facets, models, signals,
+                            JaneDocumentsValidationException)
+from jane.exceptions import JaneNotAuthorizedException
+
+
+IngestSummary = collections.namedtuple(
+    "IngestSummary", ["succeeded", "failed", "skipped", "indices", "elapsed"])
+
+# The plugins of the document type in each worker process. Set by
+# _init_worker().
+_worker_state = {}
+
+
+def _init_worker(document_type_name):
+    document_type = models.DocumentType.objects.get(name=document_type_name)
+    _worker_state["document_type"] = document_type_name
+    _worker_state["validators"] = [
+        _i.get_plugin() for _i in document_type.validators.all()]
+    _worker_state["indexer"] = document_type.indexer.get_plugin()
+
+
+def prepare_document(filename):
+    """
+    Read, validate, hash, index, and compress a single file.
+
+    Runs in the worker processes. Returns a dictionary with everything that
+    is required to write the document to the database or with the error
+    message if any of these steps failed.
+    """
+    try:
+        with open(filename, "rb") as fh:
+            buffer = signals.DocumentBuffer(fh.read())
+
+        validators = _worker_state["validators"]
+        if not validators:
+            raise Exception("At least one ValidatorPlugin must be defined "
+                            "for document type '%s'." %
+                            _worker_state["document_type"])
+        with buffer.open() as buf:
+            for validator in validators:
+                buf.seek(0, 0)
+                if not validator.validate(buf):
+                    raise JaneDocumentsValidationException(
+                        "Not a valid document of type %s." %
+                        _worker_state["document_type"])
+            buf.seek(0, 0)
+            indices = list(_worker_state["indexer"].index(buf))
+
+        # File-like attachments cannot be sent back to the main process.
+        for index in indices:
+            for value in (index.get("attachments") or {}).values():
+                if hasattr(value["data"], "seek"):
+                    value["data"].seek(0)
+                    value["data"] = value["data"].read()
+        encoding = compression.get_encoding()
+        stored = compression.compress(buffer.data, encoding)
+    except Exception as e:
+        return {"filename": filename,
+                "error": "%s: %s" % (type(e).__name__, str(e))}
+
+    return {"filename": filename,
+            "name": os.path.basename(filename),
+            "stored": stored,
+            "encoding": encoding,
+            "filesize": len(buffer),
+            "sha1": buffer.sha1,
+            "indices": indices}
+
+
+def _write_batch(document_type, user, content_type, batch):
+    """
+    Write a batch of prepared documents. Must run inside a transaction.
+
+    Returns the written documents, the number of created indices, and a
+    list of ``(filename, reason)`` tuples for the rejected documents.
+    """
+    failed = []
+
+    # Duplicates are rejected just like add_or_modify_document() does.
+    existing_sha1 = set(models.Document.objects.filter(
+        sha1__in=[_i["sha1"] for _i in batch]).values_list("sha1", flat=True))
+    documents = []
+    for doc in batch:
+        if doc["sha1"] in existing_sha1:
+            failed.append((doc["filename"],
+                           "Data already exists in the database."))
+            continue
+        existing_sha1.add(doc["sha1"])
+        documents.append(doc)
+
+    # Existing documents of the same name are updated.
+    existing = {
+        _i[0]: _i[1:] for _i in models.Document.objects.filter(
+            document_type=document_type,
+            name__in=[_i["name"] for _i in documents]).values_list(
+                "name", "id", "created_by_id")}
+    new = [_i for _i in documents if _i["name"] not in existing]
+
+    # The value of the data field - empty if kept in the blob store.
+    for doc in documents:
+        doc["stored_data"] = blobstore.put(
+            blobstore.get_key(doc["sha1"], doc["encoding"]), doc["stored"])
+
+    now = timezone.now()
+    for doc in documents:
+        if doc["name"] not in existing:
+            continue
+        doc["id"], doc["created_by_id"] = existing[doc["name"]]
+        models.Document.objects.filter(pk=doc["id"]).update(
+            data=doc["stored_data"], encoding=doc["encoding"],
+            filesize=doc["filesize"], sha1=doc["sha1"], modified_by=user,
+            modified_at=now)
+    if existing:
+        replaced = models.DocumentIndex.objects.filter(
+            document_id__in=[_i[0] for _i in existing.values()])
+        facets.update(document_type.name, removed=facets.count_stored_values(
+            replaced, facets.get_facet_keys(document_type)))
+        replaced.delete()
+
+    for doc, pk in zip(new, signals.reserve_ids(models.Document, len(new))):
+        doc["id"] = pk
+        doc["created_by_id"] = user.pk
+    models.Document.objects.bulk_create([
+        models.Document(
+            id=doc["id"], document_type=document_type, name=doc["name"],
+            content_type=content_type, data=doc["stored_data"],
+            encoding=doc["encoding"], filesize=doc["filesize"],
+            sha1=doc["sha1"], created_by=user, modified_by=user)
+        for doc in new], batch_size=signals.INSERT_BATCH_SIZE)
+
+    count = signals.bulk_create_indices(
+        ((doc["id"], doc["created_by_id"], _i)
+         for doc in documents for _i in doc["indices"]),
+        modified_by_id=user.pk, document_type_id=document_type.name)
+
+    return documents, count, failed
+
+
+def bulk_ingest(document_type, user, filenames, processes=None,
+                batch_size=100, progress_file=None, callback=None):
+    """
+    Add or modify a large number of documents.
+
+    Equivalent to calling ``add_or_modify_document()`` for each file, with
+    the name of each document being the basename of the file.
+
+    :param document_type: The document type either as a
+        jane.documents.models.DocumentType instance or as a string.
+    :param user: The user object responsible for the action.
+    :param filenames: The files to ingest.
+    :param processes: The number of worker processes. Defaults to the
+        number of CPUs. With a single process everything runs in the
+        current process.
+    :param batch_size: The number of documents written to the database in
+        a single transaction.
+    :param progress_file: Optional file to record the successfully
+        ingested files in. Files already listed in it are skipped, thus an
+        interrupted ingest can be resumed by passing the same file again.
+    :param callback: Optional callable receiving a progress message after
+        each batch.
+
+    Returns an ``IngestSummary``.
+    """
+    if not isinstance(document_type, models.DocumentType):
+        document_type = models.DocumentType.objects.get(name=document_type)
+
+    if not user.has_perm("documents.can_modify_%s" % document_type.name):
+        raise JaneNotAuthorizedException(
+            "No permission to upload documents of that type")
+
+    content_type = \
+        document_type.definition.get_plugin().default_content_type
+
+    filenames = [os.path.abspath(_i) for _i in filenames]
+    done = set()
+    if progress_file and os.path.exists(progress_file):
+        with open(progress_file, "rt") as fh:
+            done = set(_i.strip() for _i in fh)
+    todo = [_i for _i in filenames if _i not in done]
+
+    a = time.time()
+    succeeded = 0
+    index_count = 0
+    failed = []
+
+    def _flush(batch):
+        nonlocal succeeded, index_count
+        if not batch:
+            return
+        try:
+            with transaction.atomic():
+                written = [_write_batch(document_type, user, content_type,
+                                        batch)]
+        except Exception:
+            # Write one by one to only reject the offending documents.
+            written = []
+            for doc in batch:
+                try:
+                    with transaction.atomic():
+                        written.append(_write_batch(
+                            document_type, user, content_type, [doc]))
+                except Exception as e:
+                    failed.append((doc["filename"], "%s: %s" % (
+                        type(e).__name__, str(e))))
+        for documents, count, rejected in written:
+            succeeded += len(documents)
+            index_count += count
+            failed.extend(rejected)
+            if progress_file:
+                progress.write("".join(
+                    "%s\n" % _i["filename"] for _i in documents))
+        if progress_file:
+            progress.flush()
+        cache.delete('record_list_json')
+        signals.invalidate_document_type(document_type.name)
+
+        if callback:
+            elapsed = time.time() - a
+            callback("Ingested %i of %i files in %.1f seconds "
+                     "(%.1f files/s), %i failed." % (
+                         succeeded, len(todo), elapsed,
+                         succeeded / max(elapsed, 1E-9), len(failed)))
+
+    if processes == 1:
+        pool = None
+        _init_worker(document_type.name)
+        results = map(prepare_document, todo)
+    else:
+        # Close the connection before forking - each process will open its
+        # own.
+        connection.close()
+        pool = multiprocessing.Pool(processes=processes,
+                                    initializer=_init_worker,
+                                    initargs=(document_type.name,))
+        results = pool.imap_unordered(prepare_document, todo, chunksize=4)
+
+    progress = open(progress_file, "at") if progress_file else None
+    try:
+        batch = []
+        names = set()
+        for result in results:
+            if "error" in result:
+                failed.append((result["filename"], result["error"]))
+                continue
+            # Multiple files with the same name go to separate batches.
+            if len(batch) >= batch_size or result["name"] in names:
+                _flush(batch)
+                batch = []
+                names = set()
+            batch.append(result)
+            names.add(result["name"])
+        _flush(batch)
+    except:
+        if pool:
+            pool.terminate()
+        raise
+    else:
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.join()
+        if progress:
+            progress.close()
+
+    return IngestSummary(succeeded=succeeded, failed=failed,
+                         skipped=len(filenames) - len(todo),
+                         indices=index_count, elapsed=time.time() - a)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+import statistics
+import time
+
+from django.contrib.gis.measure import Distance
+from django.core.management.base import BaseCommand
+
+from jane.documents import models, registry
+from jane.documents.utils import deg2km
+
+
+# (min_radius, max_radius) in degree.
+CASES = [(None, 1), (None, 10), (None, 90), (None, 180), (90, None),
+         (10, 30)]
+
+
+def _legacy_queryset(queryset, point, min_radius, max_radius):
+    """
+    Radial query comparing the distances of the whole geometries as done
+    before the location of the indices has been stored.
+    """
+    if min_radius is not None:
+        queryset = queryset.filter(geometry__distance_gt=(
+            point, Distance(km=deg2km(min_radius))))
+    if max_radius is not None:
+        queryset = queryset.filter(geometry__distance_lt=(
+            point, Distance(km=deg2km(max_radius))))
+    return queryset
+
+
+def _time(queryset):
+    start = time.perf_counter()
+    count = queryset.count()
+    return time.perf_counter() - start, count
+
+
+class Command(BaseCommand):
+    help = "Compare the speed of the radial queries of the fdsnws station " \
+        "and event services with the previous implementation on the " \
+        "existing indices."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "document_type", type=str, nargs="*",
+            help="The document types to query. Defaults to all.")
+        parser.add_argument(
+            "-n", "--queries", type=int, default=20,
+            help="Number of random central points per radius.")
+        parser.add_argument(
+            "--seed", type=int, default=12345,
+            help="Seed of the random central points.")
+
+    def handle(self, *args, **kwargs):
+        document_types = kwargs["document_type"] or \
+            sorted(registry.get_registry())
+        rng = random.Random(kwargs["seed"])
+
+        for document_type in document_types:
+            base = models.DocumentIndex.objects.apply_retrieve_permission(
+                document_type=document_type,
+                queryset=models.DocumentIndex._base_manager.filter(
+                    document__document_type=document_type),
+                user=None)
+            print("%s: %i indices" % (document_type, base.count()))
+            print("  min_radius  max_radius  previous [ms]  current [ms]  "
+                  "speedup")
+
+            for min_radius, max_radius in CASES:
+                previous = []
+                current = []
+                for _ in range(kwargs["queries"]):
+                    # Uniformly distributed on the sphere.
+                    latitude = math.degrees(math.asin(rng.uniform(-1, 1)))
+                    longitude = rng.uniform(-180, 180)
+                    point = "POINT(%f %f)" % (longitude, latitude)
+
+                    t_previous, n_previous = _time(_legacy_queryset(
+                        base, point, min_radius, max_radius))
+                    t_current, n_current = _time(
+                        models.DocumentIndex.objects
+                        .get_filtered_queryset_radial_distance(
+                            document_type=document_type,
+                            central_latitude=latitude,
+                            central_longitude=longitude,
+                            min_radius=min_radius, max_radius=max_radius,
+                            queryset=base))
+                    if n_previous != n_current:
+                        self.stderr.write(
+                            "Different results around %s: %i vs. %i" % (
+                                point, n_previous, n_current))
+                    previous.append(t_previous)
+                    current.append(t_current)
+
+                previous = statistics.median(previous) * 1000
+                current = statistics.median(current) * 1000
+                print("  %10s  %10s  %13.2f  %12.2f  %6.1fx" % (
+                    min_radius, max_radius, previous, current,
+                    previous / current if current else float("inf")))
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from jane.documents import blobstore
+
+
+class Command(BaseCommand):
+    help = "Maintain the blob store configured with JANE_BLOB_STORE."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action', type=str, choices=["move", "collect"],
+            help="'move' moves the data of all documents and attachments "
+                 "still stored in the database to the blob store, "
+                 "'collect' deletes all blobs no longer referenced.")
+        parser.add_argument(
+            '--min-age', type=float, default=3600,
+            help="Only collect blobs older than this many seconds (default "
+                 "is 3600).")
+
+    def handle(self, *args, **kwargs):
+        if kwargs["action"] == "move":
+            count = blobstore.move_to_blob_store()
+            print("Moved the data of %i documents and attachments to the "
+                  "blob store." % count)
+        else:
+            count = blobstore.collect_garbage(min_age=kwargs["min_age"])
+            print("Deleted %i unreferenced blobs." % count)
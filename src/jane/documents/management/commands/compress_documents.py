@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from jane.documents import compression
+
+
+class Command(BaseCommand):
+    help = "Store all documents with the compression configured with " \
+        "JANE_DOCUMENT_COMPRESSION."
+
+    def handle(self, *args, **kwargs):
+        count = compression.recompress_documents()
+        print("Recompressed %i documents." % count)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Index the documents queued with ``JANE_ASYNC_INDEXING`` enabled.
+"""
+import logging
+import multiprocessing
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ... import indexing
+
+
+django.setup()
+
+
+logger = logging.getLogger("jane-indexing-queue")
+
+
+def worker(job_id):
+    try:
+        status = indexing.run_job(job_id)
+    except Exception as e:
+        return job_id, None, "%s - %s" % (str(type(e)), str(e))
+    return job_id, status, None
+
+
+def _run(options):
+    # Close the connection before forking - each process will open its own.
+    connection.close()
+    pool = multiprocessing.Pool(processes=options["number_of_cpus"])
+    try:
+        while True:
+            requeued = indexing.requeue_stale_jobs()
+            if requeued:
+                logger.warning("Requeued %i stale indexing jobs." % requeued)
+            job_ids = indexing.get_pending_jobs(limit=options["batch_size"])
+            if not job_ids:
+                if options["run_once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            a = time.time()
+            counts = {}
+            for job_id, status, error in pool.imap_unordered(worker,
+                                                             job_ids):
+                if error:
+                    logger.error("Error running indexing job for document "
+                                 "%i: %s" % (job_id, error))
+                    continue
+                if status is None:
+                    continue
+                counts[status] = counts.get(status, 0) + 1
+                logger.debug("Indexed document %i: %s" % (job_id, status))
+            logger.info("Processed %i indexing jobs in %.2f seconds (%s)." % (
+                sum(counts.values()), time.time() - a,
+                ", ".join("%i %s" % (value, key)
+                          for key, value in sorted(counts.items()))))
+    except KeyboardInterrupt:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+
+class Command(BaseCommand):
+    help = "Index the documents queued for asynchronous indexing."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', type=int, dest='number_of_cpus',
+            help="Number of CPUs used to index the documents.",
+            default=multiprocessing.cpu_count())
+        parser.add_argument(
+            '-b', '--batch-size', type=int, default=100,
+            help="Number of jobs handed to the worker processes at once.")
+        parser.add_argument(
+            '-i', '--poll-interval', type=float, default=5.0,
+            help="Poll interval in seconds when waiting for new jobs "
+                 "(default is 5).")
+        parser.add_argument(
+            '-1', '--run-once', action='store_true',
+            help="Process all pending jobs once and quit afterwards.")
+
+    def handle(self, *args, **kwargs):
+        # set level of verbosity
+        if kwargs["verbosity"] > 1:
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.INFO)
+
+        # Prevent propagating to higher loggers.
+        logger.propagate = 0
+
+        ch = logging.StreamHandler()
+        FORMAT = "[%(asctime)s] %(levelname)s: %(message)s"
+        ch.setFormatter(logging.Formatter(FORMAT))
+        logger.addHandler(ch)
+
+        _run(kwargs)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from jane.documents import facets, models
+
+
+class Command(BaseCommand):
+    help = "Recount the distinct values of the facet keys of all indices."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "document_type", type=str, nargs="*",
+            help="The document types to recount. Defaults to all.")
+
+    def handle(self, *args, **kwargs):
+        document_types = models.DocumentType.objects.all()
+        if kwargs["document_type"]:
+            document_types = document_types.filter(
+                name__in=kwargs["document_type"])
+        for document_type in document_types:
+            facets.rebuild(document_type)
+            print("Recounted the facets of '%s'." % document_type.name)
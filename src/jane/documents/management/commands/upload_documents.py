@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 import glob
-import io
+import multiprocessing
 import os
 
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 
-from jane.documents import models
+from jane.documents import ingest, models
 
 
 class Command(BaseCommand):
@@ -25,6 +25,24 @@ class Command(BaseCommand):
         parser.add_argument(
             'path', type=str, nargs='+',
             help='The files to upload.')
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help='Validate and index the files in parallel and write them '
+                 'to the database in batches. Much faster for large numbers '
+                 'of files.')
+        parser.add_argument(
+            '-n', type=int, dest='number_of_cpus',
+            help='Number of CPUs used in bulk mode.',
+            default=multiprocessing.cpu_count())
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of documents written in one transaction in bulk '
+                 'mode (default is 100).')
+        parser.add_argument(
+            '--progress-file', type=str,
+            help='Record the uploaded files in this file in bulk mode. '
+                 'Files already listed in it will be skipped which allows '
+                 'resuming an interrupted upload.')
 
     def handle(self, *args, **kwargs):
         # Cannot easily fail as the model type settings are enforced by
@@ -40,15 +58,36 @@ class Command(BaseCommand):
         for pattern in paths:
             all_files.extend(glob.glob(pattern))
 
+        if kwargs["bulk"]:
+            self._bulk_upload(document_type, user, all_files, kwargs)
+            return
+
         for filename in all_files:
             print('Uploading %s...' % filename)
             with open(filename, "rb") as fh:
-                with io.BytesIO(fh.read()) as data:
-                    try:
-                        models.Document.objects.add_or_modify_document(
-                            document_type=document_type,
-                            name=os.path.basename(filename),
-                            data=data.read(),
-                            user=user)
-                    except Exception as e:
-                        print("Failed uploading due to: %s" % str(e))
+                data = fh.read()
+            try:
+                models.Document.objects.add_or_modify_document(
+                    document_type=document_type,
+                    name=os.path.basename(filename),
+                    data=data,
+                    user=user)
+            except Exception as e:
+                print("Failed uploading due to: %s" % str(e))
+
+    def _bulk_upload(self, document_type, user, all_files, kwargs):
+        summary = ingest.bulk_ingest(
+            document_type=document_type, user=user, filenames=all_files,
+            processes=kwargs["number_of_cpus"],
+            batch_size=kwargs["batch_size"],
+            progress_file=kwargs["progress_file"], callback=print)
+
+        for filename, reason in summary.failed:
+            print("Failed uploading %s due to: %s" % (filename, reason))
+
+        print("Uploaded %i files with %i indices in %.1f seconds "
+              "(%.1f files/s)." % (
+                  summary.succeeded, summary.indices, summary.elapsed,
+                  summary.succeeded / max(summary.elapsed, 1E-9)))
+        print("%i files failed, %i files were skipped as they have already "
+              "been uploaded." % (len(summary.failed), summary.skipped))
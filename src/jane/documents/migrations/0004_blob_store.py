@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_attachments(apps, schema_editor):
+    DocumentIndexAttachment = apps.get_model("documents",
+                                             "DocumentIndexAttachment")
+    attachments = DocumentIndexAttachment.objects.values_list("id", "data")
+    for pk, data in attachments.iterator():
+        DocumentIndexAttachment.objects.filter(pk=pk).update(
+            sha1=hashlib.sha1(data).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_documentindexingjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='data',
+            field=models.BinaryField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='documentindexattachment',
+            name='data',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='documentindexattachment',
+            name='sha1',
+            field=models.CharField(db_index=True, editable=False,
+                                   max_length=40, null=True),
+        ),
+        migrations.RunPython(hash_attachments, migrations.RunPython.noop),
+    ]
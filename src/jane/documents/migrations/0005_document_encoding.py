@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='encoding',
+            field=models.CharField(blank=True, editable=False, max_length=10,
+                                   null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_document_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentindex',
+            name='attachments_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            "UPDATE documents_documentindex SET attachments_count = ("
+            "SELECT COUNT(*) FROM documents_documentindexattachment "
+            "WHERE documents_documentindexattachment.index_id = "
+            "documents_documentindex.id)",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
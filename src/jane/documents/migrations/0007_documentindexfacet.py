@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The facet keys of the bundled document types. Others have to be counted
+# with the rebuild_facets management command.
+FACETS = [
+    ("quakeml", "agency"), ("quakeml", "author"),
+    ("quakeml", "magnitude_type"), ("quakeml", "evaluation_mode"),
+    ("quakeml", "event_type"), ("quakeml", "region"),
+    ("stationxml", "network"), ("stationxml", "location"),
+    ("stationxml", "channel"), ("stationxml", "sensor_type"),
+    ("stationxml", "units_after_sensitivity")]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_documentindex_attachments_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentIndexFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('value', models.TextField()),
+                ('count', models.IntegerField()),
+                ('document_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='documents.DocumentType')),
+            ],
+            options={
+                'ordering': ['document_type', 'key', 'value'],
+                'verbose_name': 'Facet',
+                'verbose_name_plural': 'Facets',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentindexfacet',
+            unique_together=set([('document_type', 'key', 'value')]),
+        ),
+        # Count the values of the already existing indices.
+        migrations.RunSQL(
+            [("INSERT INTO documents_documentindexfacet "
+              "(document_type_id, key, value, count) "
+              "SELECT f.document_type_id, f.key, i.json->>f.key, COUNT(*) "
+              "FROM documents_documentindex i "
+              "INNER JOIN documents_document d ON i.document_id = d.id "
+              "INNER JOIN (VALUES {values}) AS f(document_type_id, key) "
+              "ON d.document_type_id = f.document_type_id "
+              "WHERE i.json->>f.key IS NOT NULL "
+              "GROUP BY 1, 2, 3".format(
+                  values=", ".join(["(%s, %s)"] * len(FACETS))),
+              [_j for _i in FACETS for _j in _i])],
+            reverse_sql=migrations.RunSQL.noop),
+    ]
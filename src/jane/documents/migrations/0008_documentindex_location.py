@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_documentindexfacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentindex',
+            name='location',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            "UPDATE documents_documentindex "
+            "SET location = ST_GeometryN(geometry::geometry, 1)::geography "
+            "WHERE ST_NumGeometries(geometry::geometry) = 1 AND "
+            "GeometryType(ST_GeometryN(geometry::geometry, 1)) = 'POINT'",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
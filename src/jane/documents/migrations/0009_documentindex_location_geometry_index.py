@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_documentindex_location'),
+    ]
+
+    # Rectangular queries compare the locations as planar geometries which
+    # cannot use the index of the geography column.
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX documents_documentindex_location_geometry_id "
+            "ON documents_documentindex USING GIST ((location::geometry))",
+            reverse_sql="DROP INDEX "
+                        "documents_documentindex_location_geometry_id"),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def remove_facets(apps, schema_editor):
+    DocumentIndexFacet = apps.get_model("documents", "DocumentIndexFacet")
+    DocumentIndexFacet.objects.filter(
+        document_type_id="stationxml", key="station").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_documentindex_location_geometry_index'),
+    ]
+
+    # Stations are no longer a facet of StationXML documents - remove the
+    # values counted before.
+    operations = [
+        migrations.RunPython(remove_facets, migrations.RunPython.noop),
+    ]
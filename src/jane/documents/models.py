@@ -15,7 +15,12 @@ The hierarchy is fairly simple:
 
 New document types can be defined by adding new plug-ins.
 """
+import collections
+import contextlib
 import hashlib
+import io
+import logging
+import time
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
@@ -23,22 +28,84 @@ from django.contrib.gis.db import models
 from django.contrib.gis.measure import Distance
 from django.contrib.postgres.fields import jsonb
 from django.core.urlresolvers import reverse
-from django.db import connection
-from django.db.models.aggregates import Count
-from django.db.models.expressions import OrderBy, RawSQL
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import F, RawSQL
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
 from djangoplugins.fields import PluginField, ManyPluginField
 from obspy.core.utcdatetime import UTCDateTime
 from rest_framework import status
 
-from jane.documents import plugins, signals
+from jane.documents import (blobstore, compression, facets, plugins,
+                            registry, signals)
 from jane.documents.utils import deg2km
 from jane.exceptions import (JaneDocumentAlreadyExists,
                              JaneNotAuthorizedException)
 
 
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def _timed(timings, stage):
+    a = time.time()
+    try:
+        yield
+    finally:
+        timings[stage] = time.time() - a
+
+
+class BlobDataMixin(object):
+    """
+    Access to the data of models whose ``data`` field can be stored in the
+    blob store. An empty ``data`` field means the data is in the blob store.
+    Models with an ``encoding`` field can store their data compressed, see
+    ``jane.documents.compression``.
+    """
+    @property
+    def in_blob_store(self):
+        return self.data is None
+
+    @property
+    def blob_key(self):
+        return blobstore.get_key(self.sha1, getattr(self, "encoding", None))
+
+    def open_stored_data(self):
+        """
+        Open the data as it is stored, e.g. compressed, as a binary
+        file-like object.
+        """
+        if self.in_blob_store:
+            return blobstore.open_blob(self.blob_key)
+        return io.BytesIO(self.data)
+
+    def open_data(self):
+        """
+        Open the uncompressed data as a binary file-like object.
+        """
+        return compression.open_decompressed(
+            self.open_stored_data(), getattr(self, "encoding", None))
+
+    def read_data(self):
+        """
+        The uncompressed data as a byte string.
+        """
+        with self.open_data() as fh:
+            return fh.read()
+
+    def stored_size(self):
+        """
+        The size of the data as it is stored.
+        """
+        if self.in_blob_store:
+            return blobstore.get_blob_store(required=True).size(
+                self.blob_key)
+        return len(self.data)
+
+
 class DocumentType(models.Model):
     """
     Document category. Will be determined from the registered plugins.
@@ -65,6 +132,15 @@ class DocumentType(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        registry.clear()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        registry.clear()
+        return result
+
     class Meta:
         ordering = ['name']
         verbose_name = 'Document Type'
@@ -92,8 +168,8 @@ class DocumentManager(models.Manager):
         """
         # Works with strings and DocumentType instances.
         if not isinstance(document_type, DocumentType):
-            document_type = get_object_or_404(
-                DocumentType, name=document_type)
+            document_type = registry.get_document_type_info(
+                document_type).document_type
         document_type_str = document_type.name
 
         # The user in question must have the permission to modify documents
@@ -124,8 +200,8 @@ class DocumentManager(models.Manager):
         """
         # Works with strings and DocumentType instances.
         if not isinstance(document_type, DocumentType):
-            document_type = get_object_or_404(
-                DocumentType, name=document_type)
+            document_type = registry.get_document_type_info(
+                document_type).document_type
         document_type_str = document_type.name
 
         # The user in question must have the permission to modify documents
@@ -135,9 +211,10 @@ class DocumentManager(models.Manager):
             raise JaneNotAuthorizedException(
                 "No permission to upload documents of that type")
 
-        # Calculate the hash upfront to not upload any duplicates.
-        sha1 = hashlib.sha1(data).hexdigest()
-        if Document.objects.filter(sha1=sha1).exists():
+        # Calculate the hash upfront to not upload any duplicates. The
+        # buffer is passed on to avoid hashing and copying the data again.
+        buffer = signals.DocumentBuffer(data)
+        if Document.objects.filter(sha1=buffer.sha1).exists():
             raise JaneDocumentAlreadyExists("Data already exists in the "
                                             "database.")
 
@@ -154,15 +231,22 @@ class DocumentManager(models.Manager):
                 created_by=user)
             stat = status.HTTP_201_CREATED
 
-        document.data = data
-        document.save()
+        document.set_data(buffer.data)
+
+        # Only store the document and leave the indexing to the queue.
+        if settings.JANE_ASYNC_INDEXING:
+            document.save(buffer=buffer, index=False)
+            DocumentIndexingJob.objects.queue(document)
+            return status.HTTP_202_ACCEPTED
+
+        document.save(buffer=buffer)
 
         # Return the status to be able to generate good HTTP responses. Can
         # be ignored if not needed.
         return stat
 
 
-class Document(models.Model):
+class Document(BlobDataMixin, models.Model):
     """
     A document of a particular type.
 
@@ -177,8 +261,12 @@ class Document(models.Model):
     # The content type of the data. Must be given to be able to provide a
     # reasonable HTTP view of the data.
     content_type = models.CharField(max_length=255)
-    # The actual data as a binary field.
-    data = models.BinaryField(editable=False)
+    # The actual data as a binary field. Empty if the data is kept in the
+    # blob store.
+    data = models.BinaryField(editable=False, null=True)
+    # Compression of the stored data, e.g. 'gzip'. None if uncompressed.
+    encoding = models.CharField(max_length=10, null=True, blank=True,
+                                editable=False)
     # The file's size in bytes.
     filesize = models.IntegerField(editable=False)
     # sha1 hash of the data to avoid duplicates.
@@ -216,15 +304,127 @@ class Document(models.Model):
     format_filesize.short_description = 'File size'
     format_filesize.admin_order_field = 'filesize'
 
+    def set_data(self, data):
+        """
+        Replace the data of the document with uncompressed data. Call
+        ``save()`` afterwards.
+        """
+        self.data = data
+        self.encoding = None
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            facets.update(self.document_type_id,
+                          removed=facets.count_stored_values(
+                              self.indices.all(),
+                              facets.get_facet_keys(self.document_type_id)))
+            result = super().delete(*args, **kwargs)
+        signals.invalidate_document_type(self.document_type_id)
+        return result
+
+    @property
+    def indexing_status(self):
+        """
+        Status of the asynchronous indexing. Documents that have never been
+        queued are indexed upon saving.
+        """
+        try:
+            return self.indexing_job.status
+        except DocumentIndexingJob.DoesNotExist:
+            return DocumentIndexingJob.DONE
+
     def save(self, *args, **kwargs):
         """
         Manually trigger the signals as they are for some reason unreliable
         and for example do not get called when a model is updated.
+
+        An optional ``buffer`` keyword argument can pass a
+        ``jane.documents.signals.DocumentBuffer`` of the uncompressed data,
+        otherwise one is created. Pass ``index=False`` to not index the
+        document, e.g. because it will be indexed by the indexing queue. The
+        time spent in each stage is stored in the ``timings`` attribute and
+        logged.
         """
-        signals.validate_document(sender=None, instance=self)
-        signals.set_document_metadata(sender=None, instance=self)
-        super().save(*args, **kwargs)
-        signals.index_document(sender=None, instance=self, created=None)
+        buffer = kwargs.pop("buffer", None)
+        index = kwargs.pop("index", True)
+        if buffer is None:
+            buffer = signals.DocumentBuffer(self.read_data())
+
+        self.timings = collections.OrderedDict()
+        with _timed(self.timings, "validate"):
+            signals.validate_document(sender=None, instance=self,
+                                      buffer=buffer)
+        with _timed(self.timings, "metadata"):
+            signals.set_document_metadata(sender=None, instance=self,
+                                          buffer=buffer)
+        with _timed(self.timings, "store"):
+            self.encoding = compression.get_encoding()
+            self.data = blobstore.put(
+                blobstore.get_key(buffer.sha1, self.encoding),
+                compression.compress(buffer.data, self.encoding))
+        with _timed(self.timings, "save"):
+            super().save(*args, **kwargs)
+        if index:
+            with _timed(self.timings, "index"):
+                signals.index_document(sender=None, instance=self,
+                                       created=None, buffer=buffer)
+
+        logger.info("Saved document '%s' of type '%s' (%i bytes): %s" % (
+            self.name, self.document_type.name, self.filesize,
+            ", ".join("%s %.3f s" % _i for _i in self.timings.items())))
+
+
+class DocumentIndexingJobManager(models.Manager):
+    def queue(self, document):
+        """
+        Queue a document for indexing. A job that is already queued or
+        running for the document will be reset.
+        """
+        return self.update_or_create(document=document, defaults={
+            "status": DocumentIndexingJob.PENDING,
+            "queued_at": timezone.now(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None})[0]
+
+
+class DocumentIndexingJob(models.Model):
+    """
+    Pending or finished indexing of a document if indexing happens
+    asynchronously.
+
+    See ``JANE_ASYNC_INDEXING`` and ``jane.documents.indexing``.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = ((PENDING, "Pending"), (RUNNING, "Running"),
+                      (DONE, "Done"), (FAILED, "Failed"))
+
+    document = models.OneToOneField(Document, primary_key=True,
+                                    related_name='indexing_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    queued_at = models.DateTimeField(default=timezone.now, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Error message of failed jobs.
+    error = models.TextField(null=True, blank=True)
+    objects = DocumentIndexingJobManager()
+
+    class Meta:
+        ordering = ['queued_at']
+        verbose_name = 'Indexing Job'
+        verbose_name_plural = 'Indexing Jobs'
+
+    def __str__(self):
+        return "%s: %s" % (self.document_id, self.status)
+
+
+# Parameters of get_filtered_queryset() selecting rectangular regions.
+BOUNDING_BOX_KEYS = ("min_latitude", "max_latitude", "min_longitude",
+                     "max_longitude")
 
 
 class DocumentIndexManager(models.GeoManager):
@@ -247,6 +447,14 @@ class DocumentIndexManager(models.GeoManager):
         "UTCDateTime": "CAST(json->>'%s' AS TIMESTAMP)"
     }
 
+    JSON_ORDERING_FIELDS = {
+        "int": models.IntegerField,
+        "float": models.FloatField,
+        "str": models.TextField,
+        "bool": models.BooleanField,
+        "UTCDateTime": models.DateTimeField
+    }
+
     def get_queryset(self):
         queryset = super().get_queryset()
         # improve query performance for foreignkeys
@@ -254,9 +462,6 @@ class DocumentIndexManager(models.GeoManager):
             select_related('document', 'document__document_type')
         # defer data
         queryset = queryset.defer('document__data')
-        # annotate number of attachments
-        queryset = queryset.\
-            annotate(attachments_count=Count('attachments'))
         return queryset
 
     def _get_json_query(self, key, operator, type, value):
@@ -266,16 +471,16 @@ class DocumentIndexManager(models.GeoManager):
         """
         Apply potential additional restrictions based on the permissions.
         """
-        retrieve_permissions = document_type.retrieve_permissions.all()
+        info = registry.get_document_type_info(document_type)
 
         if user is None:
             user = AnonymousUser()
 
-        if retrieve_permissions:
-            for perm in retrieve_permissions:
-                perm = perm.get_plugin()
-                app_label = DocumentType._meta.app_label
-                perm_name = "%s.%s" % (app_label, perm.permission_codename)
+        if info.retrieve_permissions:
+            # Django's authentication backend caches the permissions on the
+            # user object which lives as long as the request.
+            for perm, perm_name in zip(info.retrieve_permissions,
+                                       info.retrieve_permission_names):
                 if user.has_perm(perm_name):
                     queryset = perm.filter_queryset_user_has_permission(
                         queryset, model_type="index", user=user)
@@ -285,12 +490,49 @@ class DocumentIndexManager(models.GeoManager):
                             queryset=queryset, model_type="index", user=user)
         return queryset
 
+    def apply_bounding_box(self, queryset, min_latitude=None,
+                           max_latitude=None, min_longitude=None,
+                           max_longitude=None):
+        """
+        Restrict a queryset to the indices whose location is within a
+        latitude/longitude rectangle. Missing limits are unrestricted.
+
+        A rectangle with a larger minimum than maximum longitude crosses the
+        antimeridian and is split into two envelopes. Both are compared with
+        the spatial index of the locations.
+        """
+        if min_latitude is None and max_latitude is None and \
+                min_longitude is None and max_longitude is None:
+            return queryset
+
+        south = -90.0 if min_latitude is None else float(min_latitude)
+        north = 90.0 if max_latitude is None else float(max_latitude)
+        west = -180.0 if min_longitude is None else float(min_longitude)
+        east = 180.0 if max_longitude is None else float(max_longitude)
+        if south > north:
+            return queryset.none()
+        if west <= east:
+            envelopes = [(west, east)]
+        else:
+            envelopes = [(west, 180.0), (-180.0, east)]
+
+        # ST_Intersects() is the && bounding box comparison which uses the
+        # index plus an exact check of the borders.
+        where = " OR ".join(
+            ["ST_Intersects(%s.location::geometry, "
+             "ST_MakeEnvelope(%%s, %%s, %%s, %%s, 4326))" %
+             self.model._meta.db_table] * len(envelopes))
+        params = [_j for west, east in envelopes
+                  for _j in (west, south, east, north)]
+        return queryset.extra(where=[where], params=params)
+
     def get_distinct_values(self, document_type, json_key):
         """
         Get distinct values for a certain field in the JSON document.
         """
-        res_type = get_object_or_404(DocumentType, name=document_type)
-        meta = res_type.indexer.get_plugin().meta
+        info = registry.get_document_type_info(document_type)
+        res_type = info.document_type
+        meta = info.meta
         if json_key not in meta:
             raise Http404("Key '%s' not in the meta attribute of the '%s' "
                           "resource type." % (json_key, document_type))
@@ -298,6 +540,12 @@ class DocumentIndexManager(models.GeoManager):
         if meta[json_key] != "str":
             raise Http404("Currently only implemented for string index keys")
 
+        # Facet keys are counted whenever indices change.
+        if json_key in info.facets:
+            return list(DocumentIndexFacet.objects.filter(
+                document_type=res_type, key=json_key).values_list(
+                "value", flat=True))
+
         # XXX: I am not sure how to formulate this within Django's ORM...
         # Should be a safe enough query especially with the checks above but
         # one might still want to change it.
@@ -338,7 +586,8 @@ class DocumentIndexManager(models.GeoManager):
             queryset = DocumentIndex.objects
 
         # filter by document type
-        res_type = get_object_or_404(DocumentType, name=document_type)
+        info = registry.get_document_type_info(document_type)
+        res_type = info.document_type
         queryset = queryset.filter(document__document_type=res_type)
 
         queryset = self.apply_retrieve_permission(document_type=res_type,
@@ -347,14 +596,21 @@ class DocumentIndexManager(models.GeoManager):
 
         central_point = 'POINT({lng} {lat})'.format(lng=central_longitude,
                                                     lat=central_latitude)
+        # ST_DWithin() can use the spatial indices in contrast to comparing
+        # the distances. Indices consisting of a single point only have to
+        # be compared to their location, everything else to its geometry.
+        has_location = Q(location__isnull=False)
+        has_other_geometry = Q(location__isnull=True, geometry__isnull=False)
         if min_radius is not None:
+            distance = (central_point, Distance(km=deg2km(min_radius)))
             queryset = queryset.filter(
-                geometry__distance_gt=(central_point,
-                                       Distance(km=deg2km(min_radius))))
+                (has_location & ~Q(location__dwithin=distance)) |
+                (has_other_geometry & ~Q(geometry__dwithin=distance)))
         if max_radius is not None:
+            distance = (central_point, Distance(km=deg2km(max_radius)))
             queryset = queryset.filter(
-                geometry__distance_lt=(central_point,
-                                       Distance(km=deg2km(max_radius))))
+                Q(location__dwithin=distance) |
+                (has_other_geometry & Q(geometry__dwithin=distance)))
         return queryset
 
     def get_filtered_queryset(self, document_type, queryset=None, user=None,
@@ -398,6 +654,11 @@ class DocumentIndexManager(models.GeoManager):
         * Booleans can only be searched for (in)equality.
             ``public=True``
             ``kwargs={"!public": True}``
+        * Minimum and maximum ``latitude`` and ``longitude`` values select
+          the indices whose location is within that rectangle. It crosses
+          the antimeridian if the minimum longitude is larger than the
+          maximum longitude:
+            ``min_longitude=170, max_longitude=-170``
 
         Please note that as soon as you search for a value, all values that
         are null will be discarded from the queryset (even if you search for
@@ -408,19 +669,28 @@ class DocumentIndexManager(models.GeoManager):
             queryset = DocumentIndex.objects
 
         # filter by document type
-        res_type = get_object_or_404(DocumentType, name=document_type)
+        info = registry.get_document_type_info(document_type)
+        res_type = info.document_type
         queryset = queryset.filter(document__document_type=res_type)
 
         queryset = self.apply_retrieve_permission(document_type=res_type,
                                                   queryset=queryset,
                                                   user=user)
 
+        meta = info.meta
+
+        # Rectangles are looked up in the spatial index of the locations
+        # instead of comparing the indexed coordinates.
+        if meta.get("latitude") == "float" and \
+                meta.get("longitude") == "float":
+            queryset = self.apply_bounding_box(queryset, **{
+                _k: kwargs.pop(_k) for _k in BOUNDING_BOX_KEYS
+                if _k in kwargs})
+
         # Nothing to do.
         if not kwargs:
             return queryset
 
-        meta = res_type.indexer.get_plugin().meta
-
         type_map = {
             "str": str,
             "float": float,
@@ -493,9 +763,11 @@ class DocumentIndexManager(models.GeoManager):
 
         if "ordering" in kwargs and kwargs["ordering"] in meta:
             ord = kwargs["ordering"]
-            queryset = queryset.order_by(
-                OrderBy(
-                    RawSQL(self.JSON_ORDERING_TEMPLATE[meta[ord]] % ord, [])))
+            # Annotated so the value is available for keyset pagination.
+            queryset = queryset.annotate(json_ordering=RawSQL(
+                self.JSON_ORDERING_TEMPLATE[meta[ord]] % ord, [],
+                output_field=self.JSON_ORDERING_FIELDS[meta[ord]]()))
+            queryset = queryset.order_by("json_ordering", "pk")
         return queryset
 
 
@@ -507,6 +779,13 @@ class DocumentIndex(models.Model):
     json = jsonb.JSONField(verbose_name="JSON")
     geometry = models.GeometryCollectionField(blank=True, null=True,
                                               geography=True)
+    # The geometry if it is a single point. Radial queries on points are
+    # much faster than on geometry collections.
+    location = models.PointField(blank=True, null=True, geography=True,
+                                 editable=False)
+    # Number of attachments. Kept up to date when attachments are created
+    # or deleted so listing indices does not have to count them.
+    attachments_count = models.IntegerField(default=0, editable=False)
 
     objects = DocumentIndexManager()
 
@@ -548,7 +827,46 @@ class DocumentIndex(models.Model):
     format_index_id.short_description = 'Index ID'
 
 
-class DocumentIndexAttachmentManager(models.Manager):
+class DocumentIndexFacet(models.Model):
+    """
+    Number of indices of a document type with a certain value for one of the
+    facet keys of its indexer. Maintained by ``jane.documents.facets``.
+    """
+    document_type = models.ForeignKey(DocumentType, related_name='facets')
+    key = models.CharField(max_length=255)
+    value = models.TextField()
+    count = models.IntegerField()
+
+    class Meta:
+        ordering = ['document_type', 'key', 'value']
+        unique_together = ['document_type', 'key', 'value']
+        verbose_name = 'Facet'
+        verbose_name_plural = 'Facets'
+
+    def __str__(self):
+        return "%s: %s=%s (%i)" % (self.document_type_id, self.key,
+                                   self.value, self.count)
+
+
+class DocumentIndexAttachmentQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Bulk deletes, e.g. from the admin interface, bypass the model's
+        ``delete()`` method - recount the attachments of the affected
+        indices afterwards.
+        """
+        with transaction.atomic():
+            index_ids = list(self.order_by().values_list(
+                "index_id", flat=True).distinct())
+            result = super().delete()
+            signals.update_attachments_count(index_ids)
+        return result
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class DocumentIndexAttachmentManager(
+        models.Manager.from_queryset(DocumentIndexAttachmentQuerySet)):
     def get_queryset(self):
         queryset = super().get_queryset()
         # improve query performance for foreignkeys
@@ -569,8 +887,8 @@ class DocumentIndexAttachmentManager(models.Manager):
         """
         # Works with strings and DocumentType instances.
         if not isinstance(document_type, DocumentType):
-            document_type = get_object_or_404(
-                DocumentType, name=document_type)
+            document_type = registry.get_document_type_info(
+                document_type).document_type
         document_type_str = document_type.name
 
         # The user in question must have the permission to modify
@@ -611,8 +929,8 @@ class DocumentIndexAttachmentManager(models.Manager):
 
         # Works with strings and DocumentType instances.
         if not isinstance(document_type, DocumentType):
-            document_type = get_object_or_404(
-                DocumentType, name=document_type)
+            document_type = registry.get_document_type_info(
+                document_type).document_type
         document_type_str = document_type.name
 
         # The user in question must have the permission to modify documents
@@ -648,14 +966,19 @@ class DocumentIndexAttachmentManager(models.Manager):
         return stat
 
 
-class DocumentIndexAttachment(models.Model):
+class DocumentIndexAttachment(BlobDataMixin, models.Model):
     """
     Attachments for one Document.
     """
     index = models.ForeignKey(DocumentIndex, related_name='attachments')
     category = models.CharField(max_length=50, db_index=True)
     content_type = models.CharField(max_length=255)
-    data = models.BinaryField()
+    # Empty if the data is kept in the blob store.
+    data = models.BinaryField(null=True)
+    # sha1 hash of the data. Attachments are not unique so this is merely
+    # the key in the blob store.
+    sha1 = models.CharField(max_length=40, db_index=True, editable=False,
+                            null=True)
     # Attachments are almost independent from Documents thus they should
     # have people responsible for them.
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
@@ -675,6 +998,24 @@ class DocumentIndexAttachment(models.Model):
     def __str__(self):
         return str(self.id)
 
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        if self.data is not None:
+            data = bytes(self.data)
+            self.sha1 = hashlib.sha1(data).hexdigest()
+            self.data = blobstore.put(self.sha1, data)
+        super().save(*args, **kwargs)
+        if created:
+            DocumentIndex.objects.filter(pk=self.index_id).update(
+                attachments_count=F("attachments_count") + 1)
+
+    def delete(self, *args, **kwargs):
+        index_id = self.index_id
+        result = super().delete(*args, **kwargs)
+        DocumentIndex.objects.filter(pk=index_id).update(
+            attachments_count=F("attachments_count") - 1)
+        return result
+
     def verbose_name(self):
         return str(self.data)
 
@@ -689,6 +1030,6 @@ class DocumentIndexAttachment(models.Model):
     format_attachment_id.short_description = 'Attachment ID'
 
     def format_filesize(self):
-        return filesizeformat(len(self.data))
+        return filesizeformat(self.stored_size())
     format_filesize.short_description = 'File size'
     format_filesize.admin_order_field = 'filesize'
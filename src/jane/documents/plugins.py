@@ -54,6 +54,36 @@ class IndexerPluginPoint(PluginPoint):
     def keys(self):
         return self.meta.keys()
 
+    # Keys of the indices which together identify an index across
+    # different versions of a document, e.g. the id of an event. If given,
+    # modified documents only update the changed indices and keep the
+    # others including their ids and attachments. Otherwise all indices
+    # are recreated.
+    identity_keys = None
+
+    # String keys whose distinct values and their number of occurrences are
+    # maintained in a separate table, e.g. for faceted search. Only useful
+    # for keys with a limited number of different values.
+    facets = None
+
+    # Attachments which are not stored while indexing but rendered upon
+    # request, e.g. plots. Maps each category to its content type.
+    on_demand_attachments = {}
+
+    def render_attachment(self, category, document, index):
+        """
+        Render an on-demand attachment for a single index.
+
+        :param category: The category of the attachment. One of the keys of
+            ``on_demand_attachments``.
+        :param document: The data of the document as a file-like object.
+        :param index: The indexed values of the index as a dictionary.
+
+        Must return the attachment as a byte string. Runs in a separate
+        process so it must not access the database.
+        """
+        raise NotImplementedError
+
 
 class RetrievePermissionPluginPoint(PluginPoint):
     """
@@ -93,7 +123,7 @@ def initialize_plugins():
     """
     # Import in here to avoid importing models when setup for this app is
     # called.
-    from jane.documents import models
+    from jane.documents import models, registry
 
     # Get all subclasses of PluginPoint defined in this module.
     current_module = sys.modules[__name__]
@@ -213,3 +243,6 @@ def initialize_plugins():
                 name=perm["name"],
                 content_type=content_type)
         p.save()
+
+    # Look up the document types and their plugins only once.
+    registry.build()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of the document types and their plugins.
+
+Document types only change when the plugins are initialized, looking them
+and their plugins up in the database for every query is thus wasteful. The
+registry is built once and cleared whenever a document type is saved or
+deleted.
+"""
+import collections
+
+from django.http import Http404
+
+
+DocumentTypeInfo = collections.namedtuple("DocumentTypeInfo", [
+    # The jane.documents.models.DocumentType instance.
+    "document_type",
+    # Instances of the plugins.
+    "definition",
+    "indexer",
+    "validators",
+    "retrieve_permissions",
+    "upload_permissions",
+    # The meta and facets attributes of the indexer.
+    "meta",
+    "facets",
+    # Full names of the retrieve permissions as passed to user.has_perm().
+    "retrieve_permission_names"])
+
+
+_registry = None
+
+
+def _build():
+    # Avoid circular imports.
+    from jane.documents import models
+
+    app_label = models.DocumentType._meta.app_label
+    registry = {}
+    for document_type in models.DocumentType.objects.select_related(
+            "definition", "indexer").prefetch_related(
+            "validators", "retrieve_permissions", "upload_permissions"):
+        indexer = document_type.indexer.get_plugin()
+        retrieve_permissions = [
+            _i.get_plugin() for _i in document_type.retrieve_permissions.all()]
+        registry[document_type.name] = DocumentTypeInfo(
+            document_type=document_type,
+            definition=document_type.definition.get_plugin(),
+            indexer=indexer,
+            validators=[_i.get_plugin()
+                        for _i in document_type.validators.all()],
+            retrieve_permissions=retrieve_permissions,
+            upload_permissions=[
+                _i.get_plugin()
+                for _i in document_type.upload_permissions.all()],
+            meta=indexer.meta,
+            facets=tuple(indexer.facets or ()),
+            retrieve_permission_names=[
+                "%s.%s" % (app_label, _i.permission_codename)
+                for _i in retrieve_permissions])
+    return registry
+
+
+def build():
+    """
+    (Re)build the registry from the database.
+    """
+    global _registry
+    _registry = _build()
+    return _registry
+
+
+def clear():
+    """
+    Clear the registry. It will be rebuilt upon the next access.
+    """
+    global _registry
+    _registry = None
+
+
+def get_registry():
+    """
+    Dictionary mapping the names of all document types to their
+    DocumentTypeInfo.
+    """
+    registry = _registry
+    if registry is None:
+        registry = build()
+    return registry
+
+
+def get_document_type_info(document_type):
+    """
+    Get the DocumentTypeInfo of a document type.
+
+    :param document_type: The document type either as a
+        jane.documents.models.DocumentType instance or its name.
+
+    Raises Http404 if the document type does not exist.
+    """
+    name = getattr(document_type, "name", document_type)
+    registry = _registry
+    # Might have been created by another process.
+    if registry is None or name not in registry:
+        registry = build()
+    if name not in registry:
+        raise Http404("No document type '%s'." % name)
+    return registry[name]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Rendering of on-demand attachments.
+
+Indexers can declare attachments that are too expensive to create for every
+index while indexing, e.g. plots. These are rendered upon the first request,
+by default within the requesting process, and then kept in Django's cache.
+"""
+import concurrent.futures
+import io
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a single attachment to be rendered.
+RENDER_TIMEOUT = 120
+
+_lock = threading.Lock()
+_executor = None
+# Renders in progress, shared between concurrent requests for the same
+# attachment.
+_in_flight = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=settings.JANE_ATTACHMENT_RENDER_PROCESSES)
+    return _executor
+
+
+def _render(indexer_class, category, data, index):
+    """
+    Runs in the worker processes.
+    """
+    with io.BytesIO(data) as buf:
+        return indexer_class().render_attachment(category, buf, index)
+
+
+def get_cache_key(index, category):
+    # The hash invalidates the cache once the document changes.
+    return "rendered_attachment_%s_%i_%s" % (index.document.sha1, index.pk,
+                                             category)
+
+
+def get_rendered_attachment(indexer, index, category):
+    """
+    Get an on-demand attachment from the cache or render it.
+
+    :param indexer: The indexer plugin of the document type.
+    :param index: The ``jane.documents.models.DocumentIndex`` object.
+    :param category: The category of the attachment.
+
+    Returns the attachment as a byte string or None if it could not be
+    rendered.
+    """
+    global _executor
+
+    key = get_cache_key(index, category)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    args = (type(indexer), category, index.document.read_data(), index.json)
+    try:
+        if not settings.JANE_ATTACHMENT_RENDER_PROCESSES:
+            data = _render(*args)
+        else:
+            with _lock:
+                future = _in_flight.get(key)
+                if future is None:
+                    future = _get_executor().submit(_render, *args)
+                    _in_flight[key] = future
+                    future.add_done_callback(
+                        lambda _: _in_flight.pop(key, None))
+            data = future.result(timeout=RENDER_TIMEOUT)
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died - start a new pool for the next request.
+        logger.exception("Attachment rendering process died while rendering "
+                         "'%s' of index %i." % (category, index.pk))
+        with _lock:
+            _executor = None
+        return None
+    except Exception:
+        logger.exception("Could not render attachment '%s' of index %i." % (
+            category, index.pk))
+        return None
+
+    cache.set(key, data, settings.JANE_ATTACHMENT_RENDER_CACHE_TIMEOUT)
+    return data
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
-from jane.documents import models
+from jane.documents import models, registry
 
 
 class DocumentTypeHyperlinkedIdentifyField(
@@ -32,13 +33,15 @@ class DocumentTypeHyperlinkedIdentifyField(
             lookup_value = getattr(lookup_value, lookups.pop(0))
         kwargs = {self.lookup_url_kwarg: lookup_value}
 
-        # Deal with documents as well as indices and attachments.
-        if hasattr(obj, "document_type"):
-            kwargs["document_type"] = obj.document_type.name
-        elif hasattr(obj, "document"):
-            kwargs["document_type"] = obj.document.document_type.name
+        # Deal with documents as well as indices and attachments. The name
+        # of a document type is its primary key so it is known without
+        # fetching the document type.
+        if hasattr(obj, "document_type_id"):
+            kwargs["document_type"] = obj.document_type_id
+        elif hasattr(obj, "document_id"):
+            kwargs["document_type"] = obj.document.document_type_id
         else:
-            kwargs["document_type"] = obj.index.document.document_type.name
+            kwargs["document_type"] = obj.index.document.document_type_id
             kwargs["idx"] = obj.index_id
 
         url = self.reverse(view_name, kwargs=kwargs, request=request,
@@ -110,6 +113,21 @@ class DocumentIndexSerializer(serializers.ModelSerializer):
 
     attachments_count = serializers.IntegerField()
 
+    rendered_attachments = serializers.SerializerMethodField()
+
+    def get_rendered_attachments(self, obj):
+        """
+        Links to the attachments the indexer renders upon request.
+        """
+        document_type = obj.document.document_type_id
+        indexer = registry.get_document_type_info(document_type).indexer
+        return {_i: reverse(
+            "rendered_attachment_data",
+            kwargs={"document_type": document_type, "idx": obj.pk,
+                    "category": _i},
+            request=self.context.get("request"))
+            for _i in sorted(indexer.on_demand_attachments.keys())}
+
     class Meta:
         model = models.DocumentIndex
         fields = [
@@ -122,6 +140,7 @@ class DocumentIndexSerializer(serializers.ModelSerializer):
             'geometry',
             'attachments_url',
             'attachments_count',
+            'rendered_attachments',
         ]
 
 
@@ -139,6 +158,8 @@ class DocumentSerializer(serializers.ModelSerializer):
     created_by = serializers.CharField(source="created_by.username")
     modified_by = serializers.CharField(source="modified_by.username")
 
+    indexing_status = serializers.CharField(read_only=True)
+
     indices = DocumentIndexSerializer(many=True)
 
     class Meta:
@@ -156,5 +177,6 @@ class DocumentSerializer(serializers.ModelSerializer):
             'modified_at',
             'created_by',
             'modified_by',
+            'indexing_status',
             'indices'
         ]
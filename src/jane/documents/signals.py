@@ -5,94 +5,406 @@ Signals - all are called directly from within an overwritten save() method.
 Otherwise they do not get reliably triggered during a model update for example.
 """
 
+import collections
 import hashlib
 import io
+import itertools
+import json
+import uuid
 
 from django.core.cache import cache
 from django.contrib.gis.geos.collections import GeometryCollection
+from django.db import connection, transaction
 
-from jane.documents import JaneDocumentsValidationException
+from jane.documents import (JaneDocumentsValidationException, blobstore,
+                            facets, registry)
+
+
+# Number of indices or attachments written per INSERT statement.
+INSERT_BATCH_SIZE = 1000
+
+# Cache key of the generation of each document type.
+GENERATION_KEY = "document_type_generation_%s"
+
+
+class DocumentBuffer(object):
+    """
+    The data of a document shared by all stages of saving it.
+
+    The data is only converted to bytes once and the sha1 hash is computed
+    at most once.
+    """
+    def __init__(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        self.data = data
+        # Read-only view to pass the data around without copying it.
+        self.view = memoryview(data)
+        self._sha1 = None
+
+    def __len__(self):
+        return len(self.view)
+
+    @property
+    def sha1(self):
+        if self._sha1 is None:
+            self._sha1 = hashlib.sha1(self.view).hexdigest()
+        return self._sha1
+
+    def open(self):
+        """
+        File-like object for the validators and indexers. Does not copy the
+        data as long as nothing writes to it.
+        """
+        return io.BytesIO(self.data)
+
+
+def _get_buffer(instance, buffer):
+    if buffer is None:
+        buffer = DocumentBuffer(instance.read_data())
+    return buffer
 
 
 # @receiver(pre_save, sender=models.Document)
-def validate_document(sender, instance, **kwargs):
+def validate_document(sender, instance, buffer=None, **kwargs):
     """
     Validate document before saving using validators of specified document type
     """
-    plugins = instance.document_type.validators.all()
+    plugins = registry.get_document_type_info(
+        instance.document_type_id).validators
     if not plugins:
         raise Exception("At least one ValidatorPlugin must be defined for "
                         "document type '%s'." %
-                        instance.document_type.name)
-    with io.BytesIO(bytes(instance.data)) as data:
+                        instance.document_type_id)
+    with _get_buffer(instance, buffer).open() as data:
         for plugin in plugins:
             data.seek(0, 0)
             # raise if not valid
-            if not plugin.get_plugin().validate(data):
+            if not plugin.validate(data):
                 raise JaneDocumentsValidationException(
                     "Not a valid document of type %s." %
-                    instance.document_type.name)
+                    instance.document_type_id)
 
 
 # @receiver(pre_save, sender=models.Document)
-def set_document_metadata(sender, instance, **kwargs):
+def set_document_metadata(sender, instance, buffer=None, **kwargs):
     # If not set, use the default content type for that particular document
     # type.
     if not instance.content_type:
-        instance.content_type = \
-            instance.document_type.definition.get_plugin().default_content_type
+        instance.content_type = registry.get_document_type_info(
+            instance.document_type_id).definition.default_content_type
 
     # Set the filesize and calculate the hash. No need to check the hash as
     # the database constraints will enforce its uniqueness.
-    instance.filesize = len(instance.data)
-    instance.sha1 = hashlib.sha1(instance.data).hexdigest()
+    buffer = _get_buffer(instance, buffer)
+    instance.filesize = len(buffer)
+    instance.sha1 = buffer.sha1
 
 
-# @receiver(post_save, sender=models.Document)
-def index_document(sender, instance, created, **kwargs):  # @UnusedVariable
+def reserve_ids(model, count):
     """
-    Index data
+    Reserve primary keys from the sequence of a model's table.
+
+    ``bulk_create()`` does not return the primary keys of the created rows
+    so they are assigned upfront.
+    """
+    if not count:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+            "FROM generate_series(1, %s)", [model._meta.db_table, count])
+        return [_i[0] for _i in cursor.fetchall()]
+
+
+def _build_attachments(index_id, attachments, created_by_id,
+                       modified_by_id):
+    """
+    Attachment objects for the ``attachments`` of an index as created by the
+    indexers.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    objs = []
+    for key, value in (attachments or {}).items():
+        data = value['data']
+        if hasattr(data, 'seek'):
+            data.seek(0)
+            data = data.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        objs.append(models.DocumentIndexAttachment(
+            index_id=index_id, category=key,
+            content_type=value['content-type'], sha1=sha1,
+            data=blobstore.put(sha1, data),
+            created_by_id=created_by_id, modified_by_id=modified_by_id))
+    return objs
+
+
+def bulk_create_attachments(index_id, attachments, created_by_id,
+                            modified_by_id):
+    """
+    Write the attachments of a single index as created by the indexers.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    models.DocumentIndexAttachment.objects.bulk_create(_build_attachments(
+        index_id, attachments, created_by_id=created_by_id,
+        modified_by_id=modified_by_id))
+
+
+def update_attachments_count(index_ids):
+    """
+    Recount the attachments of the given indices, e.g. after attachments
+    have been created or deleted without going through the model's
+    ``save()`` and ``delete()`` methods.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    index_ids = list(index_ids)
+    if not index_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE {index} SET attachments_count = ("
+            "SELECT COUNT(*) FROM {attachment} "
+            "WHERE {attachment}.index_id = {index}.id) "
+            "WHERE {index}.id = ANY(%s)".format(
+                index=models.DocumentIndex._meta.db_table,
+                attachment=models.DocumentIndexAttachment._meta.db_table),
+            [index_ids])
+
+
+def _get_geometry(geometry):
+    """
+    The geometry collection of the geometries of an index and the point
+    used for radial queries if the geometry is a single point.
+    """
+    if not geometry:
+        return None, None
+    geometry = GeometryCollection(geometry)
+    location = None
+    if len(geometry) == 1 and geometry[0].geom_type == "Point":
+        location = geometry[0].clone()
+    return geometry, location
+
+
+def bulk_create_indices(items, modified_by_id, document_type_id=None):
+    """
+    Write the indices created by an indexer and their attachments with a
+    few INSERT statements.
+
+    :param items: Iterable of ``(document_id, created_by_id, index)``
+        tuples. ``index`` is a dictionary as returned by the indexers.
+        Consumed in chunks so generators work with bounded memory.
+    :param modified_by_id: The id of the user responsible for the action.
+    :param document_type_id: The name of the document type of all the
+        documents. If given, its facets are updated.
+
+    Returns the number of created indices.
+    """
+    # Avoid circular imports.
+    from jane.documents import models
+
+    facet_keys = ()
+    if document_type_id is not None:
+        facet_keys = facets.get_facet_keys(document_type_id)
+
+    count = 0
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, INSERT_BATCH_SIZE))
+        if not chunk:
+            break
+        if facet_keys:
+            facets.update(document_type_id, added=facets.count_values(
+                (_i[2] for _i in chunk), facet_keys))
+        indices = []
+        attachments = []
+        ids = reserve_ids(models.DocumentIndex, len(chunk))
+        for pk, (document_id, created_by_id, index) in zip(ids, chunk):
+            index = dict(index)
+            index_attachments = index.pop("attachments", None)
+            geometry = index.pop("geometry", None)
+            index_attachments = _build_attachments(
+                pk, index_attachments, created_by_id=created_by_id,
+                modified_by_id=modified_by_id)
+            obj = models.DocumentIndex(
+                id=pk, document_id=document_id, json=index,
+                attachments_count=len(index_attachments))
+            obj.geometry, obj.location = _get_geometry(geometry)
+            indices.append(obj)
+            attachments.extend(index_attachments)
+        models.DocumentIndex.objects.bulk_create(indices)
+        models.DocumentIndexAttachment.objects.bulk_create(
+            attachments, batch_size=INSERT_BATCH_SIZE)
+        count += len(indices)
+    return count
+
+
+def _get_identity(index, identity_keys):
+    """
+    The identity of an index or None if any of the keys is missing.
+    """
+    if any(index.get(_i) is None for _i in identity_keys):
+        return None
+    return tuple(index[_i] for _i in identity_keys)
+
+
+def _update_indices(instance, indices, identity_keys):
+    """
+    Only insert, update, and delete the indices that changed.
+
+    Returns the number of inserted, updated, deleted, and unchanged indices
+    or None if the indices cannot be matched, e.g. due to duplicate or
+    missing identity keys.
     """
     # Avoid circular imports.
     from jane.documents import models
 
-    # delete all existing indexed data
-    instance.indices.all().delete()
-    indexer = instance.document_type.indexer.get_plugin()
+    existing = {}
+    # The base manager skips the joins of the default one.
+    for pk, json_data, geometry in models.DocumentIndex._base_manager.filter(
+            document=instance).values_list("id", "json", "geometry"):
+        key = _get_identity(json_data, identity_keys)
+        if key is None or key in existing:
+            return None
+        existing[key] = (pk, json_data, geometry)
+
+    new = collections.OrderedDict()
+    for index in indices:
+        key = _get_identity(index, identity_keys)
+        if key is None or key in new:
+            return None
+        new[key] = index
+
+    counts = collections.OrderedDict(
+        [("inserted", 0), ("updated", 0), ("deleted", 0), ("unchanged", 0)])
+    replaced_attachments = []
+    facet_keys = facets.get_facet_keys(instance.document_type_id)
+    added_values = []
+    removed_values = []
+
+    deleted = [value[0] for key, value in existing.items() if key not in new]
+    removed_values.extend(
+        value[1] for key, value in existing.items() if key not in new)
+    if deleted:
+        models.DocumentIndex.objects.filter(pk__in=deleted).delete()
+    counts["deleted"] = len(deleted)
+
+    inserted = []
+    for key, index in new.items():
+        if key not in existing:
+            inserted.append(index)
+            continue
+        pk, old_json, old_geometry = existing[key]
+
+        index = dict(index)
+        attachments = index.pop("attachments", None)
+        geometry, location = _get_geometry(index.pop("geometry", None))
+        # Round trip to get the same types as stored in the database.
+        index = json.loads(json.dumps(index))
+
+        if index == old_json and (
+                geometry == old_geometry if geometry and old_geometry
+                else not geometry and not old_geometry):
+            counts["unchanged"] += 1
+        else:
+            models.DocumentIndex.objects.filter(pk=pk).update(
+                json=index, geometry=geometry, location=location)
+            counts["updated"] += 1
+            removed_values.append(old_json)
+            added_values.append(index)
+
+        # Attachments created by the indexer replace the existing ones of
+        # the same category. All others are kept.
+        if attachments:
+            models.DocumentIndexAttachment.objects.filter(
+                index_id=pk, category__in=list(attachments.keys())).delete()
+            bulk_create_attachments(
+                pk, attachments, created_by_id=instance.created_by_id,
+                modified_by_id=instance.modified_by_id)
+            replaced_attachments.append(pk)
+    update_attachments_count(replaced_attachments)
+    facets.update(instance.document_type_id,
+                  added=facets.count_values(added_values, facet_keys),
+                  removed=facets.count_values(removed_values, facet_keys))
+
+    counts["inserted"] = bulk_create_indices(
+        ((instance.pk, instance.created_by_id, _i) for _i in inserted),
+        modified_by_id=instance.modified_by_id,
+        document_type_id=instance.document_type_id)
+    return counts
+
+
+# @receiver(post_save, sender=models.Document)
+def index_document(sender, instance, created, buffer=None,
+                   **kwargs):  # @UnusedVariable
+    """
+    Index data
+
+    Stores the number of inserted, updated, deleted, and unchanged indices
+    in the ``index_counts`` attribute of the instance.
+    """
+    indexer = registry.get_document_type_info(
+        instance.document_type_id).indexer
     # index data
-    with io.BytesIO(bytes(instance.data)) as data:
+    with _get_buffer(instance, buffer).open() as data:
         indices = indexer.index(data)
-        for index in indices:
-            # attachments
-            attachments = index.get('attachments')
-            try:
-                del index['attachments']
-            except:
-                pass
-            # geometry
-            geometry = index.get('geometry')
-            try:
-                del index['geometry']
-            except:
-                pass
-            # add index
-            obj = models.DocumentIndex(document=instance, json=index)
-            if geometry:
-                obj.geometry = GeometryCollection(geometry)
-            obj.save()
-            # add attachments
-            if attachments:
-                for key, value in attachments.items():
-                    data = value['data']
-                    if hasattr(data, 'seek'):
-                        data.seek(0)
-                        data = data.read()
-                    models.DocumentIndexAttachment(
-                        index=obj, category=key,
-                        content_type=value['content-type'],
-                        data=data,
-                        created_by=instance.created_by,
-                        modified_by=instance.modified_by,
-                    ).save()
+
+        counts = None
+        # Modified documents only update the changed indices if possible.
+        if indexer.identity_keys and instance.indices.exists():
+            indices = list(indices)
+            counts = _update_indices(instance, indices,
+                                     indexer.identity_keys)
+
+        if counts is None:
+            # delete all existing indexed data
+            facets.update(instance.document_type_id,
+                          removed=facets.count_stored_values(
+                              instance.indices.all(), facets.get_facet_keys(
+                                  instance.document_type_id)))
+            deleted = instance.indices.all().delete()[1].get(
+                "documents.DocumentIndex", 0)
+            counts = collections.OrderedDict([
+                ("inserted", bulk_create_indices(
+                    ((instance.pk, instance.created_by_id, _i)
+                     for _i in indices),
+                    modified_by_id=instance.modified_by_id,
+                    document_type_id=instance.document_type_id)),
+                ("updated", 0), ("deleted", deleted), ("unchanged", 0)])
+    instance.index_counts = counts
     # invalidate cache
     cache.delete('record_list_json')
+    invalidate_document_type(instance.document_type_id)
+
+
+def get_document_type_generation(document_type):
+    """
+    Token that changes whenever documents of a certain type are modified.
+    Part of the keys of cached query results to invalidate them.
+
+    A random token instead of a counter ensures evicted generations can
+    never be confused with earlier ones.
+    """
+    key = GENERATION_KEY % document_type
+    generation = cache.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        # Another process might have been faster.
+        if not cache.add(key, generation, None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def invalidate_document_type(document_type):
+    """
+    Start a new generation of a document type once the current transaction
+    commits. Queries running before that still see the old documents and
+    must not cache their results under the new generation.
+    """
+    transaction.on_commit(lambda: cache.set(
+        GENERATION_KEY % document_type, uuid.uuid4().hex, None))
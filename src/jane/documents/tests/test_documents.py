@@ -1,19 +1,61 @@
 # -*- coding: utf-8 -*-
+import base64
+import datetime
+import gzip
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
 import django
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos.point import Point
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from jane.documents import blobstore, indexing, ingest, registry, signals
+from jane.documents.models import (Document, DocumentIndex,
+                                   DocumentIndexAttachment,
+                                   DocumentIndexFacet, DocumentIndexingJob)
 from jane.documents.plugins import initialize_plugins
+from jane.exceptions import JaneNotAuthorizedException
+from jane.quakeml.plugins import QuakeMLIndexerPlugin
 
 
 django.setup()
 
 
+# The generic document handling is tested with the QuakeML plugin.
+PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    __file__))), "quakeml", "tests", "data")
+FILES = {
+    "usgs": os.path.join(PATH, 'usgs_event.xml'),
+    "focmec": os.path.join(PATH, 'quakeml_1.2_focalmechanism.xml'),
+    "private": os.path.join(PATH, "private_event.xml")
+}
+
+
 class JaneDocumentsTestCase(TestCase):
     def setUp(self):
         # The test case class somehow messes with the plugins - thus we have
         # to initialize them all the time.
         initialize_plugins()
 
+        self.user = User.objects.get_or_create(
+            username='random', password=make_password('random'))[0]
+
+        self.can_modify_quakeml_permission = \
+            Permission.objects.filter(codename='can_modify_quakeml').first()
+
+        credentials = base64.b64encode(b'random:random')
+        self.valid_auth_headers = {
+            'HTTP_AUTHORIZATION': 'Basic ' + credentials.decode("ISO-8859-1")
+        }
+
     def test_rest_root_view(self):
         r = self.client.get("/rest")
         self.assertEqual(r.status_code, 200)
@@ -57,3 +99,512 @@ class JaneDocumentsTestCase(TestCase):
              'description': "StationXML Plugin for Jane's Document Database",
              'document_type': 'stationxml',
              'url': 'http://testserver/rest/documents/stationxml'}])
+
+    def test_registry(self):
+        # Filled by initialize_plugins() so no further queries are needed.
+        with self.assertNumQueries(0):
+            info = registry.get_document_type_info("quakeml")
+            queryset = DocumentIndex.objects.get_filtered_queryset(
+                document_type="quakeml", user=AnonymousUser(), magnitude=1)
+        self.assertEqual(info.document_type.name, "quakeml")
+        self.assertEqual(info.indexer.name, "quakeml")
+        self.assertEqual(info.retrieve_permission_names,
+                         ["documents.can_see_private_events"])
+        self.assertEqual(queryset.count(), 0)
+
+        with self.assertRaises(Http404):
+            registry.get_document_type_info("bogus")
+
+        # Saving a document type clears the registry.
+        info.document_type.save()
+        self.assertIsNot(registry.get_document_type_info("quakeml"), info)
+        self.assertEqual(sorted(registry.get_registry()),
+                         ["quakeml", "stationxml"])
+
+    def test_bulk_ingest(self):
+        files = [FILES["usgs"], FILES["focmec"]]
+        with self.assertRaises(JaneNotAuthorizedException):
+            ingest.bulk_ingest("quakeml", self.user, files, processes=1)
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        user = User.objects.get(pk=self.user.pk)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            progress_file = os.path.join(tmpdir, "progress.txt")
+            summary = ingest.bulk_ingest("quakeml", user, files, processes=1,
+                                         progress_file=progress_file)
+            self.assertEqual(summary.succeeded, 2)
+            self.assertEqual(summary.failed, [])
+            self.assertEqual(summary.skipped, 0)
+            self.assertEqual(summary.indices, 3)
+
+            # Resuming skips the already uploaded files.
+            summary = ingest.bulk_ingest("quakeml", user, files, processes=1,
+                                         progress_file=progress_file)
+            self.assertEqual(summary.succeeded, 0)
+            self.assertEqual(summary.skipped, 2)
+
+        # Same indices as with a normal upload.
+        self.assertEqual(Document.objects.count(), 2)
+        indices = DocumentIndex.objects.filter(
+            document__name="usgs_event.xml")
+        expected = list(QuakeMLIndexerPlugin().index(FILES["usgs"]))
+        for index in expected:
+            index.pop("geometry")
+        self.assertEqual([_i.json for _i in indices], expected)
+        self.assertEqual(indices[0].geometry.coords[0],
+                         (-117.6623333, 35.0476667))
+
+        # Duplicates and invalid files are rejected.
+        summary = ingest.bulk_ingest(
+            "quakeml", user, [FILES["usgs"], __file__], processes=1)
+        self.assertEqual(summary.succeeded, 0)
+        self.assertEqual(
+            sorted(_i[0] for _i in summary.failed),
+            sorted(os.path.abspath(_i) for _i in [FILES["usgs"], __file__]))
+
+    def test_data_is_hashed_once(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            data = fh.read()
+
+        with mock.patch("jane.documents.signals.hashlib.sha1",
+                        wraps=hashlib.sha1) as p:
+            Document.objects.add_or_modify_document(
+                document_type="quakeml", name="quake.xml", data=data,
+                user=self.user)
+        self.assertEqual(p.call_count, 1)
+
+        doc = Document.objects.get(name="quake.xml")
+        self.assertEqual(doc.sha1, hashlib.sha1(data).hexdigest())
+        self.assertEqual(doc.filesize, len(data))
+        self.assertEqual(DocumentIndex.objects.count(), 2)
+
+        # Saving directly works as well and records the time of each stage.
+        doc.data = bytes(doc.data)
+        doc.save()
+        self.assertEqual(list(doc.timings.keys()),
+                         ["validate", "metadata", "save", "index"])
+
+    def test_indices_are_inserted_in_bulk(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            Document.objects.add_or_modify_document(
+                document_type="quakeml", name="quake.xml", data=fh.read(),
+                user=self.user)
+        doc = Document.objects.get(name="quake.xml")
+
+        indices = ({"quakeml_id": "smi:local/%i" % _i,
+                    "geometry": [Point(_i % 180, 0)],
+                    "attachments": {"note": {"content-type": "text/plain",
+                                             "data": b"a"}}}
+                   for _i in range(2500))
+        # Id reservation plus one INSERT for the indices and one for the
+        # attachments per chunk of 1000 indices.
+        with self.assertNumQueries(9):
+            count = signals.bulk_create_indices(
+                ((doc.pk, doc.created_by_id, _i) for _i in indices),
+                modified_by_id=self.user.pk)
+        self.assertEqual(count, 2500)
+        self.assertEqual(doc.indices.count(), 2502)
+        index = DocumentIndex.objects.get(json__quakeml_id="smi:local/7")
+        self.assertEqual(index.geometry.coords[0], (7.0, 0.0))
+        self.assertEqual(bytes(index.attachments.get().data), b"a")
+
+    def test_incremental_reindexing(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            data = fh.read()
+        Document.objects.add_or_modify_document(
+            document_type="quakeml", name="quake.xml", data=data,
+            user=self.user)
+        ids = {_i.json["agency"]: _i.pk for _i in DocumentIndex.objects.all()}
+        DocumentIndexAttachment(
+            index_id=ids["ci"], category="note", content_type="text/plain",
+            data=b"a", created_by=self.user, modified_by=self.user).save()
+
+        # Only the changed event is updated - ids and attachments are kept.
+        doc = Document.objects.get(name="quake.xml")
+        doc.data = data.replace(b"<value>1.54</value>", b"<value>2.54</value>")
+        doc.save()
+        self.assertEqual(doc.index_counts, {
+            "inserted": 0, "updated": 1, "deleted": 0, "unchanged": 1})
+        self.assertEqual(
+            {_i.json["agency"]: _i.pk for _i in DocumentIndex.objects.all()},
+            ids)
+        self.assertEqual(
+            DocumentIndex.objects.get(pk=ids["ci"]).json["magnitude"], 2.54)
+        self.assertEqual(DocumentIndexAttachment.objects.filter(
+            index_id=ids["ci"]).count(), 1)
+
+        # Completely different events.
+        with open(FILES["focmec"], "rb") as fh:
+            doc.data = fh.read()
+        doc.save()
+        self.assertEqual(doc.index_counts, {
+            "inserted": 1, "updated": 0, "deleted": 2, "unchanged": 0})
+        self.assertEqual(DocumentIndexAttachment.objects.count(), 0)
+
+    @override_settings(JANE_ASYNC_INDEXING=True)
+    def test_async_indexing(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            r = self.client.put("/rest/documents/quakeml/quake.xml",
+                                data=fh.read(), **self.valid_auth_headers)
+        # Stored but not yet indexed.
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertEqual(DocumentIndex.objects.count(), 0)
+        r = self.client.get("/rest/documents/quakeml/quake.xml")
+        self.assertEqual(r.json()["indexing_status"], "pending")
+
+        job_ids = indexing.get_pending_jobs()
+        self.assertEqual(len(job_ids), 1)
+        self.assertEqual(indexing.run_job(job_ids[0]), "done")
+        # Already processed.
+        self.assertEqual(indexing.run_job(job_ids[0]), None)
+        self.assertEqual(indexing.get_pending_jobs(), [])
+
+        self.assertEqual(DocumentIndex.objects.count(), 2)
+        r = self.client.get("/rest/documents/quakeml/quake.xml")
+        self.assertEqual(r.json()["indexing_status"], "done")
+
+    @override_settings(JANE_ASYNC_INDEXING=True)
+    def test_requeue_stale_indexing_jobs(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            self.client.put("/rest/documents/quakeml/quake.xml",
+                            data=fh.read(), **self.valid_auth_headers)
+        # Claimed by a worker that crashed afterwards.
+        job = DocumentIndexingJob.objects.get()
+        job.status = DocumentIndexingJob.RUNNING
+        job.started_at = timezone.now() - datetime.timedelta(hours=2)
+        job.save()
+        self.assertEqual(indexing.get_pending_jobs(), [])
+
+        # Still within the timeout.
+        self.assertEqual(indexing.requeue_stale_jobs(timeout=3 * 3600), 0)
+        self.assertEqual(indexing.requeue_stale_jobs(timeout=3600), 1)
+        self.assertEqual(indexing.get_pending_jobs(), [job.pk])
+        self.assertEqual(indexing.run_job(job.pk), "done")
+        self.assertEqual(DocumentIndex.objects.count(), 2)
+
+    def test_blob_store(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            data = fh.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(
+                JANE_BLOB_STORE={
+                    "BACKEND": "jane.documents.blobstore.FileSystemBlobStore",
+                    "OPTIONS": {"location": tmpdir}}):
+            Document.objects.add_or_modify_document(
+                document_type="quakeml", name="quake.xml", data=data,
+                user=self.user)
+            doc = Document.objects.get(name="quake.xml")
+            self.assertTrue(doc.in_blob_store)
+            self.assertEqual(DocumentIndex.objects.count(), 2)
+            path = os.path.join(tmpdir, sha1[:2], sha1[2:4], sha1)
+            with open(path, "rb") as fh:
+                self.assertEqual(fh.read(), data)
+
+            r = self.client.get("/rest/documents/quakeml/quake.xml/data")
+            self.assertEqual(r["Content-Length"], str(len(data)))
+            self.assertEqual(b"".join(r.streaming_content), data)
+
+            # Storing an existing blob again protects it from being
+            # collected before the new reference is committed.
+            os.utime(path, (0, 0))
+            blobstore.get_blob_store().save(sha1, data)
+            self.assertGreater(os.path.getmtime(path), 0)
+
+            # The blob stays until it is collected.
+            doc.delete()
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(blobstore.collect_garbage(min_age=0), 1)
+            self.assertFalse(os.path.exists(path))
+
+    def test_ranged_and_conditional_downloads(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["focmec"], "rb") as fh:
+            data = fh.read()
+        self.client.put("/rest/documents/quakeml/quake.xml",
+                        data=data, **self.valid_auth_headers)
+        path = "/rest/documents/quakeml/quake.xml/data"
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+
+        r = self.client.get(path)
+        self.assertEqual(r["ETag"], etag)
+        self.assertEqual(r["Accept-Ranges"], "bytes")
+        self.assertEqual(r["Content-Length"], str(len(data)))
+
+        r = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+        r = self.client.get(path, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(r.status_code, 200)
+
+        r = self.client.get(path, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r["Content-Range"], "bytes 10-19/%i" % len(data))
+        self.assertEqual(b"".join(r.streaming_content), data[10:20])
+
+        r = self.client.get(path, HTTP_RANGE="bytes=-10")
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(b"".join(r.streaming_content), data[-10:])
+
+        # Resuming a download of an outdated version gets everything.
+        r = self.client.get(path, HTTP_RANGE="bytes=100-",
+                            HTTP_IF_RANGE='"other"')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(b"".join(r.streaming_content), data)
+
+        r = self.client.get(path, HTTP_RANGE="bytes=%i-" % len(data))
+        self.assertEqual(r.status_code, 416)
+        self.assertEqual(r["Content-Range"], "bytes */%i" % len(data))
+
+    @override_settings(JANE_DOCUMENT_COMPRESSION="gzip")
+    def test_document_compression(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            data = fh.read()
+        Document.objects.add_or_modify_document(
+            document_type="quakeml", name="quake.xml", data=data,
+            user=self.user)
+        doc = Document.objects.get(name="quake.xml")
+        self.assertEqual(doc.encoding, "gzip")
+        # Size and hash are the ones of the uncompressed data.
+        self.assertEqual(doc.filesize, len(data))
+        self.assertEqual(doc.sha1, hashlib.sha1(data).hexdigest())
+        self.assertLess(len(doc.data), len(data))
+        self.assertEqual(gzip.decompress(bytes(doc.data)), data)
+        self.assertEqual(DocumentIndex.objects.count(), 2)
+
+        # Sent as stored if the client accepts it.
+        path = "/rest/documents/quakeml/quake.xml/data"
+        r = self.client.get(path, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(r["Content-Encoding"], "gzip")
+        self.assertEqual(r["Vary"], "Accept-Encoding")
+        self.assertEqual(
+            gzip.decompress(b"".join(r.streaming_content)), data)
+
+        # Otherwise decompressed while streaming.
+        r = self.client.get(path)
+        self.assertFalse(r.has_header("Content-Encoding"))
+        self.assertEqual(r["Content-Length"], str(len(data)))
+        self.assertEqual(b"".join(r.streaming_content), data)
+
+    def test_attachments_count(self):
+        self.user.user_permissions.add(
+            Permission.objects.filter(
+                codename="can_modify_quakeml").first(),
+            Permission.objects.filter(
+                codename="can_modify_quakeml_attachments").first())
+        with open(FILES["usgs"], "rb") as fh:
+            Document.objects.add_or_modify_document(
+                document_type="quakeml", name="quake.xml", data=fh.read(),
+                user=self.user)
+        index = DocumentIndex.objects.first()
+        self.assertEqual(index.attachments_count, 0)
+
+        for _ in range(3):
+            DocumentIndexAttachment.objects.add_or_modify_attachment(
+                document_type="quakeml", index_id=index.pk,
+                content_type="text/plain", category="note", data=b"abc",
+                user=self.user)
+        index.refresh_from_db()
+        self.assertEqual(index.attachments_count, 3)
+
+        # Deleting a single attachment.
+        DocumentIndexAttachment.objects.filter(index=index).first().delete()
+        index.refresh_from_db()
+        self.assertEqual(index.attachments_count, 2)
+
+        # Bulk deletes, e.g. from the admin interface, recount.
+        DocumentIndexAttachment.objects.filter(index=index).delete()
+        index.refresh_from_db()
+        self.assertEqual(index.attachments_count, 0)
+        # The serialized indices carry the counter.
+        r = self.client.get("/rest/document_indices/quakeml/%i" % index.pk)
+        self.assertEqual(r.json()["attachments_count"], 0)
+
+    def test_keyset_pagination(self):
+        """
+        Walks the indices page by page with the cursors of the next links.
+        """
+        path = "/rest/document_indices/quakeml"
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        for name in ("usgs", "focmec"):
+            with open(FILES[name], "rb") as fh:
+                r = self.client.put("/rest/documents/quakeml/%s.xml" % name,
+                                    data=fh.read(), **self.valid_auth_headers)
+            self.assertEqual(r.status_code, 201)
+
+        def walk(url, count):
+            ids = []
+            while url:
+                r = self.client.get(url).json()
+                # Only the first page is counted.
+                self.assertEqual(r["count"],
+                                 None if "cursor=" in url else count)
+                self.assertIsNone(r["previous"])
+                ids.extend(_i["id"] for _i in r["results"])
+                url = r["next"]
+            return ids
+
+        all_ids = [_i["id"] for _i in self.client.get(path).json()["results"]]
+        self.assertEqual(all_ids, sorted(all_ids))
+        self.assertEqual(walk(path + "?limit=1", 3), all_ids)
+        self.assertIn("cursor=",
+                      self.client.get(path + "?limit=1").json()["next"])
+
+        # Ordered by a JSON value - the event without a magnitude comes last.
+        r = self.client.get(path + "?ordering=magnitude").json()["results"]
+        ordered_ids = [_i["id"] for _i in r]
+        self.assertEqual([_i["indexed_data"]["magnitude"] for _i in r],
+                         [1.54, 1.6, None])
+        self.assertEqual(walk(path + "?ordering=magnitude&limit=2", 3),
+                         ordered_ids)
+
+        # Cursors are stable if earlier items are deleted.
+        r = self.client.get(path + "?limit=1").json()
+        DocumentIndex.objects.filter(pk=all_ids[0]).delete()
+        self.assertEqual(walk(r["next"], 2), all_ids[1:])
+
+        # Offsets still work.
+        r = self.client.get(path + "?limit=1&offset=1").json()
+        self.assertEqual([_i["id"] for _i in r["results"]], [all_ids[2]])
+        self.assertIsNotNone(r["previous"])
+
+        # Invalid cursors.
+        self.assertEqual(
+            self.client.get(path + "?cursor=invalid").status_code, 404)
+
+    def test_number_of_queries_of_list_views(self):
+        """
+        The number of queries of the list views must not grow with the
+        number of listed items.
+        """
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        self.user.user_permissions.add(Permission.objects.get(
+            codename="can_modify_quakeml_attachments"))
+
+        def upload(name):
+            with open(FILES[name], "rb") as fh:
+                r = self.client.put("/rest/documents/quakeml/%s.xml" % name,
+                                    data=fh.read(), **self.valid_auth_headers)
+            self.assertEqual(r.status_code, 201)
+
+        def attach(index_id, category):
+            DocumentIndexAttachment.objects.add_or_modify_attachment(
+                document_type="quakeml", index_id=index_id,
+                content_type="text/plain", category=category, data=b"1",
+                user=self.user)
+
+        def count_queries(path):
+            # Warm up caches so only the queries of the request are counted.
+            self.client.get(path)
+            with CaptureQueriesContext(connection) as queries:
+                r = self.client.get(path)
+            self.assertEqual(r.status_code, 200)
+            return len(queries)
+
+        upload("usgs")
+        index_id = DocumentIndex.objects.first().pk
+        attach(index_id, "a")
+
+        paths = ["/rest/documents/quakeml", "/rest/document_indices/quakeml",
+                 "/rest/document_indices/quakeml/%i/attachments" % index_id]
+        counts = [count_queries(_i) for _i in paths]
+
+        upload("focmec")
+        upload("private")
+        attach(index_id, "b")
+        attach(index_id, "c")
+
+        self.assertEqual([count_queries(_i) for _i in paths], counts)
+
+    # Tests run in a transaction that is never committed.
+    @mock.patch("django.db.transaction.on_commit", lambda func: func())
+    def test_rest_root_counts(self):
+        """
+        The cached counts per document type are updated when documents
+        change.
+        """
+        def get_counts(path):
+            return {_i["document_type"]: _i["available_documents"]
+                    for _i in self.client.get(path).json()}
+
+        self.assertEqual(get_counts("/rest/documents")["quakeml"], 0)
+        self.assertEqual(get_counts("/rest/document_indices")["quakeml"], 0)
+
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            r = self.client.put("/rest/documents/quakeml/quake.xml",
+                                data=fh.read(), **self.valid_auth_headers)
+        self.assertEqual(r.status_code, 201)
+
+        self.assertEqual(get_counts("/rest/documents"),
+                         {"quakeml": 1, "stationxml": 0})
+        self.assertEqual(get_counts("/rest/document_indices"),
+                         {"quakeml": 2, "stationxml": 0})
+        r = self.client.get("/rest").json()
+        self.assertEqual(r[1]["available_documents"], 1)
+        self.assertEqual(r[2]["available_indices"], 2)
+
+        r = self.client.delete("/rest/documents/quakeml/quake.xml",
+                               **self.valid_auth_headers)
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(get_counts("/rest/documents")["quakeml"], 0)
+        self.assertEqual(get_counts("/rest/document_indices")["quakeml"], 0)
+
+    def test_facets(self):
+        """
+        Test the counts of the distinct values of the facet keys.
+        """
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        self.user.user_permissions.add(Permission.objects.get(
+            codename="can_see_private_events"))
+        path = "/rest/document_indices/quakeml/facets/"
+
+        def get_facets(key, **kwargs):
+            r = self.client.get(path + key, **kwargs)
+            self.assertEqual(r.status_code, 200)
+            return [(_i["value"], _i["count"]) for _i in r.json()]
+
+        def upload(filename, name):
+            with open(FILES[filename], "rb") as fh:
+                r = self.client.put("/rest/documents/quakeml/" + name,
+                                    data=fh.read(), **self.valid_auth_headers)
+            self.assertIn(r.status_code, (201, 204))
+
+        upload("usgs", "quake1.xml")
+        self.assertEqual(get_facets("agency", **self.valid_auth_headers),
+                         [("ci", 1), ("uw", 1)])
+        self.assertEqual(get_facets("region", **self.valid_auth_headers),
+                         [("CENTRAL CALIFORNIA", 1), ("OREGON", 1)])
+
+        upload("usgs", "quake2.xml")
+        self.assertEqual(get_facets("agency", **self.valid_auth_headers),
+                         [("ci", 2), ("uw", 2)])
+        self.assertEqual(get_facets("event_type", **self.valid_auth_headers),
+                         [("quarry blast", 4)])
+        # Users without the retrieve permission get counts of the indices
+        # they are allowed to see - here all of them are public.
+        self.assertEqual(get_facets("agency"), [("ci", 2), ("uw", 2)])
+
+        # Replacing a document removes the values of its old indices.
+        upload("focmec", "quake2.xml")
+        self.assertEqual(get_facets("agency", **self.valid_auth_headers),
+                         [("ci", 1), ("uw", 1)])
+        self.assertEqual(sorted(DocumentIndex.objects.get_distinct_values(
+            document_type="quakeml", json_key="agency")), ["ci", "uw"])
+
+        r = self.client.delete("/rest/documents/quakeml/quake1.xml",
+                               **self.valid_auth_headers)
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(get_facets("agency", **self.valid_auth_headers), [])
+        self.assertEqual(DocumentIndexFacet.objects.count(), 0)
+
+        # Only facet keys can be queried.
+        self.assertEqual(self.client.get(path + "latitude").status_code, 404)
+        self.assertEqual(self.client.get(path + "bogus").status_code, 404)
@@ -27,7 +27,17 @@ urlpatterns = [
     url(r'^rest/document_indices/(?P<document_type>[a-zA-Z0-9]+)'
         r'/(?P<idx>[0-9]+)/attachments/(?P<pk>[0-9]+)/data$',
         view=views.attachment_data,
-        name='attachment_data')
+        name='attachment_data'),
+    # Attachments rendered upon request.
+    url(r'^rest/document_indices/(?P<document_type>[a-zA-Z0-9]+)'
+        r'/(?P<idx>[0-9]+)/rendered/(?P<category>[a-zA-Z0-9_-]+)$',
+        view=views.rendered_attachment_data,
+        name='rendered_attachment_data'),
+    # Distinct values of an index key.
+    url(r'^rest/document_indices/(?P<document_type>[a-zA-Z0-9]+)'
+        r'/facets/(?P<key>[a-zA-Z0-9_]+)$',
+        view=views.document_index_facets,
+        name='document_index_facets')
 
 ]
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -1,18 +1,27 @@
 # -*- coding: utf-8 -*-
 import collections
+import hashlib
 
+from django.core.cache import cache
+from django.db.models import Prefetch
 from django.db.models.aggregates import Count
+from django.db.models.functions import Length
 from django.http import HttpResponse
 from django.http.response import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
 from rest_framework import viewsets, generics, mixins
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
-from jane.documents import models, serializer, DOCUMENT_FILENAME_REGEX
+from jane.documents import (compression, facets, models, registry,
+                            rendering, serializer, signals,
+                            DOCUMENT_FILENAME_REGEX)
 from jane.exceptions import JaneInvalidRequestException
+from jane.jane.pagination import KeysetPagination
+from jane.jane.utils import file_response
 
 
 CACHE_TIMEOUT = 60 * 60 * 24
@@ -26,9 +35,17 @@ class DocumentsView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
     lookup_value_regex = DOCUMENT_FILENAME_REGEX
 
     def get_queryset(self):
-        doctype = get_object_or_404(models.DocumentType,
-                                    name=self.kwargs['document_type'])
-        queryset = models.Document.objects.filter(document_type=doctype)
+        doctype = registry.get_document_type_info(
+            self.kwargs['document_type']).document_type
+        # Fetch everything the serializer needs upfront so the number of
+        # queries does not grow with the number of documents. The indices
+        # are fetched with the base manager as their documents are already
+        # known.
+        queryset = models.Document.objects.filter(document_type=doctype) \
+            .select_related('indexing_job', 'created_by', 'modified_by') \
+            .defer('data') \
+            .prefetch_related(Prefetch(
+                'indices', queryset=models.DocumentIndex._base_manager.all()))
         return queryset
 
     def update(self, request, document_type, name):
@@ -42,10 +59,14 @@ class DocumentsView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
             data=request.data.body,
             user=request.user)
 
-        return Response(
-            {"status": "Successfully created or updated the document",
-             "status_code": status},
-            status=status)
+        if status == 202:
+            message = "Successfully stored the document, it has been " \
+                "queued for indexing"
+        else:
+            message = "Successfully created or updated the document"
+
+        return Response({"status": message, "status_code": status},
+                        status=status)
 
     def destroy(self, request, document_type, name):
         """
@@ -62,15 +83,15 @@ class DocumentsView(mixins.RetrieveModelMixin, mixins.ListModelMixin,
 
 class DocumentIndicesView(viewsets.ReadOnlyModelViewSet):
     serializer_class = serializer.DocumentIndexSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Get the query dictionary.
         params = dict(self.request.query_params)
         # Remove some that might be due to the API.
-        if "offset" in params:
-            del params["offset"]
-        if "format" in params:
-            del params["format"]
+        for key in ("offset", "limit", "cursor", "format"):
+            if key in params:
+                del params[key]
         # Flatten the rest.
         params = {key: value[0] for key, value in params.items()}
 
@@ -78,10 +99,6 @@ class DocumentIndicesView(viewsets.ReadOnlyModelViewSet):
             document_type=self.kwargs["document_type"],
             user=self.request.user, **params)
 
-        # annotate number of attachments
-        queryset = queryset.\
-            annotate(attachments_count=Count('attachments'))
-
         return queryset
 
 
@@ -94,7 +111,8 @@ class DocumentIndexAttachmentsView(mixins.RetrieveModelMixin,
     def get_queryset(self):
         index = get_object_or_404(models.DocumentIndex,
                                   pk=self.kwargs['idx'])
-        return models.DocumentIndexAttachment.objects.filter(index=index)
+        return models.DocumentIndexAttachment.objects.filter(index=index) \
+            .select_related('index__document').defer('data')
 
     def destroy(self, request, document_type, idx, pk):
         """
@@ -145,28 +163,55 @@ class DocumentIndexAttachmentsView(mixins.RetrieveModelMixin,
                            idx=idx, pk=pk)
 
 
+def _get_document_types():
+    """
+    All document types with their descriptions in a single query.
+    """
+    return [(name, info.definition.title)
+            for name, info in sorted(registry.get_registry().items())]
+
+
+def _count_per_document_type(queryset, field):
+    """
+    Number of items of a queryset per document type, counted with a single
+    query. Cached until documents of any type are indexed or deleted.
+
+    :param queryset: The queryset to count.
+    :param field: The field with the document type.
+    """
+    generations = sorted(
+        (_i, signals.get_document_type_generation(_i))
+        for _i in registry.get_registry())
+    key = "document_type_counts_%s" % hashlib.sha1(repr((
+        queryset.model._meta.label, field, generations)).encode()).hexdigest()
+    counts = cache.get(key)
+    if counts is None:
+        # Clear the ordering as it would be part of the GROUP BY.
+        counts = dict(queryset.order_by().values_list(field).annotate(
+            count=Count("pk")))
+        cache.set(key, counts, CACHE_TIMEOUT)
+    return counts
+
+
 @api_view(['GET'])
 def documents_rest_root(request, format=None):
     """
     Index of all document types.
     """
     if request.method == "GET":
-        document_types = [_i.name for _i in models.DocumentType.objects.all()]
-
-        data = [(_i, reverse("rest_documents-list",
-                             kwargs={"document_type": _i}, request=request))
-                for _i in document_types]
+        counts = _count_per_document_type(models.Document.objects,
+                                          "document_type")
 
         # Use OrderedDict to force order in browseable REST API.
         return Response([
             collections.OrderedDict([
-                ('document_type', i[0]),
-                ('url', i[1]),
-                ('description', models.DocumentType.objects.get(name=i[0])
-                 .definition.get_plugin().title),
-                ('available_documents',
-                 models.Document.objects.filter(document_type=i[0]).count())]
-            ) for i in sorted(data, key=lambda x: x[0])
+                ('document_type', name),
+                ('url', reverse("rest_documents-list",
+                                kwargs={"document_type": name},
+                                request=request)),
+                ('description', description),
+                ('available_documents', counts.get(name, 0))]
+            ) for name, description in _get_document_types()
         ])
     else:  # pragma: no cover
         raise Http404
@@ -178,43 +223,128 @@ def documents_indices_rest_root(request, format=None):
     Index of all document types for the document indices.
     """
     if request.method == "GET":
-        document_types = [_i.name for _i in models.DocumentType.objects.all()]
-
-        data = [(_i, reverse("rest_document_indices-list",
-                             kwargs={"document_type": _i}, request=request))
-                for _i in document_types]
+        counts = _count_per_document_type(models.DocumentIndex._base_manager,
+                                          "document__document_type")
 
         # Use OrderedDict to force order in browseable REST API.
         return Response([
             collections.OrderedDict([
-                ('document_type', i[0]),
-                ('url', i[1]),
-                ('description', models.DocumentType.objects.get(name=i[0])
-                 .definition.get_plugin().title),
-                ('available_documents',
-                 models.DocumentIndex.objects.filter(
-                     document__document_type=i[0]).count())]
-            ) for i in sorted(data, key=lambda x: x[0])
+                ('document_type', name),
+                ('url', reverse("rest_document_indices-list",
+                                kwargs={"document_type": name},
+                                request=request)),
+                ('description', description),
+                ('available_documents', counts.get(name, 0))]
+            ) for name, description in _get_document_types()
         ])
     else:  # pragma: no cover
         raise Http404
 
 
+@api_view(['GET'])
+def document_index_facets(request, document_type, key, format=None):
+    """
+    Distinct values of an index key with the number of indices having them.
+    """
+    info = registry.get_document_type_info(document_type)
+    document_type = info.document_type
+    if key not in info.facets:
+        raise Http404("'%s' is not a facet of the '%s' document type." % (
+            key, document_type.name))
+
+    if not all(request.user.has_perm(_i)
+               for _i in info.retrieve_permission_names):
+        # Users lacking a retrieve permission are not allowed to see all
+        # indices so count the ones they can see.
+        queryset = models.DocumentIndex.objects.apply_retrieve_permission(
+            document_type=document_type,
+            queryset=models.DocumentIndex._base_manager.filter(
+                document__document_type=document_type),
+            user=request.user)
+        values = sorted(
+            (value, count) for (_, value), count in
+            facets.count_stored_values(queryset, [key]).items())
+    else:
+        values = models.DocumentIndexFacet.objects.filter(
+            document_type=document_type, key=key).order_by(
+            "value").values_list("value", "count")
+
+    # Use OrderedDict to force order in browseable REST API.
+    return Response([
+        collections.OrderedDict([("value", value), ("count", count)])
+        for value, count in values])
+
+
+def _get_stored_size(obj):
+    # The length of data in the database is annotated by the queries below
+    # to not load it for conditional requests.
+    if obj.stored_length is not None:
+        return obj.stored_length
+    return obj.stored_size()
+
+
 def document_data(request, document_type, name, *args, **kwargs):
     """
     Get the data for the document corresponding to a certain document type
     and name.
+
+    Streamed with support for range and conditional requests with the sha1
+    hash as the ETag. Compressed documents are sent as they are stored if
+    the client accepts their encoding.
     """
-    document = get_object_or_404(models.Document,
-                                 document_type__name=document_type, name=name)
-    return HttpResponse(content=document.data,
-                        content_type=document.content_type)
+    document = get_object_or_404(
+        models.Document.objects.annotate(stored_length=Length("data")),
+        document_type__name=document_type, name=name)
+    encoding = document.encoding
+
+    if encoding and compression.accepts_encoding(
+            request.META.get("HTTP_ACCEPT_ENCODING"), encoding):
+        response = file_response(
+            request, document.open_stored_data,
+            size=_get_stored_size(document),
+            content_type=document.content_type,
+            etag="%s-%s" % (document.sha1, encoding))
+        if response.status_code in (200, 206):
+            response["Content-Encoding"] = encoding
+    else:
+        response = file_response(
+            request, document.open_data, size=document.filesize,
+            content_type=document.content_type, etag=document.sha1)
+
+    if encoding:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
 
 
 def attachment_data(request, pk, *args, **kwargs):
     """
     Get the data for the attachment with a certain id.
     """
-    attachment = get_object_or_404(models.DocumentIndexAttachment, pk=pk)
-    return HttpResponse(content=attachment.data,
-                        content_type=attachment.content_type)
+    # Only load the data if it actually has to be sent.
+    attachment = get_object_or_404(
+        models.DocumentIndexAttachment.objects.defer("data").annotate(
+            stored_length=Length("data")), pk=pk)
+    return file_response(request, attachment.open_data,
+                         size=_get_stored_size(attachment),
+                         content_type=attachment.content_type,
+                         etag=attachment.sha1)
+
+
+def rendered_attachment_data(request, document_type, idx, category, *args,
+                             **kwargs):
+    """
+    Get an attachment of a document index that is rendered upon request.
+    """
+    queryset = models.DocumentIndex.objects.get_filtered_queryset(
+        document_type=document_type, user=request.user)
+    index = get_object_or_404(queryset, pk=idx)
+    indexer = registry.get_document_type_info(document_type).indexer
+    if category not in indexer.on_demand_attachments:
+        raise Http404("No attachment '%s' for documents of type '%s'." % (
+            category, document_type))
+
+    data = rendering.get_rendered_attachment(indexer, index, category)
+    if data is None:
+        raise Http404("Attachment could not be rendered.")
+    return HttpResponse(content=data,
+                        content_type=indexer.on_demand_attachments[category])
@@ -3,6 +3,7 @@
 from functools import reduce
 import io
 import operator
+import os
 
 from django.db.models import Q
 import obspy
@@ -103,11 +104,17 @@ def query_dataselect(networks, stations, locations, channels,
             "file__id", "original_network", "original_station",
             "original_location", "original_channel")
 
-    results = query.all()
-
-    if not results:
+    if not query.exists():
         return nodata
 
+    # Only the columns required to read the data. There is one row per file
+    # and channel so they are fetched at once - the data is streamed after
+    # the view returned and must not hold a transaction open meanwhile.
+    results = list(query.values_list(
+        "file__path__name", "file__name", "original_network",
+        "original_station", "original_location", "original_channel",
+        "network", "station", "location", "channel"))
+
     return data_streamer(results, starttime, endtime, format)
 
 
@@ -119,22 +126,20 @@ def data_streamer(results, starttime, endtime, format):
     """
     def iterator():
         for result in results:
+            path, filename = result[:2]
+            original_id, seed_id = result[2:6], result[6:]
             # Use time + sourcename to only read the required files.
             # Previous steps guarantee that this is only called once per
             # file and SEED id.
             st = obspy.read(
-                result.file.absolute_path,
+                os.path.join(path, filename),
                 starttime=starttime, endtime=endtime,
-                sourcename="%s.%s.%s.%s" % (
-                    result.original_network, result.original_station,
-                    result.original_location, result.original_channel))
+                sourcename="%s.%s.%s.%s" % original_id)
             for tr in st:
                 tr.trim(starttime, endtime)
                 # apply mappings if any
-                tr.stats.network = result.network
-                tr.stats.station = result.station
-                tr.stats.location = result.location
-                tr.stats.channel = result.channel
+                (tr.stats.network, tr.stats.station, tr.stats.location,
+                 tr.stats.channel) = seed_id
                 # write trace
                 with io.BytesIO() as fh:
                     tr.write(fh, format=format.upper())
@@ -5,12 +5,9 @@ import io
 
 from lxml import etree
 from obspy import UTCDateTime
-from obspy.geodetics import FlinnEngdahl
 
-from jane.documents.models import DocumentIndex
-
-
-FG = FlinnEngdahl()
+from jane.documents.models import Document, DocumentIndex
+from jane.jane.utils import get_flinn_engdahl_region, iterate_rows
 
 
 def query_event(fh, nodata, orderby, format, starttime=None, endtime=None,
@@ -89,10 +86,13 @@ def query_event(fh, nodata, orderby, format, starttime=None, endtime=None,
             central_latitude=latitude, central_longitude=longitude,
             min_radius=minradius, max_radius=maxradius)
 
-    results = query.all()
-    if not results:
+    if not query.exists():
         return nodata
 
+    # Only fetch the required columns and stream them from the database so
+    # memory usage stays flat even for the full catalog.
+    results = iterate_rows(query.values_list("document_id", "json"))
+
     if format == "xml":
         nsmap = {None: "http://quakeml.org/xmlns/bed/1.2",
                  "ns0": "http://quakeml.org/xmlns/quakeml/1.2"}
@@ -105,10 +105,14 @@ def query_event(fh, nodata, orderby, format, starttime=None, endtime=None,
 
         # Now things get a bit more interesting and this might actually require
         # a different approach to be fast enough.
-        for result in results:
-            quakeml_id = result.json["quakeml_id"]
-            data = io.BytesIO(result.document.data)
-            event = get_event_node(data, quakeml_id)
+        # Consecutive events are often part of the same document.
+        document_id, document_data = None, None
+        for _id, value in results:
+            if _id != document_id:
+                document_id = _id
+                document_data = Document.objects.get(pk=_id).read_data()
+            event = get_event_node(io.BytesIO(document_data),
+                                   value["quakeml_id"])
             if event is None:
                 continue
             catalog_el.append(event)
@@ -129,8 +133,8 @@ def query_event(fh, nodata, orderby, format, starttime=None, endtime=None,
             writer = csv.writer(csvfile, delimiter='|',
                                 quotechar='"', quoting=csv.QUOTE_MINIMAL)
             writer.writerow(header)
-            for result in results:
-                row = [result.json[_i] if _i is not None else ""
+            for _, value in results:
+                row = [value[_i] if _i is not None else ""
                        for _i in json_keys]
 
                 # Guard against events with no location.
@@ -138,8 +142,12 @@ def query_event(fh, nodata, orderby, format, starttime=None, endtime=None,
                     # Convert depth to km.
                     row[4] /= 1000.0
 
-                if row[2] is not None and row[3] is not None:
-                    row.append(FG.get_region(row[3], row[2]))
+                # Indices created before the region has been part of the
+                # index don't have it.
+                if value.get("region"):
+                    row.append(value["region"])
+                elif row[2] is not None and row[3] is not None:
+                    row.append(get_flinn_engdahl_region(row[3], row[2]))
                 else:
                     row.append("")
 
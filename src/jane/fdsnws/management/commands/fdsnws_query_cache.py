@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from jane.fdsnws import query_cache
+
+
+class Command(BaseCommand):
+    help = "Show the statistics of the fdsnws query cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help="Reset the counters afterwards.")
+
+    def handle(self, *args, **kwargs):
+        stats = query_cache.get_statistics()
+        print("%i hits, %i misses, hit ratio: %.1f %%" % (
+            stats["hits"], stats["misses"], stats["hit_ratio"] * 100))
+        if kwargs["reset"]:
+            query_cache.reset_statistics()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the results of fdsnws station and event queries.
+
+Enabled with the ``JANE_FDSNWS_QUERY_CACHE_TIMEOUT`` setting. Results are
+kept in Django's default cache, keyed by the normalized query parameters,
+the permissions of the user, and the generation of the document type which
+changes whenever a document of that type is indexed or deleted.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from jane.documents.signals import get_document_type_generation
+
+
+KEY = "fdsnws_query_%s"
+STATISTICS_KEYS = {
+    "hits": "fdsnws_query_cache_hits",
+    "misses": "fdsnws_query_cache_misses"
+}
+
+
+def get_user_state(user):
+    """
+    String identifying a user and its permissions as both might change the
+    results of a query.
+    """
+    if user is None or not user.is_authenticated():
+        return "anonymous"
+    return "%i:%s" % (user.pk, ",".join(sorted(user.get_all_permissions())))
+
+
+def _count(name):
+    key = STATISTICS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Does not exist yet or has been evicted.
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_statistics():
+    """
+    Number of cache hits and misses since the counters have last been
+    reset.
+    """
+    stats = {_k: cache.get(_v, 0) for _k, _v in STATISTICS_KEYS.items()}
+    total = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+def reset_statistics():
+    cache.delete_many(list(STATISTICS_KEYS.values()))
+
+
+def run_query(service, document_type, params, user, function, state=""):
+    """
+    Get the result of a query from the cache or run it.
+
+    :param service: The name of the service, e.g. ``"station"``.
+    :param document_type: The name of the queried document type.
+    :param params: The parsed and normalized query parameters.
+    :param user: The user or None.
+    :param function: Callable running the query and returning a tuple of
+        the status code and the data as a byte string.
+    :param state: Optional string describing further state the result
+        depends on.
+
+    Returns a tuple of the status code, the data, and ``"HIT"``, ``"MISS"``,
+    or ``"BYPASS"`` if caching is disabled.
+    """
+    timeout = settings.JANE_FDSNWS_QUERY_CACHE_TIMEOUT
+    if not timeout:
+        return function() + ("BYPASS",)
+
+    key = KEY % hashlib.sha1(repr((
+        service, get_document_type_generation(document_type),
+        sorted(params.items()), get_user_state(user),
+        state)).encode()).hexdigest()
+
+    result = cache.get(key)
+    if result is not None:
+        _count("hits")
+        return result + ("HIT",)
+
+    _count("misses")
+    result = function()
+    # Keep huge results out of the cache.
+    if len(result[1]) <= settings.JANE_FDSNWS_QUERY_CACHE_MAX_SIZE:
+        cache.set(key, result, timeout)
+    return result + ("MISS",)
@@ -9,10 +9,10 @@ from lxml import etree
 from obspy import UTCDateTime
 
 from django.conf import settings
-from django.shortcuts import get_object_or_404
 
 import jane
-from jane.documents.models import DocumentIndex, DocumentType
+from jane.documents.models import Document, DocumentIndex
+from jane.jane.utils import iterate_rows
 
 
 def _get_json_query(key, operator, type, value):
@@ -46,10 +46,9 @@ class StationStats(object):
     Might be worthwhile to use a cache here.
     """
     def __init__(self):
-        res_type = get_object_or_404(DocumentType, name="stationxml")
         queryset = DocumentIndex.objects. \
-            filter(document__document_type=res_type)
-        self.data = [_i.json for _i in queryset]
+            filter(document__document_type="stationxml")
+        self.data = list(queryset.values_list("json", flat=True))
 
     def stations_for_network(self, network):
         return len(set([_i["station"] for _i in self.data
@@ -150,18 +149,6 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
         where.append(
             "((json->>'end_date') is null) OR (" +
             _get_json_query("end_date", ">", UTCDateTime, endafter) + ")")
-    if minlatitude is not None:
-        where.append(
-            _get_json_query("latitude", ">=", float, minlatitude))
-    if maxlatitude is not None:
-        where.append(
-            _get_json_query("latitude", "<=", float, maxlatitude))
-    if minlongitude is not None:
-        where.append(
-            _get_json_query("longitude", ">=", float, minlongitude))
-    if maxlongitude is not None:
-        where.append(
-            _get_json_query("longitude", "<=", float, maxlongitude))
 
     for key in ["network", "station", "location", "channel"]:
         argument = locals()[key]
@@ -185,6 +172,10 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
     if where:
         query = query.extra(where=where)
 
+    query = DocumentIndex.objects.apply_bounding_box(
+        query, min_latitude=minlatitude, max_latitude=maxlatitude,
+        min_longitude=minlongitude, max_longitude=maxlongitude)
+
     # Radial queries - also apply the per-user filtering right here!
     if latitude is not None:
         query = DocumentIndex.objects.get_filtered_queryset_radial_distance(
@@ -192,14 +183,16 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
             central_latitude=latitude, central_longitude=longitude,
             min_radius=minradius, max_radius=maxradius, user=user)
     else:
-        doctype = get_object_or_404(DocumentType, name="stationxml")
         query = DocumentIndex.objects.apply_retrieve_permission(
-            document_type=doctype, queryset=query, user=user)
+            document_type="stationxml", queryset=query, user=user)
 
-    results = query.all()
-    if not results:
+    if not query.exists():
         return nodata
 
+    # Only fetch the required columns and stream them from the database so
+    # memory usage stays flat even for huge inventories.
+    results = iterate_rows(query.values_list("document_id", "json"))
+
     # Some things require global statistics.
     stats = StationStats()
 
@@ -233,9 +226,9 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
         elif level in ("station", "network"):
             # Find unique networks - keep one element per network.
             networks = {}
-            for _i in results:
-                network = _i.json["network"]
-                station = _i.json["station"]
+            for _, value in results:
+                network = value["network"]
+                station = value["station"]
 
                 if network not in networks:
                     networks[network] = {}
@@ -243,7 +236,7 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
                 if station in networks[network]:
                     continue
 
-                networks[network][station] = _i.json
+                networks[network][station] = value
 
             # Sort alphabetically to be more predictable.
             all_networks = sorted(networks.keys())
@@ -329,11 +322,11 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
         if level == "network":
             # Find unique networks - keep one element per network.
             networks = collections.OrderedDict()
-            for _i in results:
-                network = _i.json["network"]
+            for _, value in results:
+                network = value["network"]
                 if network in networks:
                     continue
-                networks[network] = _i.json
+                networks[network] = value
 
             field_names = ["Network", "Description", "StartTime", "EndTime",
                            "TotalStations"]
@@ -359,12 +352,12 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
         elif level == "station":
             # Find unique networks - keep one element per network.
             stations = collections.OrderedDict()
-            for _i in results:
-                network = _i.json["network"]
-                station = _i.json["station"]
+            for _, value in results:
+                network = value["network"]
+                station = value["station"]
                 if (network, station) in stations:
                     continue
-                stations[(network, station)] = _i.json
+                stations[(network, station)] = value
 
             field_names = ["Network", "Station", "Latitude", "Longitude",
                            "Elevation", "SiteName", "StartTime", "EndTime"]
@@ -403,8 +396,7 @@ def query_stations(fh, url, nodata, level, format, user, starttime=None,
                                         restval="", dialect=FDSNDialiect)
                 writer.writeheader()
 
-                for _i in results:
-                    value = _i.json
+                for _, value in results:
                     writer.writerow({
                         "Network": value["network"],
                         "Station": value["station"],
@@ -441,13 +433,17 @@ def assemble_network_elements(results, level, stats):
     # created. This is probably faster in the average case where many
     # channels from only a few files are created. Memory usage should not
     # be an issue for the database size Jane is designed for.
-    files = parse_stationxml_files(results)
 
-    # All the required channel_ids
-    channel_ids = set([(
-        _i.json["network"], _i.json["station"], _i.json["location"],
-        _i.json["channel"], _i.json["start_date"], _i.json["end_date"])
-        for _i in results])
+    # All the required channel_ids and the documents containing them.
+    channel_ids = set()
+    document_ids = collections.OrderedDict()
+    for document_id, value in results:
+        channel_ids.add((
+            value["network"], value["station"], value["location"],
+            value["channel"], value["start_date"], value["end_date"]))
+        document_ids[document_id] = None
+
+    files = parse_stationxml_files(document_ids)
 
     # Now filter once again based on the channels.
     chans = collections.OrderedDict()
@@ -555,20 +551,16 @@ def assemble_network_elements(results, level, stats):
     return list(final_networks.values())
 
 
-def parse_stationxml_files(results):
-    parsed_docs = []
+def parse_stationxml_files(document_ids):
     final_results = {
         "networks": collections.OrderedDict(),
         "stations": collections.OrderedDict(),
         "channels": collections.OrderedDict()
     }
-    for result in results:
-        # The indexed document which contains the data.
-        pk = result.pk
-        if pk in parsed_docs:
-            continue
-        parsed_docs.append(pk)
-        data = io.BytesIO(result.document.data)
+    # Each document is parsed once no matter how many of its channels have
+    # been selected.
+    for pk in document_ids:
+        data = io.BytesIO(Document.objects.get(pk=pk).read_data())
 
         # Small state machine.
         net_state, sta_state = [None, None]
@@ -4,6 +4,7 @@ import base64
 import io
 import os
 import tempfile
+from unittest import mock
 
 import django
 from django.contrib.auth.hashers import make_password
@@ -15,7 +16,8 @@ from obspy.clients.fdsn import Client as FDSNClient
 from obspy.clients.fdsn.header import FDSNException
 from psycopg2._range import DateTimeTZRange
 
-from jane.waveforms.models import Restriction, Mapping, ContinuousTrace
+from jane.waveforms.models import (Restriction, Mapping, ContinuousTrace,
+                                   File)
 from jane.waveforms.process_waveforms import process_file
 
 
@@ -152,6 +154,54 @@ class DataSelect1TestCase(TestCase):
         np.testing.assert_equal(got.data, expected.data)
         self.assertEqual(got, expected)
 
+    def test_data_is_streamed_without_queries(self):
+        """
+        The files to read are fetched before the response is returned, so
+        no transaction stays open while the data is streamed.
+        """
+        params = {
+            'net': 'TA',
+            'sta': 'A25A',
+            'cha': 'BH*',
+            'start': '2010-03-25T00:00:00',
+            'end': '2010-03-26T00:00:00'
+        }
+        response = self.client.get('/fdsnws/dataselect/1/query', params)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            data = b"".join(response.streaming_content)
+        expected = [tr.id for tr in read(FILES[1])
+                    if tr.stats.channel.startswith("BH")]
+        self.assertGreater(len(expected), 1)
+        self.assertEqual(sorted(tr.id for tr in read(io.BytesIO(data))),
+                         sorted(expected))
+
+    # Tests run in a transaction that is never committed.
+    @mock.patch("django.db.transaction.on_commit", lambda func: func())
+    def test_conditional_requests(self):
+        path = '/fdsnws/dataselect/1/query?net=TA&sta=A25A&cha=BHE&' \
+            'start=2010-03-25T00:00:00&end=2010-03-26T00:00:00'
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertFalse(response.has_header("Last-Modified"))
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Changes with the restrictions.
+        Restriction.objects.create(network="TA", station="A25A")
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 204)
+        Restriction.objects.all().delete()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # And with the indexed files.
+        File.objects.get(name=os.path.basename(FILES[1])).delete()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 204)
+
     def test_queryauth_nodata(self):
         param = '?start=2012-01-01&end=2012-01-02&net=GE&sta=APE&cha=EHE'
 
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import functools
 import io
 import os
 from unittest import mock
@@ -8,7 +9,8 @@ from unittest import mock
 import django
 from django.contrib.auth.models import User, Permission
 from django.contrib.auth.hashers import make_password
-from django.test import TestCase, LiveServerTestCase
+from django.core.cache import cache
+from django.test import TestCase, LiveServerTestCase, override_settings
 
 import obspy
 from obspy.clients.fdsn import Client as FDSNClient
@@ -18,6 +20,8 @@ from obspy.io.stationxml.core import validate_stationxml
 
 from jane.documents.models import Document
 from jane.documents.plugins import initialize_plugins
+from jane.fdsnws import query_cache
+from jane.jane.utils import iterate_rows
 from jane.waveforms.models import Restriction
 
 
@@ -53,14 +57,12 @@ class Station1TestCase(TestCase):
             'HTTP_AUTHORIZATION': 'Basic ' + credentials.decode("ISO-8859-1")
         }
 
-        # Test will then execute much faster.
-        with mock.patch("obspy.core.inventory.channel.Channel.plot"):
-            with open(FILES["BW.ALTM.xml"], "rb") as fh:
-                Document.objects.add_or_modify_document(
-                    document_type="stationxml",
-                    name="station.xml",
-                    data=fh.read(),
-                    user=self.user)
+        with open(FILES["BW.ALTM.xml"], "rb") as fh:
+            Document.objects.add_or_modify_document(
+                document_type="stationxml",
+                name="station.xml",
+                data=fh.read(),
+                user=self.user)
 
     def test_version(self):
         # 1 - HTTP OK
@@ -252,6 +254,85 @@ class Station1TestCase(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertTrue('Not Found: No data' in response.reason_phrase)
 
+    def test_conditional_requests(self):
+        path = '/fdsnws/station/1/query?level=channel'
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        # Modification times do not reflect deleted documents.
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertIn("public", response["Cache-Control"])
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Different query.
+        response = self.client.get(path + "&net=BW")
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Changes once the documents change.
+        Document.objects.get(name="station.xml").delete()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 204)
+
+        # Responses for authenticated users must not end up in shared caches.
+        response = self.client.get('/fdsnws/station/1/queryauth',
+                                   **self.valid_auth_headers)
+        self.assertIn("private", response["Cache-Control"])
+
+    @override_settings(JANE_FDSNWS_QUERY_CACHE_TIMEOUT=60)
+    # Tests run in a transaction that is never committed.
+    @mock.patch("django.db.transaction.on_commit", lambda func: func())
+    def test_query_cache(self):
+        cache.clear()
+        path = '/fdsnws/station/1/query?level=channel&net=BW'
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Jane-Cache"], "MISS")
+        content = response.content
+
+        response = self.client.get(path)
+        self.assertEqual(response["X-Jane-Cache"], "HIT")
+        self.assertEqual(response.content, content)
+        stats = query_cache.get_statistics()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+        # The URL is part of the StationXML file.
+        response = self.client.get(
+            '/fdsnws/station/1/query?network=bw&level=channel')
+        self.assertEqual(response["X-Jane-Cache"], "MISS")
+        self.assertIn(b"network=bw&amp;level=channel", response.content)
+
+        # Indexing a document of that type invalidates the cache.
+        document = Document.objects.get(name="station.xml")
+        document.save()
+        response = self.client.get(path)
+        self.assertEqual(response["X-Jane-Cache"], "MISS")
+
+        # Deleting it as well.
+        document.delete()
+        response = self.client.get(path)
+        self.assertEqual(response["X-Jane-Cache"], "MISS")
+        self.assertEqual(response.status_code, 204)
+
+    def test_channel_level_reads_each_document_once(self):
+        # Fetch the rows one at a time from the server-side cursor.
+        with mock.patch("jane.fdsnws.station_query.iterate_rows",
+                        functools.partial(iterate_rows, chunk_size=1)), \
+                mock.patch.object(Document, "read_data", autospec=True,
+                                  side_effect=Document.read_data) as p:
+            response = self.client.get(
+                '/fdsnws/station/1/query?level=channel')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(p.call_count, 1)
+
+        expected = obspy.read_inventory(FILES["BW.ALTM.xml"]).get_contents()
+        got = obspy.read_inventory(io.BytesIO(response.content)) \
+            .get_contents()
+        self.assertEqual(len(got["channels"]), 3)
+        self.assertEqual(sorted(got["channels"]),
+                         sorted(expected["channels"]))
+
     def test_text_format(self):
         d = self.client.get(
             '/fdsnws/station/1/query?format=text&level=network').content
@@ -450,16 +531,13 @@ class Station1LiveServerTestCase(LiveServerTestCase):
             'HTTP_AUTHORIZATION': 'Basic ' + credentials.decode("ISO-8859-1")
         }
 
-        # Mocking makes the plotting fails which is the slow operation -
-        # thus the tests execute much faster.
-        with mock.patch("obspy.core.inventory.channel.Channel.plot"):
-            # Add a station.
-            with open(FILES["BW.ALTM.xml"], "rb") as fh:
-                Document.objects.add_or_modify_document(
-                    document_type="stationxml",
-                    name="station.xml",
-                    data=fh.read(),
-                    user=self.user)
+        # Add a station.
+        with open(FILES["BW.ALTM.xml"], "rb") as fh:
+            Document.objects.add_or_modify_document(
+                document_type="stationxml",
+                name="station.xml",
+                data=fh.read(),
+                user=self.user)
 
     def test_level_argument(self):
         client = FDSNClient(self.live_server_url)
@@ -705,6 +783,17 @@ class Station1LiveServerTestCase(LiveServerTestCase):
             client.get_stations(minlatitude=48, maxlatitude=49,
                                 minlongitude=11, maxlongitude=11.4)
 
+        # Rectangles crossing the antimeridian.
+        self.assertEqual(
+            len(client.get_stations(
+                minlatitude=48, maxlatitude=49,
+                minlongitude=170, maxlongitude=12).get_contents()["stations"]),
+            1)
+
+        with self.assertRaises(FDSNException):
+            client.get_stations(minlatitude=48, maxlatitude=49,
+                                minlongitude=12, maxlongitude=11)
+
     def test_radial_queries(self):
         client = FDSNClient(self.live_server_url)
         lat = 48.995167 + 1.0
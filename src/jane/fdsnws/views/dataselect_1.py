@@ -8,7 +8,8 @@ from django.shortcuts import render
 from obspy.core.utcdatetime import UTCDateTime
 
 from jane.fdsnws.dataselect_query import query_dataselect
-from jane.fdsnws.views.utils import fdnsws_error
+from jane.fdsnws.views.utils import (conditional_query, fdnsws_error,
+                                     get_waveform_state)
 from jane.jane.decorators import logged_in_or_basicauth
 
 
@@ -51,6 +52,7 @@ def wadl(request):  # @UnusedVariable
                   content_type="application/xml; charset=utf-8")
 
 
+@conditional_query(get_waveform_state)
 def query(request):
     """
     Parses and returns data request
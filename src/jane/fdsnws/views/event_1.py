@@ -11,7 +11,10 @@ from lxml.builder import E
 
 from jane.documents.models import DocumentIndex
 from jane.fdsnws.event_query import query_event
-from jane.fdsnws.views.utils import fdnsws_error, parse_query_parameters
+from jane.fdsnws import query_cache
+from jane.fdsnws.views.utils import (
+    conditional_query, fdnsws_error, get_document_type_state,
+    parse_query_parameters)
 
 import obspy
 
@@ -177,6 +180,7 @@ def wadl(request):  # @UnusedVariable
                   content_type="application/xml; charset=utf-8")
 
 
+@conditional_query(lambda: get_document_type_state("quakeml"))
 def query(request):
     """
     Parses and returns event request
@@ -221,16 +225,22 @@ def query(request):
     else:
         raise NotImplementedError
 
-    with io.BytesIO() as fh:
-        status = query_event(fh, **params)
-        fh.seek(0, 0)
+    def _run_query():
+        with io.BytesIO() as fh:
+            status = query_event(fh, **params)
+            return status, fh.getvalue()
 
-        if status == 200:
-            response = HttpResponse(fh, content_type=content_type)
-            return response
-        else:
-            msg = 'Not Found: No data selected'
-            return _error(request, msg, status)
+    status, data, cache_status = query_cache.run_query(
+        service="event", document_type="quakeml", params=params,
+        user=request.user, function=_run_query)
+
+    if status == 200:
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        msg = 'Not Found: No data selected'
+        response = _error(request, msg, status)
+    response["X-Jane-Cache"] = cache_status
+    return response
 
 
 @login_required
@@ -8,7 +8,10 @@ import obspy
 
 from jane.jane.decorators import logged_in_or_basicauth
 from jane.fdsnws.station_query import query_stations
-from jane.fdsnws.views.utils import fdnsws_error, parse_query_parameters
+from jane.fdsnws import query_cache
+from jane.fdsnws.views.utils import (
+    conditional_query, fdnsws_error, get_restriction_state,
+    get_station_state, parse_query_parameters)
 
 
 VERSION = '1.1.1'
@@ -182,6 +185,7 @@ def wadl(request):  # @UnusedVariable
                   content_type="application/xml; charset=utf-8")
 
 
+@conditional_query(get_station_state)
 def query(request):
     """
     Parses and returns event request
@@ -255,16 +259,25 @@ def query(request):
     else:
         user = None
 
-    with io.BytesIO() as fh:
-        status = query_stations(fh, url=url, user=user, **params)
-        fh.seek(0, 0)
+    def _run_query():
+        with io.BytesIO() as fh:
+            status = query_stations(fh, url=url, user=user, **params)
+            return status, fh.getvalue()
 
-        if status == 200:
-            response = HttpResponse(fh, content_type=content_type)
-            return response
-        else:
-            msg = 'Not Found: No data selected'
-            return _error(request, msg, status)
+    # The restrictions also apply to the stations and the URL is part of
+    # the StationXML files.
+    status, data, cache_status = query_cache.run_query(
+        service="station", document_type="stationxml", params=params,
+        user=user, function=_run_query,
+        state="%s|%s" % (get_restriction_state(), url))
+
+    if status == 200:
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        msg = 'Not Found: No data selected'
+        response = _error(request, msg, status)
+    response["X-Jane-Cache"] = cache_status
+    return response
 
 
 @logged_in_or_basicauth(settings.JANE_INSTANCE_NAME)
@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import functools
+import hashlib
 
+from django.conf import settings
+from django.db.models import Count, Max
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from jane.documents.models import Document
+from jane.fdsnws.query_cache import get_user_state
+from jane.waveforms.models import Restriction, Revision
 
 
 def fdnsws_error(request, status_code, service, message, version):
@@ -60,3 +70,85 @@ def parse_query_parameters(query_params, request):
                 param_name, e)
 
     return parameters
+
+
+def get_document_type_state(document_type):
+    """
+    Validator of the documents of a certain type - their number and the
+    last modification time. Changes whenever a document is added, modified,
+    or deleted.
+    """
+    state = Document.objects.filter(document_type=document_type).aggregate(
+        count=Count("id"), modified_at=Max("modified_at"))
+    return "%s:%i:%s" % (document_type, state["count"], state["modified_at"])
+
+
+def get_restriction_state():
+    """
+    Validator of the waveform restrictions which also apply to the
+    channels in StationXML files.
+    """
+    state = Restriction.objects.aggregate(count=Count("id"),
+                                          modified_at=Max("modified_at"))
+    return "restrictions:%i:%s" % (state["count"], state["modified_at"])
+
+
+def get_station_state():
+    """
+    Validator of the StationXML documents including the restrictions.
+    """
+    return "%s|%s" % (get_document_type_state("stationxml"),
+                      get_restriction_state())
+
+
+def get_waveform_state():
+    """
+    Validator of the waveform index including the mappings and
+    restrictions.
+    """
+    return "waveforms:%s" % Revision.objects.get_token()
+
+
+def conditional_query(get_state):
+    """
+    Decorator for fdsnws query views adding an ETag and Cache-Control
+    headers and answering conditional GET requests with ``304 Not
+    Modified``.
+
+    :param get_state: Callable returning a string that changes whenever the
+        underlying data changes.
+
+    There is no Last-Modified header as the modification times of the data
+    do not reflect deletions.
+
+    The ETag also depends on the full request path and on the user and their
+    permissions as these determine what a query returns.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # POST bodies are not part of the URL.
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            state = get_state()
+            user = request.user
+            etag = hashlib.sha1(("%s|%s|%s" % (
+                state, get_user_state(user),
+                request.get_full_path())).encode()).hexdigest()
+
+            response = condition(
+                etag_func=lambda *args, **kwargs: etag)(view)(
+                request, *args, **kwargs)
+
+            # Results depend on the user so shared caches must only cache
+            # anonymous requests.
+            max_age = settings.JANE_FDSNWS_CACHE_MAX_AGE
+            if user.is_authenticated():
+                patch_cache_control(response, private=True, max_age=max_age)
+            else:
+                patch_cache_control(response, public=True, max_age=max_age)
+            patch_vary_headers(response, ["Authorization", "Cookie"])
+            return response
+        return wrapper
+    return decorator
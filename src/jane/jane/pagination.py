@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Keyset pagination for the REST API.
+"""
+import base64
+import binascii
+import collections
+import datetime
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from psycopg2.extras import DateTimeTZRange
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, DateTimeTZRange):
+        bounds = ("[" if value.lower_inc else "(") + \
+            ("]" if value.upper_inc else ")")
+        return {"range": [_encode_value(value.lower),
+                          _encode_value(value.upper), bounds]}
+    raise TypeError
+
+
+def _decode_value(value):
+    if "datetime" in value:
+        return parse_datetime(value["datetime"])
+    if "range" in value:
+        lower, upper, bounds = value["range"]
+        return DateTimeTZRange(
+            lower and _decode_value(lower), upper and _decode_value(upper),
+            bounds)
+    return value
+
+
+def encode_cursor(values):
+    """
+    Opaque string representing a position in an ordered result set.
+    """
+    data = json.dumps(values, default=_encode_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode())
+        values = json.loads(data.decode(), object_hook=_decode_value)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise NotFound("Invalid cursor.")
+    if not isinstance(values, list):
+        raise NotFound("Invalid cursor.")
+    return values
+
+
+def _get_ordering(queryset):
+    """
+    The ordering of a queryset as a list of ``(name, descending)`` tuples
+    with the primary key as the last item or None if it cannot be used for
+    keyset pagination, e.g. because it orders on expressions or related
+    fields.
+    """
+    query = queryset.query
+    if query.extra_order_by:
+        return None
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = queryset.model._meta.ordering
+    else:
+        ordering = []
+
+    result = []
+    for item in ordering:
+        if not isinstance(item, str) or "__" in item or item == "?":
+            return None
+        descending = item.startswith("-")
+        name = item.lstrip("-")
+        if name == queryset.model._meta.pk.name:
+            name = "pk"
+        result.append((name, descending))
+        # Everything after the primary key is irrelevant.
+        if name == "pk":
+            return result
+    result.append(("pk", False))
+    return result
+
+
+def _get_value(obj, name):
+    if name == "pk":
+        return obj.pk
+    try:
+        return getattr(obj, obj._meta.get_field(name).attname)
+    except FieldDoesNotExist:
+        # An annotation.
+        return getattr(obj, name)
+
+
+def _get_keyset_filter(ordering, values):
+    """
+    Filter selecting everything after the given values of the ordering. NULL
+    values come last in ascending order and first in descending order, just
+    as PostgreSQL sorts them.
+    """
+    terms = []
+    equal = []
+    for (name, descending), value in zip(ordering, values):
+        if value is None:
+            after = Q(**{name + "__isnull": False}) if descending else None
+        elif descending:
+            after = Q(**{name + "__lt": value})
+        else:
+            after = Q(**{name + "__gt": value}) | \
+                Q(**{name + "__isnull": True})
+        if after is not None:
+            terms.append(reduce(operator.and_, equal + [after]))
+        if value is None:
+            equal.append(Q(**{name + "__isnull": True}))
+        else:
+            equal.append(Q(**{name: value}))
+    if not terms:
+        return Q(pk__in=[])
+    return reduce(operator.or_, terms)
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Pages through results by remembering the ordering values and the primary
+    key of the last item of the previous page, e.g.
+
+    http://example.com/rest/document_indices/quakeml?cursor=WzEyXQ==
+
+    Each page costs the same no matter how deep into the results it is and
+    items inserted or deleted concurrently do not shift the following pages.
+    The ``next`` link of each page contains the cursor of the next page,
+    pages can only be walked forward.
+
+    Only the first page is counted - counting all results would make the
+    following pages as expensive as the first one, their ``count`` is thus
+    None.
+
+    Requests with an ``offset`` parameter and querysets ordered by
+    expressions or related fields use limit/offset pagination.
+    """
+    cursor_query_param = "cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = None
+        if self.offset_query_param not in request.query_params:
+            self.ordering = _get_ordering(queryset)
+        if self.ordering is None:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.request = request
+
+        queryset = queryset.order_by(*[
+            ("-" if _i[1] else "") + _i[0] for _i in self.ordering])
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        self.count = None if cursor else queryset.count()
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise NotFound("Invalid cursor.")
+            try:
+                queryset = queryset.filter(
+                    _get_keyset_filter(self.ordering, values))
+            except (TypeError, ValueError):
+                raise NotFound("Invalid cursor.")
+
+        # One more to know if there is a next page.
+        results = list(queryset[:self.limit + 1])
+        self.next_cursor = None
+        if len(results) > self.limit:
+            results = results[:self.limit]
+            try:
+                self.next_cursor = encode_cursor([
+                    _get_value(results[-1], _i[0]) for _i in self.ordering])
+            except TypeError:
+                raise ParseError("Results cannot be paginated with cursors "
+                                 "in this ordering. Use 'offset' instead.")
+        return results
+
+    def get_paginated_response(self, data):
+        if self.ordering is None:
+            return super().get_paginated_response(data)
+        return Response(collections.OrderedDict([
+            ("count", self.count),
+            ("next", self.get_next_link()),
+            ("previous", None),
+            ("results", data)
+        ]))
+
+    def get_next_link(self):
+        if self.ordering is None:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.next_cursor)
+
+    def get_previous_link(self):
+        if self.ordering is None:
+            return super().get_previous_link()
+        return None
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import django
+
+from jane.jane.utils import _parse_range
+
+
+django.setup()
+
+
+class UtilsTestCase(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertEqual(_parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(_parse_range("bytes=90-200", 100), (90, 99))
+        self.assertEqual(_parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(_parse_range("bytes=-200", 100), (0, 99))
+        self.assertEqual(_parse_range("bytes=0-9,20-29", 100), None)
+        self.assertEqual(_parse_range("bytes=100-", 100), False)
+        self.assertEqual(_parse_range("bytes=-0", 100), False)
+        # Empty files cannot satisfy any range.
+        self.assertEqual(_parse_range("bytes=-10", 0), False)
+        self.assertEqual(_parse_range("bytes=0-", 0), False)
@@ -1,4 +1,11 @@
 # -*- coding: utf-8 -*-
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
 from rest_framework.routers import SimpleRouter
 
 
@@ -17,3 +24,200 @@ class OptionalTrailingSlashSimpleRouter(SimpleRouter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.trailing_slash = "/?"
+
+
+RANGE_REGEX = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class _FileRange(object):
+    """
+    File-like object only exposing a range of another file-like object.
+
+    Deliberately has no fileno() so WSGI servers do not sendfile() the whole
+    underlying file.
+    """
+    def __init__(self, fh, start, length):
+        self.fh = fh
+        self.fh.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fh.close()
+
+
+def _parse_range(header, size):
+    """
+    Parse a ``Range`` header with a single byte range.
+
+    Returns a ``(start, end)`` tuple with an inclusive end, None if the
+    header should be ignored, or False if the range cannot be satisfied.
+    """
+    match = RANGE_REGEX.match(header)
+    # Multiple or otherwise unsupported ranges - just send everything.
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    # Not even a single byte of an empty file can be sent.
+    if not size:
+        return False
+    if not start:
+        # Suffix range with the number of bytes at the end of the file.
+        length = int(end)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return False
+    return start, end
+
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    tags = [_i.strip() for _i in header.split(",")]
+    # Weak comparison as demanded for If-None-Match.
+    tags = [_i[2:] if _i.startswith("W/") else _i for _i in tags]
+    return etag in tags
+
+
+def file_response(request, open_file, size, content_type, etag=None,
+                  filename=None):
+    """
+    Stream a file-like object in chunks.
+
+    Supports single byte ``Range`` requests (including ``If-Range``) as well
+    as conditional requests with ``If-None-Match`` if an ETag is given. The
+    file will be closed once the response has been sent.
+
+    :param request: The request.
+    :param open_file: Callable returning the binary file-like object. Not
+        called if no data has to be sent.
+    :param size: The size of the file in bytes.
+    :param content_type: The content type of the response.
+    :param etag: Optional unquoted entity tag, e.g. a hash of the data.
+    :param filename: Optional filename to download the data as.
+    """
+    if etag is not None:
+        etag = '"%s"' % etag
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    # Only honor ranges if the client has the current version of the data.
+    if range_header and (not if_range or (etag and if_range == etag)):
+        byte_range = _parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%i" % size
+    elif byte_range is not None:
+        start, end = byte_range
+        response = FileResponse(_FileRange(open_file(), start,
+                                           end - start + 1),
+                                content_type=content_type, status=206)
+        response["Content-Range"] = "bytes %i-%i/%i" % (start, end, size)
+        response["Content-Length"] = end - start + 1
+    else:
+        response = FileResponse(open_file(), content_type=content_type)
+        response["Content-Length"] = size
+
+    response["Accept-Ranges"] = "bytes"
+    if etag is not None:
+        response["ETag"] = etag
+    if filename:
+        response["Content-Disposition"] = \
+            'attachment; filename="%s"' % filename
+    return response
+
+
+_flinn_engdahl = None
+_flinn_engdahl_regions = {}
+
+
+def get_flinn_engdahl_region(longitude, latitude):
+    """
+    Name of the Flinn-Engdahl region of a coordinate.
+
+    The regions are defined on a grid of one degree cells so the names are
+    cached per cell which makes this cheap enough to call for large numbers
+    of events.
+    """
+    global _flinn_engdahl
+    if longitude == -180:
+        longitude = 180
+    # The same cells as in obspy's lookup.
+    cell = (longitude >= 0, latitude >= 0,
+            int(abs(longitude)), int(abs(latitude)))
+    if cell not in _flinn_engdahl_regions:
+        if _flinn_engdahl is None:
+            from obspy.geodetics import FlinnEngdahl
+            _flinn_engdahl = FlinnEngdahl()
+        _flinn_engdahl_regions[cell] = _flinn_engdahl.get_region(
+            longitude, latitude)
+    return _flinn_engdahl_regions[cell]
+
+
+def iterate_rows(queryset, chunk_size=2000):
+    """
+    Iterate over the rows of a ``values_list()`` queryset with a server-side
+    cursor so only ``chunk_size`` rows are held in memory at any time.
+
+    Django's own ``iterator()`` still fetches the complete result set from
+    PostgreSQL. The rows are the raw values returned by the database, thus
+    this is only meant for simple columns and ``jsonb`` fields. Falls back
+    to ``iterator()`` for other databases.
+
+    A transaction is open until the rows have been consumed, so do not
+    hand the iterator to a streaming response.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        yield from queryset.iterator()
+        return
+    try:
+        sql, params = queryset.query.get_compiler(
+            using=queryset.db).as_sql()
+    except EmptyResultSet:
+        return
+    # Named cursors only live inside a transaction.
+    with transaction.atomic(using=queryset.db):
+        with connection.connection.cursor(
+                name="jane_%s" % uuid.uuid4().hex) as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(sql, params)
+            yield from cursor
+
+
+def estimate_count(model):
+    """
+    Number of rows of the table of a model. Tables with at least
+    ``JANE_ESTIMATED_COUNT_THRESHOLD`` rows are not counted but PostgreSQL's
+    estimate from the last time the table has been analyzed is returned.
+    """
+    connection = connections[router.db_for_read(model)]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                [model._meta.db_table])
+            row = cursor.fetchone()
+        # Never analyzed tables have an estimate of 0 or -1.
+        if row and row[0] >= settings.JANE_ESTIMATED_COUNT_THRESHOLD:
+            return int(row[0])
+    return model._base_manager.count()
@@ -13,6 +13,7 @@ from jane.documents import models, views
 from jane.waveforms.models import ContinuousTrace
 
 from .serializer import UserSerializer
+from .utils import estimate_count
 
 
 @api_view(['GET'])
@@ -56,14 +57,14 @@ def rest_root(request, format=None):
         waveforms["name"] = "waveforms"
         waveforms["url"] = reverse('rest_waveforms-list', request=request)
         waveforms["description"] = ("REST view of Jane's waveform database")
-        waveforms["available_traces"] = ContinuousTrace.objects.count()
+        waveforms["available_traces"] = estimate_count(ContinuousTrace)
 
         documents = OrderedDict()
         documents["name"] = "documents"
         documents["url"] = reverse(views.documents_rest_root, request=request)
         documents["description"] = ("Jane's document database at the "
                                     "document level")
-        documents["available_documents"] = models.Document.objects.count()
+        documents["available_documents"] = estimate_count(models.Document)
 
         document_indices = OrderedDict()
         document_indices["name"] = "document_indices"
@@ -72,7 +73,7 @@ def rest_root(request, format=None):
         document_indices["description"] = (
             "Jane's document database at the index level")
         document_indices["available_indices"] = \
-            models.DocumentIndex.objects.count()
+            estimate_count(models.DocumentIndex)
 
         return Response([waveforms, documents, document_indices])
 
@@ -87,7 +87,7 @@ class QuakeMLIndexerPlugin(IndexerPluginPoint):
     Each document type can have one indexer.
 
     Upon uploading, the indexer will parse the uploaded document and extract
-    information from it as a list of dictionaries. Each dictionary is the
+    information from it as a sequence of dictionaries. Each dictionary is the
     index for one particular logical part in the document. A document may
     have one or more indices. In this case here one index will be created
     and stored per event in the QuakeML file.
@@ -116,81 +116,103 @@ class QuakeMLIndexerPlugin(IndexerPluginPoint):
         "event_type": "str",
         "has_focal_mechanism": "bool",
         "has_moment_tensor": "bool",
+        "region": "str",
     }
 
+    # Optional keys that identify an index when a document is modified.
+    # Only the indices of events that actually changed will then be
+    # updated and all others keep their id and attachments.
+    identity_keys = ("quakeml_id",)
+
+    # Keys with distinct values that are cheap to list, e.g. the agencies
+    # for the contributors of the fdsnws event service.
+    facets = ("agency", "author", "magnitude_type", "evaluation_mode",
+              "event_type", "region")
+
     def index(self, document):
         """
         The method that actually performs the indexing.
 
         :param document: The document as a memory file.
+
+        Each index has to be a dictionary. Instead of returning a list of
+        them, indexers can also yield them one after the other.
         """
-        from django.contrib.gis.geos.point import Point  # NOQA
         from obspy import read_events
 
-        # Collect all indices in a list. Each index has to be a dictionary.
-        indices = []
-
-        inv = read_events(document, format="quakeml")
-
-        for event in inv:
-            if event.origins:
-                org = event.preferred_origin() or event.origins[0]
-            else:
-                org = None
-
-            if event.magnitudes:
-                mag = event.preferred_magnitude() or event.magnitudes[0]
-            else:
-                mag = None
-
-            has_focal_mechanism = False
-            has_moment_tensor = False
-            if event.focal_mechanisms:
-                has_focal_mechanism = True
-                if any(mt for mt in event.focal_mechanisms):
-                    has_moment_tensor = True
-
-            # Parse attributes in the baynet namespace.
-            # The public attribute defaults to True, it can only be set to
-            # False by utilizing the baynet namespace as of now.
-            extra = event.get("extra", {})
-            if "public" in extra:
-                public = extra["public"]["value"]
-                if public.lower() in ["false", "f"]:
-                    public = False
-                elif public.lower() in ["true", "t"]:
-                    public = True
-                else:
-                    public = None
-            else:
-                public = True
-            if "evaluationMode" in extra:
-                evaluation_mode = extra["evaluationMode"]["value"]
-            else:
-                evaluation_mode = None
-
-            indices.append({
-                "quakeml_id": str(event.resource_id),
-                "latitude": org.latitude if org else None,
-                "longitude": org.longitude if org else None,
-                "depth_in_m": org.depth if org else None,
-                "origin_time": str(org.time) if org else None,
-                "magnitude": mag.mag if mag else None,
-                "magnitude_type": mag.magnitude_type if mag else None,
-                "agency":
-                event.creation_info and event.creation_info.agency_id or None,
-                "author":
-                event.creation_info and event.creation_info.author or None,
-                "public": public,
-                "evaluation_mode": evaluation_mode,
-                "event_type": event.event_type,
-                "has_focal_mechanism": has_focal_mechanism,
-                "has_moment_tensor": has_moment_tensor,
-                # The special key geometry can be used to store geographic
-                # information about the indexes geometry. Useful for very
-                # fast queries using PostGIS.
-                "geometry":
-                    [Point(org.longitude, org.latitude)] if org else None,
-            })
-
-        return indices
+        cat = read_events(document, format="quakeml")
+
+        for event in cat.events:
+            yield _index_event(event)
+
+
+def _index_event(event):
+    """
+    Create the index for a single event.
+    """
+    from django.contrib.gis.geos.point import Point  # NOQA
+    from jane.jane.utils import get_flinn_engdahl_region
+
+    if event.origins:
+        org = event.preferred_origin() or event.origins[0]
+    else:
+        org = None
+
+    if event.magnitudes:
+        mag = event.preferred_magnitude() or event.magnitudes[0]
+    else:
+        mag = None
+
+    has_focal_mechanism = False
+    has_moment_tensor = False
+    if event.focal_mechanisms:
+        has_focal_mechanism = True
+        if any(mt for mt in event.focal_mechanisms):
+            has_moment_tensor = True
+
+    # Parse attributes in the baynet namespace.
+    # The public attribute defaults to True, it can only be set to
+    # False by utilizing the baynet namespace as of now.
+    extra = event.get("extra", {})
+    if "public" in extra:
+        public = extra["public"]["value"]
+        if public.lower() in ["false", "f"]:
+            public = False
+        elif public.lower() in ["true", "t"]:
+            public = True
+        else:
+            public = None
+    else:
+        public = True
+    if "evaluationMode" in extra:
+        evaluation_mode = extra["evaluationMode"]["value"]
+    else:
+        evaluation_mode = None
+
+    return {
+        "quakeml_id": str(event.resource_id),
+        "latitude": org.latitude if org else None,
+        "longitude": org.longitude if org else None,
+        "depth_in_m": org.depth if org else None,
+        "origin_time": str(org.time) if org else None,
+        "magnitude": mag.mag if mag else None,
+        "magnitude_type": mag.magnitude_type if mag else None,
+        "agency":
+        event.creation_info and event.creation_info.agency_id or None,
+        "author":
+        event.creation_info and event.creation_info.author or None,
+        "public": public,
+        "evaluation_mode": evaluation_mode,
+        "event_type": event.event_type,
+        "has_focal_mechanism": has_focal_mechanism,
+        "has_moment_tensor": has_moment_tensor,
+        # Stored so the text output of the fdsnws event service does not
+        # have to look it up for every event.
+        "region": get_flinn_engdahl_region(org.longitude, org.latitude)
+        if org else None,
+        # The special key geometry can be used to store geographic
+        # information about the indexes geometry. Useful for very
+        # fast queries using PostGIS.
+        "geometry":
+            [Point(org.longitude, org.latitude)] if org else None,
+    }
@@ -1,17 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import functools
+import io
 import os
+from unittest import mock
 
 import django
 from django.contrib.auth.models import User, Permission
 from django.contrib.auth.hashers import make_password
 from django.contrib.gis.geos.point import Point
 from django.test import TestCase
+import obspy
 
 from jane.quakeml.plugins import QuakeMLIndexerPlugin
 from jane.documents import JaneDocumentsValidationException
-from jane.documents.models import DocumentIndex
+from jane.documents.models import Document, DocumentIndex
+from jane.jane.utils import iterate_rows
 from jane.documents.plugins import initialize_plugins
 
 
@@ -71,6 +76,7 @@ class QuakeMLPluginTestCase(TestCase):
              'magnitude_type': 'ml',
              'origin_time': '2014-11-06T00:24:42.240000Z',
              'public': True,
+             'region': 'CENTRAL CALIFORNIA',
              'quakeml_id': 'quakeml:comcat.cr.usgs.gov/fdsnws/event/1/'
                            'query?eventid=ci37285320&amp;format=quakeml'},
             {'agency': 'uw',
@@ -87,6 +93,7 @@ class QuakeMLPluginTestCase(TestCase):
              'magnitude_type': 'Md',
              'origin_time': '2014-11-14T21:07:48.200000Z',
              'public': True,
+             'region': 'OREGON',
              'quakeml_id': 'quakeml:comcat.cr.usgs.gov/fdsnws/event/1/'
                            'query?eventid=uw60916552&amp;format=quakeml'}]
         expected_focmec = [
@@ -104,10 +111,11 @@ class QuakeMLPluginTestCase(TestCase):
              'magnitude_type': None,
              'origin_time': None,
              'public': True,
+             'region': None,
              'quakeml_id': 'smi:ISC/evid=11713537'}]
         indexer = QuakeMLIndexerPlugin()
-        result_usgs = indexer.index(FILES['usgs'])
-        result_focmec = indexer.index(FILES['focmec'])
+        result_usgs = list(indexer.index(FILES['usgs']))
+        result_focmec = list(indexer.index(FILES['focmec']))
         self.assertEqual(expected_usgs, result_usgs)
         self.assertEqual(expected_focmec, result_focmec)
 
@@ -397,6 +405,12 @@ class QuakeMLPluginTestCase(TestCase):
         lat = 35.0476667
         lng = -117.6623333
 
+        # Both events have a single point as their geometry.
+        self.assertEqual(sorted(
+            (round(_i.x, 4), round(_i.y, 4)) for _i in
+            DocumentIndex.objects.values_list("location", flat=True)),
+            [(-120.2807, 42.138), (-117.6623, 35.0477)])
+
         q = DocumentIndex.objects.get_filtered_queryset_radial_distance(
             document_type="quakeml",
             central_latitude=lat, central_longitude=lng)
@@ -582,7 +596,7 @@ class QuakeMLPluginTestCase(TestCase):
         a_id = self.client.get(a_path).json()["results"][0]["id"]
         r = self.client.get(a_path + "/%i/data" % a_id)
         self.assertEqual(r.status_code, 200)
-        self.assertEqual(r.content, b"Hello 1")
+        self.assertEqual(b"".join(r.streaming_content), b"Hello 1")
         # Make sure its served with the correct content type.
         self.assertEqual(r["Content-Type"], "text/plain")
 
@@ -599,7 +613,7 @@ class QuakeMLPluginTestCase(TestCase):
         self.assertEqual(r["content_type"], "text/random")
         r = self.client.get(a_path + "/%i/data" % a_id)
         self.assertEqual(r.status_code, 200)
-        self.assertEqual(r.content, b"Hello 2")
+        self.assertEqual(b"".join(r.streaming_content), b"Hello 2")
         self.assertEqual(r["Content-Type"], "text/random")
 
         # Add another attachment.
@@ -648,4 +662,33 @@ class QuakeMLPluginTestCase(TestCase):
         self.assertEqual(r.status_code, 201)
 
         r = self.client.get("/rest/documents/quakeml/quake.xml/data")
-        self.assertEqual(r.content, data)
+        self.assertEqual(b"".join(r.streaming_content), data)
+
+    def test_fdsnws_event_query(self):
+        self.user.user_permissions.add(self.can_modify_quakeml_permission)
+        with open(FILES["usgs"], "rb") as fh:
+            self.client.put("/rest/documents/quakeml/quake.xml",
+                            data=fh.read(), **self.valid_auth_headers)
+        path = "/fdsnws/event/1/query?orderby=time-asc"
+
+        # Fetch the rows one at a time from the server-side cursor.
+        with mock.patch("jane.fdsnws.event_query.iterate_rows",
+                        functools.partial(iterate_rows, chunk_size=1)), \
+                mock.patch.object(Document, "read_data", autospec=True,
+                                  side_effect=Document.read_data) as p:
+            r = self.client.get(path)
+            self.assertEqual(r.status_code, 200)
+            # Both events are part of the same document.
+            self.assertEqual(p.call_count, 1)
+            cat = obspy.read_events(io.BytesIO(r.content))
+            self.assertEqual(
+                [_i.resource_id.id.split("eventid=")[1][:10] for _i in cat],
+                ["ci37285320", "uw60916552"])
+
+            r = self.client.get(path + "&format=text")
+            self.assertEqual(r.status_code, 200)
+            lines = r.content.decode().splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertIn("ci37285320", lines[1])
+            self.assertIn("uw60916552", lines[2])
+            self.assertTrue(lines[2].endswith("|OREGON"))
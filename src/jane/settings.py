@@ -164,6 +164,13 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': False,
         },
+        # Set to INFO to log the time spent in each stage of saving a
+        # document.
+        'jane.documents': {
+            'handlers': ['console'],
+            'level': 'WARN',
+            'propagate': False,
+        },
     }
 }
 
@@ -282,6 +289,42 @@ JANE_ACCENT_COLOR = "#D9230F"
 # Constants written to StationXML files created by Jane.
 JANE_FDSN_STATIONXML_SENDER = "Jane"
 JANE_FDSN_STATIONXML_SOURCE = "Jane"
+# Resolution of the waveform preview traces in seconds.
+JANE_WAVEFORM_PREVIEW_RESOLUTION = 60
+# Number of processes rendering on-demand attachments, e.g. the StationXML
+# response plots. 0 renders them within the web server process. Other values
+# start a pool forked from the web server process.
+JANE_ATTACHMENT_RENDER_PROCESSES = 0
+# Rendered attachments are kept in Django's cache for this many seconds.
+JANE_ATTACHMENT_RENDER_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Store uploaded documents right away and index them in the background with
+# the process_indexing_queue management command.
+JANE_ASYNC_INDEXING = False
+# Indexing jobs still running after this many seconds are considered
+# abandoned, e.g. by a crashed worker, and are queued again.
+JANE_INDEXING_JOB_TIMEOUT = 60 * 60
+# Keep the data of documents and attachments in a content-addressed blob
+# store instead of the database, e.g.
+# JANE_BLOB_STORE = {
+#     "BACKEND": "jane.documents.blobstore.FileSystemBlobStore",
+#     "OPTIONS": {"location": "/path/to/blobs"}}
+JANE_BLOB_STORE = None
+# Store documents compressed with 'gzip' or 'zstd' (requires the zstandard
+# module). None stores them uncompressed.
+JANE_DOCUMENT_COMPRESSION = None
+# max-age in seconds of the Cache-Control header of fdsnws query responses.
+JANE_FDSNWS_CACHE_MAX_AGE = 0
+# Seconds to keep the results of fdsnws station and event queries in the
+# cache. 0 disables the cache. Use a cache backend shared by all processes,
+# e.g. memcached, as otherwise changed documents only invalidate the cache
+# of the process that changed them.
+JANE_FDSNWS_QUERY_CACHE_TIMEOUT = 0
+# Results larger than this many bytes are not cached.
+JANE_FDSNWS_QUERY_CACHE_MAX_SIZE = 10 * 1024 * 1024
+# The REST interface shows PostgreSQL's estimate of the number of traces,
+# documents, and indices if there are at least this many. Counting all
+# rows of huge tables is slow.
+JANE_ESTIMATED_COUNT_THRESHOLD = 100000
 
 ###############################################################################
 # Import local settings
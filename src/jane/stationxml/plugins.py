@@ -97,91 +97,107 @@ class StationIndexerPlugin(IndexerPluginPoint):
         "units_after_sensitivity": "str"
         }
 
+    # A channel epoch identifies an index across versions of a document.
+    identity_keys = ("network", "station", "location", "channel",
+                     "start_date")
+
+    # Keys with few distinct values that are cheap to list. Stations are
+    # almost unique per index.
+    facets = ("network", "location", "channel", "sensor_type",
+              "units_after_sensitivity")
+
+    # Response plots are expensive and thus only rendered upon request.
+    on_demand_attachments = {"response": "image/png"}
+
     def index(self, document):
         inv = obspy.read_inventory(document, format="stationxml")
-        indices = []
         for network in inv:
             for station in network:
                 for channel in station:
-                    if channel.response:
-                        if channel.response.instrument_sensitivity:
-                            _i = channel.response.instrument_sensitivity
-                            total_sensitivity = _i.value
-                            sensitivity_frequency = _i.frequency
-                            units_after_sensitivity = _i.input_units
-                        else:
-                            total_sensitivity = None
-                            sensitivity_frequency = None
-                            units_after_sensitivity = None
-                    else:
-                        total_sensitivity = None
-                        sensitivity_frequency = None
-                        units_after_sensitivity = None
-
-                    index = {
-                        # Information.
-                        "network": network.code,
-                        "network_name": network.description,
-                        "station": station.code,
-                        "station_name": station.description if
-                        station.description else station.site.name,
-                        "location": channel.location_code,
-                        "channel": channel.code,
-
-                        # Coordinates and orientation.
-                        "latitude": channel.latitude,
-                        "longitude": channel.longitude,
-                        "elevation_in_m": channel.elevation,
-                        "depth_in_m": channel.depth,
-                        "dip": channel.dip,
-                        "azimuth": channel.azimuth,
-
-                        # Dates.
-                        "start_date": str(channel.start_date),
-                        "end_date": str(channel.end_date)
-                        if channel.end_date is not None else None,
-                        # This is strictly speaking not channel level
-                        # information but needed to for a fast generation of
-                        # the station level fdsnws responses.
-                        "station_creation_date": str(station.creation_date)
-                        if station.creation_date is not None else None,
-
-                        # Characteristics.
-                        "sample_rate": float(channel.sample_rate),
-                        "sensor_type": channel.sensor.type
-                        if channel.sensor else None,
-                        # Some things have to be extracted from the response.
-                        "total_sensitivity": total_sensitivity,
-                        "sensitivity_frequency": sensitivity_frequency,
-                        "units_after_sensitivity": units_after_sensitivity,
-
-                        # Geometry for PostGIS.
-                        "geometry": [Point(channel.longitude,
-                                           channel.latitude)],
-                    }
-
-                    try:
-                        plt.close()
-                    except:
-                        pass
-
-                    # Sometimes fails. Wrap in try/except.
-                    try:
-                        # Plot response.
-                        with io.BytesIO() as plot:
-                            channel.plot(min_freq=1E-3, outfile=plot)
-                            plot.seek(0)
-                            index["attachments"] = {
-                                "response": {"content-type": "image/png",
-                                             "data": plot.read()}}
-                    except Exception:
-                        pass
-                    finally:
-                        try:
-                            plt.close()
-                        except:
-                            pass
-
-                    indices.append(index)
-
-        return indices
+                    yield _index_channel(network, station, channel)
+
+    def render_attachment(self, category, document, index):
+        if category != "response":
+            raise NotImplementedError
+        inv = obspy.read_inventory(document, format="stationxml")
+        inv = inv.select(network=index["network"], station=index["station"],
+                         location=index["location"],
+                         channel=index["channel"])
+        channels = [cha for net in inv for sta in net for cha in sta
+                    if str(cha.start_date) == index["start_date"]]
+        if not channels:
+            raise ValueError("Channel not found in the document.")
+
+        try:
+            plt.close()
+        except:
+            pass
+
+        try:
+            with io.BytesIO() as plot:
+                channels[0].plot(min_freq=1E-3, outfile=plot)
+                return plot.getvalue()
+        finally:
+            try:
+                plt.close()
+            except:
+                pass
+
+
+def _index_channel(network, station, channel):
+    """
+    Create the index for a single channel.
+    """
+    if channel.response:
+        if channel.response.instrument_sensitivity:
+            _i = channel.response.instrument_sensitivity
+            total_sensitivity = _i.value
+            sensitivity_frequency = _i.frequency
+            units_after_sensitivity = _i.input_units
+        else:
+            total_sensitivity = None
+            sensitivity_frequency = None
+            units_after_sensitivity = None
+    else:
+        total_sensitivity = None
+        sensitivity_frequency = None
+        units_after_sensitivity = None
+
+    return {
+        # Information.
+        "network": network.code,
+        "network_name": network.description,
+        "station": station.code,
+        "station_name": station.description if station.description else
+        station.site.name,
+        "location": channel.location_code,
+        "channel": channel.code,
+
+        # Coordinates and orientation.
+        "latitude": channel.latitude,
+        "longitude": channel.longitude,
+        "elevation_in_m": channel.elevation,
+        "depth_in_m": channel.depth,
+        "dip": channel.dip,
+        "azimuth": channel.azimuth,
+
+        # Dates.
+        "start_date": str(channel.start_date),
+        "end_date": str(channel.end_date)
+        if channel.end_date is not None else None,
+        # This is strictly speaking not channel level information but needed
+        # to for a fast generation of the station level fdsnws responses.
+        "station_creation_date": str(station.creation_date)
+        if station.creation_date is not None else None,
+
+        # Characteristics.
+        "sample_rate": float(channel.sample_rate),
+        "sensor_type": channel.sensor.type if channel.sensor else None,
+        # Some things have to be extracted from the response.
+        "total_sensitivity": total_sensitivity,
+        "sensitivity_frequency": sensitivity_frequency,
+        "units_after_sensitivity": units_after_sensitivity,
+
+        # Geometry for PostGIS.
+        "geometry": [Point(channel.longitude, channel.latitude)],
+    }
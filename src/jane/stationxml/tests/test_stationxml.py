@@ -117,17 +117,23 @@ class StationXMLPluginTestCase(TestCase):
             'total_sensitivity': 251650000.0,
             'units_after_sensitivity': 'M/S'})
 
-        # Everything should also have an attachment!
-        self.assertEqual(r["results"][0]["attachments_count"], 1)
-        self.assertEqual(r["results"][1]["attachments_count"], 1)
-        self.assertEqual(r["results"][2]["attachments_count"], 1)
-
-        # Get the attachment and make sure it is a picture.
-        r = self.client.get(r["results"][0]["attachments_url"])
-        r = r.json()["results"]
-        self.assertEqual(len(r), 1)
-        self.assertEqual(r[0]["content_type"], "image/png")
-        self.assertEqual(r[0]["category"], "response")
-        # Just make sure it at least returns something.
-        attachment_data = self.client.get(r[0]["data_url"]).content
-        self.assertTrue(len(attachment_data) > 100)
+        # The response plots are not stored while indexing.
+        self.assertEqual(r["results"][0]["attachments_count"], 0)
+        self.assertEqual(r["results"][1]["attachments_count"], 0)
+        self.assertEqual(r["results"][2]["attachments_count"], 0)
+
+        # But rendered upon request.
+        url = r["results"][0]["rendered_attachments"]["response"]
+        self.assertTrue(url.endswith(
+            "/rest/document_indices/stationxml/%i/rendered/response" %
+            r["results"][0]["id"]))
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], "image/png")
+        self.assertTrue(r.content.startswith(b"\x89PNG"))
+        # Now served from the cache.
+        self.assertEqual(self.client.get(url).content, r.content)
+
+        # Unknown categories do not exist.
+        r = self.client.get(url.replace("response", "other"))
+        self.assertEqual(r.status_code, 404)
@@ -117,11 +117,11 @@ class ContinuousTraceAdmin(admin.ModelAdmin):
                     'quality']
     search_fields = ['network', 'station', 'location', 'channel']
     list_filter = ['network', 'station', 'location', 'channel',
-                   'sampling_rate', 'quality']
+                   'sampling_rate', 'quality', 'preview_pending']
     readonly_fields = [
         'file', 'format_path', 'pos', 'network', 'station', 'location',
         'channel', 'starttime', 'endtime', 'duration', 'sampling_rate', 'npts',
-        'quality', 'preview_trace']
+        'quality', 'preview_pending', 'preview_trace']
 
     exclude = ["timerange"]
 
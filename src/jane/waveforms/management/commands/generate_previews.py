@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Generate the preview traces of indexed waveforms.
+
+The waveform indexer only extracts the meta information of each trace. The
+comparatively expensive preview traces are filled in by this command.
+"""
+import logging
+import multiprocessing
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ... import models
+from ... import process_waveforms
+
+
+django.setup()
+
+
+logger = logging.getLogger("jane-preview-generator")
+
+
+def _get_pending_files(limit):
+    """
+    Returns the ids of the files with pending previews.
+
+    Most recently modified files come first as these are most likely the
+    ones people want to look at.
+    """
+    return list(models.File.objects
+                .filter(traces__preview_pending=True)
+                .order_by("-mtime")
+                .values_list("id", flat=True)
+                .distinct()[:limit])
+
+
+def worker(args):
+    file_id, resolution = args
+    try:
+        count = process_waveforms.create_previews(file_id,
+                                                  resolution=resolution)
+    except Exception as e:
+        return file_id, 0, "%s - %s" % (str(type(e)), str(e))
+    return file_id, count, None
+
+
+def _run(options):
+    resolution = options["resolution"]
+
+    # Recompute everything, e.g. for a new resolution. This also rebuilds
+    # the preview pyramid from scratch.
+    if options["force"]:
+        models.PreviewPyramid.objects.all().delete()
+        count = models.ContinuousTrace.objects.update(preview_pending=True)
+        logger.info("Marked %i traces for preview generation." % count)
+
+    # Close the connection before forking - each process will open its own.
+    connection.close()
+    pool = multiprocessing.Pool(processes=options["number_of_cpus"])
+    try:
+        while True:
+            file_ids = _get_pending_files(limit=options["batch_size"])
+            if not file_ids:
+                if options["run_once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            a = time.time()
+            total = 0
+            for file_id, count, error in pool.imap_unordered(
+                    worker, [(_i, resolution) for _i in file_ids]):
+                if error:
+                    logger.error("Error creating previews for file %i: %s" %
+                                 (file_id, error))
+                    continue
+                total += count
+            logger.info("Created %i previews for %i files in %.2f seconds." %
+                        (total, len(file_ids), time.time() - a))
+    except KeyboardInterrupt:
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+
+
+class Command(BaseCommand):
+    help = "Generate the preview traces of indexed waveforms."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', type=int, dest='number_of_cpus',
+            help="Number of CPUs used to generate the previews.",
+            default=multiprocessing.cpu_count())
+        parser.add_argument(
+            '-r', '--resolution', type=float, default=None,
+            help="Resolution of the previews in seconds. Defaults to the "
+                 "JANE_WAVEFORM_PREVIEW_RESOLUTION setting.")
+        parser.add_argument(
+            '-b', '--batch-size', type=int, default=100,
+            help="Number of files handed to the worker processes at once.")
+        parser.add_argument(
+            '-i', '--poll-interval', type=float, default=10.0,
+            help="Poll interval in seconds when waiting for newly indexed "
+                 "waveforms (default is 10).")
+        parser.add_argument(
+            '-1', '--run-once', action='store_true',
+            help="Generate all pending previews once and quit afterwards.")
+        parser.add_argument(
+            '-f', '--force', action='store_true',
+            help="Recompute the previews of all traces and the preview "
+                 "pyramid, e.g. after changing the resolution.")
+
+    def handle(self, *args, **kwargs):
+        # set level of verbosity
+        if kwargs["verbosity"] > 1:
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.INFO)
+
+        # Prevent propagating to higher loggers.
+        logger.propagate = 0
+
+        ch = logging.StreamHandler()
+        FORMAT = "[%(asctime)s] %(levelname)s: %(message)s"
+        ch.setFormatter(logging.Formatter(FORMAT))
+        logger.addHandler(ch)
+
+        _run(kwargs)
@@ -42,7 +42,7 @@ class WaveformFileCrawler(object):
         if file:
             try:
                 f = models.File.objects.get(path__name=path, name=file)
-                f.delete()
+                process_waveforms.delete_files([f])
                 logger.debug("Deleted file '%s'." % os.path.join(path, file))
             except models.File.DoesNotExist:
                 logger.error("Error deleting file '%s': Not part of the "
@@ -50,6 +50,7 @@ class WaveformFileCrawler(object):
         else:
             try:
                 p = models.Path.objects.get(name=path)
+                process_waveforms.delete_files(p.files.all())
                 p.delete()
                 logger.debug("Deleted path '%s'." % path)
             except models.Path.DoesNotExist:
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waveforms', '0002_auto_20160706_1508'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='continuoustrace',
+            name='preview_pending',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        # Existing previews are already done.
+        migrations.RunSQL(
+            sql="UPDATE waveforms_continuoustrace "
+                "SET preview_pending = (preview_trace IS NULL)",
+            reverse_sql=migrations.RunSQL.noop),
+    ]
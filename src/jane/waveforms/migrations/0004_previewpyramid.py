@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waveforms', '0003_continuoustrace_preview_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewPyramid',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(blank=True, db_index=True, max_length=2)),
+                ('station', models.CharField(blank=True, db_index=True, max_length=5)),
+                ('location', models.CharField(blank=True, db_index=True, max_length=2)),
+                ('channel', models.CharField(blank=True, db_index=True, max_length=3)),
+                ('day', models.DateField(db_index=True)),
+                ('level', models.IntegerField()),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['network', 'station', 'location', 'channel', 'level', 'day'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='previewpyramid',
+            unique_together=set([('network', 'station', 'location', 'channel', 'level', 'day')]),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import numpy as np
+
+
+def pack_previews(apps, schema_editor):
+    ContinuousTrace = apps.get_model("waveforms", "ContinuousTrace")
+    previews = ContinuousTrace.objects.exclude(preview_trace=None) \
+        .values_list("id", "preview_trace")
+    for pk, preview in previews.iterator():
+        ContinuousTrace.objects.filter(pk=pk).update(
+            preview_data=np.require(preview, dtype="<f4").tobytes())
+
+
+def unpack_previews(apps, schema_editor):
+    ContinuousTrace = apps.get_model("waveforms", "ContinuousTrace")
+    previews = ContinuousTrace.objects.exclude(preview_data=None) \
+        .values_list("id", "preview_data")
+    for pk, preview in previews.iterator():
+        ContinuousTrace.objects.filter(pk=pk).update(
+            preview_trace=np.frombuffer(preview, dtype="<f4").tolist())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('waveforms', '0004_previewpyramid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='continuoustrace',
+            name='preview_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_previews, unpack_previews),
+        migrations.RemoveField(
+            model_name='continuoustrace',
+            name='preview_trace',
+        ),
+    ]
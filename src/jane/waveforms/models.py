@@ -2,16 +2,25 @@
 
 import re
 import os
+import uuid
+
+import numpy as np
 
 from django.conf import settings
 from django.core.exceptions import ValidationError, ImproperlyConfigured
-from django.db import models
-from django.contrib.postgres.fields import DateTimeRangeField, ArrayField
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.contrib.postgres.fields import DateTimeRangeField
 
-from jane.waveforms.utils import to_datetime
+from jane.waveforms import pyramid
+from jane.waveforms.utils import to_datetime, to_timestamp
 
 User = settings.AUTH_USER_MODEL
 
+# Storage type of the preview traces.
+PREVIEW_DTYPE = np.dtype("<f4")
+
 
 class Path(models.Model):
     name = models.CharField(max_length=255, primary_key=True,
@@ -89,8 +98,10 @@ class ContinuousTrace(models.Model):
     duration = models.FloatField('Duration (s)', db_index=True, default=0)
     sampling_rate = models.FloatField(default=1)
     npts = models.IntegerField(verbose_name="Samples", default=0)
-    preview_trace = ArrayField(base_field=models.FloatField(), blank=True,
-                               null=True)
+    # Packed little endian float32 array - use the preview_trace property.
+    preview_data = models.BinaryField(blank=True, null=True)
+    # Previews are generated asynchronously after the trace has been indexed.
+    preview_pending = models.BooleanField(default=True, db_index=True)
     quality = models.CharField(max_length=1, null=True, blank=True,
                                db_index=True)
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
@@ -106,10 +117,55 @@ class ContinuousTrace(models.Model):
                            'timerange']
 
     def timed_preview_trace(self):
-        num_samples = (len(self.preview_trace) - 1)
-        delta = (self.timerange.upper - self.timerange.lower) / num_samples
-        return [((self.timerange.lower + (delta * i)).isoformat(), v / 2)
-                for i, v in enumerate(self.preview_trace)]
+        # Generate the preview upon first access if it has not yet been
+        # created by the preview queue.
+        if self.preview_pending:
+            try:
+                self.create_preview()
+            except Exception:
+                return []
+        preview = self.preview_trace
+        if preview is None or not len(preview):
+            return []
+        values = preview.astype(np.float64) / 2.0
+        times = np.linspace(
+            to_timestamp(self.timerange.lower),
+            to_timestamp(self.timerange.upper), len(values))
+        times = np.round(times * 1E6).astype(np.int64) \
+            .astype("datetime64[us]").astype(str)
+        # Explicitly in UTC - otherwise browsers interpret them as local time.
+        times = [_i + "Z" for _i in times.tolist()]
+        return list(zip(times, values.tolist()))
+
+    def create_preview(self, resolution=None):
+        """
+        Create the preview trace right now and store it.
+
+        Previews are usually created by the ``generate_previews`` management
+        command - this is the fallback if it has not yet been run for this
+        trace.
+        """
+        # Avoid circular imports.
+        from jane.waveforms.process_waveforms import create_previews
+
+        create_previews(self.file, resolution=resolution,
+                        force=not self.preview_pending)
+        self.refresh_from_db(fields=["preview_data", "preview_pending"])
+
+    @property
+    def preview_trace(self):
+        """
+        The preview trace as a read-only NumPy array or None.
+
+        The array directly wraps the stored bytes without copying them.
+        """
+        if self.preview_data is None:
+            return None
+        return np.frombuffer(self.preview_data, dtype=PREVIEW_DTYPE)
+
+    @preview_trace.setter
+    def preview_trace(self, value):
+        self.preview_data = pack_preview(value)
 
     @property
     def seed_id(self):
@@ -180,9 +236,51 @@ class ContinuousTrace(models.Model):
             row.save()
             count += 1
 
+        Revision.objects.bump()
         return count
 
 
+def pack_preview(data):
+    """
+    Pack a preview trace to the bytes stored in the database.
+    """
+    if data is None:
+        return None
+    return np.require(data, dtype=PREVIEW_DTYPE).tobytes()
+
+
+class PreviewPyramid(models.Model):
+    """
+    One day of the min/max preview pyramid of a single channel at one level.
+
+    See ``jane.waveforms.pyramid`` for the layout of the data.
+    """
+    network = models.CharField(max_length=2, db_index=True, blank=True)
+    station = models.CharField(max_length=5, db_index=True, blank=True)
+    location = models.CharField(max_length=2, db_index=True, blank=True)
+    channel = models.CharField(max_length=3, db_index=True, blank=True)
+    day = models.DateField(db_index=True)
+    # Length of each bucket in seconds.
+    level = models.IntegerField()
+    # Packed little endian float32 array with interleaved min/max values.
+    data = models.BinaryField()
+
+    def __str__(self):
+        return "%s.%s.%s.%s | %s | %i s" % (
+            self.network, self.station, self.location, self.channel,
+            self.day, self.level)
+
+    class Meta:
+        ordering = ['network', 'station', 'location', 'channel', 'level',
+                    'day']
+        unique_together = ['network', 'station', 'location', 'channel',
+                           'level', 'day']
+
+    @property
+    def values(self):
+        return pyramid.unpack(self.data, self.level)
+
+
 class Mapping(models.Model):
     timerange = DateTimeRangeField(verbose_name="Temporal Range (UTC)",
                                    db_index=True)
@@ -251,3 +349,51 @@ class Restriction(models.Model):
         self.network = self.network.upper().strip()
         self.station = self.station.upper().strip()
         super(Restriction, self).save(*args, **kwargs)
+
+
+class RevisionManager(models.Manager):
+    def get_token(self):
+        """
+        The current revision token or an empty string if the waveforms
+        have never been changed.
+        """
+        token = self.filter(pk=1).values_list("token", flat=True).first()
+        return token or ""
+
+    def bump(self):
+        """
+        Start a new revision.
+
+        A random token instead of a counter ensures that recreated databases
+        do not repeat earlier revisions.
+        """
+        token = uuid.uuid4().hex
+        if not self.filter(pk=1).update(token=token):
+            self.get_or_create(pk=1, defaults={"token": token})
+
+
+class Revision(models.Model):
+    """
+    Single row whose token changes whenever the indexed waveform files, the
+    mappings, or the restrictions change. Cheap validator of the results of
+    the dataselect service that does not need to scan the waveform index.
+    """
+    token = models.CharField(max_length=32)
+    objects = RevisionManager()
+
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+@receiver(post_save, sender=Mapping)
+@receiver(post_delete, sender=Mapping)
+@receiver(post_save, sender=Restriction)
+@receiver(post_delete, sender=Restriction)
+@receiver(m2m_changed, sender=Restriction.users.through)
+def bump_revision(sender, **kwargs):
+    """
+    Traces are only changed along with their files or by
+    ``ContinuousTrace.update_all_mappings()``. Bumped once the transaction
+    commits so concurrent indexers do not wait for the lock of the revision
+    row.
+    """
+    transaction.on_commit(Revision.objects.bump)
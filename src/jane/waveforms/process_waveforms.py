@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import datetime
 import os
 
+from django.conf import settings
 from django.db import transaction
 from obspy.core import read
 from obspy.core.preview import create_preview
@@ -9,7 +12,7 @@ from psycopg2.extras import DateTimeTZRange
 
 from jane.exceptions import JaneWaveformTaskException
 
-from . import models
+from . import models, pyramid
 from .utils import to_datetime
 
 
@@ -54,7 +57,7 @@ def process_file(filename):
     except:
         # Delete if invalid file.
         if file is not None:
-            file.delete()
+            delete_files([file])
         # Reraise the exception.
         raise
 
@@ -63,7 +66,7 @@ def process_file(filename):
         raise JaneWaveformTaskException(msg % filename)
         # Delete if invalid file.
         if file is not None:
-            file.delete()
+            delete_files([file])
 
     # Log channels for example are special as they have no sampling rate.
     if any(tr.stats.sampling_rate == 0 for tr in stream):
@@ -73,7 +76,7 @@ def process_file(filename):
         if len(ids) != 1:
             # Delete if invalid file.
             if file is not None:
-                file.delete()
+                delete_files([file])
             raise ValueError("File has a trace with sampling rate zero "
                              "and more then one different id.")
 
@@ -85,9 +88,8 @@ def process_file(filename):
         if file is None:
             path_obj = models.Path.objects.get_or_create(
                 name=os.path.dirname(os.path.abspath(filename)))[0]
-            models.File.objects. \
-                filter(path=path_obj, name=os.path.basename(filename)). \
-                delete()
+            delete_files(models.File.objects.filter(
+                path=path_obj, name=os.path.basename(filename)))
             file = models.File.objects. \
                 create(path=path_obj, name=os.path.basename(filename))
 
@@ -124,7 +126,8 @@ def process_file(filename):
                 "npts": sum(tr.stats.npts for tr in stream),
                 "duration": endtime - starttime,
                 "quality": quality,
-                "preview_trace": None,
+                # Log channels have no meaningful preview.
+                "preview_pending": False,
                 "pos": 0}
         else:
             # get number of gaps and overlaps per file
@@ -138,15 +141,6 @@ def process_file(filename):
                 except AttributeError:
                     quality = None
 
-                # Preview is optional. For some traces, e.g. LOG channels it
-                # does not work.
-                try:
-                    preview_trace = create_preview(trace, 60)
-                except:
-                    preview_trace = None
-                else:
-                    preview_trace = list(map(float, preview_trace.data))
-
                 traces_in_file[pos] = {
                     "starttime": trace.stats.starttime,
                     "endtime": trace.stats.endtime,
@@ -158,7 +152,8 @@ def process_file(filename):
                     "npts": trace.stats.npts,
                     "duration": trace.stats.endtime - trace.stats.starttime,
                     "quality": quality,
-                    "preview_trace": preview_trace,
+                    # Previews are generated later on by create_previews().
+                    "preview_pending": True,
                     "pos": pos}
 
         # Get all existing traces.
@@ -169,6 +164,9 @@ def process_file(filename):
                 # Delete in the dictionary.
                 del traces_in_file[tr_db.pos]
 
+                # The data of the trace changed.
+                invalidate_preview_pyramid([tr_db])
+
                 tr_db.timerange = DateTimeTZRange(
                     lower=tr["starttime"].datetime,
                     upper=tr["endtime"].datetime)
@@ -180,13 +178,15 @@ def process_file(filename):
                 tr_db.npts = tr["npts"]
                 tr_db.duration = tr["duration"]
                 tr_db.quality = tr["quality"]
-                tr_db.preview_trace = tr["preview_trace"]
+                tr_db.preview_data = None
+                tr_db.preview_pending = tr["preview_pending"]
                 tr_db.pos = tr["pos"]
                 tr_db.save()
 
             # If it does not exist in the waveform file, delete it here as
             # it is (for whatever reason) no longer in the file..
             else:
+                invalidate_preview_pyramid([tr_db])
                 tr_db.delete()
 
         # Add remaining items.
@@ -204,6 +204,155 @@ def process_file(filename):
             tr_db.npts = tr["npts"]
             tr_db.duration = tr["duration"]
             tr_db.quality = tr["quality"]
-            tr_db.preview_trace = tr["preview_trace"]
+            tr_db.preview_pending = tr["preview_pending"]
             tr_db.pos = tr["pos"]
             tr_db.save()
+
+
+def create_previews(file, resolution=None, force=False):
+    """
+    Create the preview traces for all traces of a single waveform file.
+
+    This is decoupled from :func:`process_file` as it is fairly expensive
+    and not required to make the waveforms available. The file is read only
+    once for all of its traces.
+
+    :param file: The file either as a ``jane.waveforms.models.File``
+        instance or its primary key.
+    :param resolution: The resolution of the previews in seconds. Defaults
+        to ``settings.JANE_WAVEFORM_PREVIEW_RESOLUTION``.
+    :param force: If True, the previews for all traces of the file will be
+        recomputed, otherwise only the pending ones.
+
+    Returns the number of traces with an updated preview.
+    """
+    if not isinstance(file, models.File):
+        file = models.File.objects.select_related("path").get(pk=file)
+    if resolution is None:
+        resolution = settings.JANE_WAVEFORM_PREVIEW_RESOLUTION
+
+    traces = models.ContinuousTrace.objects.filter(file=file)
+    if not force:
+        traces = traces.filter(preview_pending=True)
+    traces = list(traces.only("id", "pos", "network", "station",
+                              "location", "channel"))
+    if not traces:
+        return 0
+
+    try:
+        stream = read(file.absolute_path)
+    except:
+        # The file might have vanished in the meanwhile - it will be
+        # cleaned up by the indexer.
+        models.ContinuousTrace.objects.filter(
+            pk__in=[_i.pk for _i in traces]).update(preview_pending=False)
+        raise
+
+    for tr_db in traces:
+        # Preview is optional. For some traces, e.g. LOG channels it does
+        # not work.
+        try:
+            preview_data = models.pack_preview(
+                create_preview(stream[tr_db.pos], resolution).data)
+        except:
+            preview_data = None
+        # Update directly to not trigger the mappings in the save() method.
+        models.ContinuousTrace.objects.filter(pk=tr_db.pk).update(
+            preview_data=preview_data, preview_pending=False)
+
+        if preview_data is not None:
+            update_preview_pyramid(tr_db, stream[tr_db.pos])
+
+    return len(traces)
+
+
+def delete_files(files):
+    """
+    Delete waveform files together with their traces and remove the traces
+    from the preview pyramid.
+
+    Use this instead of deleting the files directly - the pyramid would
+    otherwise keep their data.
+
+    :param files: Iterable or queryset of ``jane.waveforms.models.File``
+        objects.
+    """
+    pks = [_i.pk for _i in files]
+    if not pks:
+        return
+    with transaction.atomic():
+        invalidate_preview_pyramid(
+            models.ContinuousTrace.objects.filter(file__in=pks).only(
+                "network", "station", "location", "channel", "timerange",
+                "preview_pending").iterator())
+        models.File.objects.filter(pk__in=pks).delete()
+
+
+def invalidate_preview_pyramid(traces):
+    """
+    Remove the days of the min/max preview pyramid the given traces
+    contributed to. Merging only ever widens the minima and maxima so the
+    data of removed or replaced traces would otherwise persist. All other
+    traces of these channels and days get pending previews so the
+    ``generate_previews`` command rebuilds the removed days.
+
+    :param traces: The ``jane.waveforms.models.ContinuousTrace`` objects
+        about to be deleted or replaced.
+    """
+    days = collections.defaultdict(set)
+    pks = []
+    for trace in traces:
+        pks.append(trace.pk)
+        # Pending previews have not yet been merged.
+        if trace.preview_pending:
+            continue
+        first = trace.timerange.lower.date()
+        last = trace.timerange.upper.date()
+        days[(trace.network, trace.station, trace.location,
+              trace.channel)].update(
+            first + datetime.timedelta(days=_i)
+            for _i in range((last - first).days + 1))
+
+    for (network, station, location, channel), channel_days in days.items():
+        models.PreviewPyramid.objects.filter(
+            network=network, station=station, location=location,
+            channel=channel, day__in=channel_days).delete()
+        start = datetime.datetime.combine(min(channel_days), datetime.time())
+        end = datetime.datetime.combine(
+            max(channel_days) + datetime.timedelta(days=1), datetime.time())
+        models.ContinuousTrace.objects.filter(
+            network=network, station=station, location=location,
+            channel=channel, preview_pending=False,
+            timerange__overlap=DateTimeTZRange(start, end)) \
+            .exclude(pk__in=pks).update(preview_pending=True)
+
+
+def update_preview_pyramid(trace_obj, trace):
+    """
+    Merge a trace into the min/max preview pyramid of its channel.
+
+    :param trace_obj: The ``jane.waveforms.models.ContinuousTrace`` object
+        of the trace. Its (potentially mapped) SEED identifier is used.
+    :param trace: The actual trace as an ObsPy Trace object.
+    """
+    epoch = datetime.date(1970, 1, 1)
+    levels = pyramid.pyramid_for_trace(
+        trace.data, trace.stats.starttime.timestamp,
+        trace.stats.sampling_rate)
+    for level, days in levels.items():
+        for day, positions, mins, maxs in days:
+            # Lock the row as multiple files can contribute to the same day.
+            with transaction.atomic():
+                obj = models.PreviewPyramid.objects.select_for_update() \
+                    .get_or_create(
+                        network=trace_obj.network,
+                        station=trace_obj.station,
+                        location=trace_obj.location,
+                        channel=trace_obj.channel,
+                        level=level,
+                        day=epoch + datetime.timedelta(days=day),
+                        defaults={"data": pyramid.pack(
+                            pyramid.empty_day(level))})[0]
+                obj.data = pyramid.pack(
+                    pyramid.merge(obj.values, positions, mins, maxs))
+                obj.save(update_fields=["data"])
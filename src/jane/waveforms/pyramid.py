@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Min/max preview pyramid of the indexed waveforms.
+
+For each channel and day the minimum and maximum of the waveform data are
+stored in fixed, absolutely aligned time buckets at a number of levels.
+Each level is a packed array of little endian 32 bit floats with interleaved
+minimum and maximum values per bucket. Buckets without data are NaN.
+
+Everything in here only operates on NumPy arrays and POSIX timestamps - the
+database handling happens in ``jane.waveforms.process_waveforms`` and the
+views.
+"""
+import numpy as np
+
+
+# Length of the buckets of each level in seconds. Each one must be a
+# multiple of the first one and divide a day.
+LEVELS = (60, 600, 3600, 86400)
+
+SECONDS_PER_DAY = 86400
+
+DTYPE = np.dtype("<f4")
+
+
+def buckets_per_day(level):
+    return SECONDS_PER_DAY // level
+
+
+def empty_day(level):
+    """
+    Array of shape (N, 2) for one day at the given level with no data.
+    """
+    return np.full((buckets_per_day(level), 2), np.nan, dtype=DTYPE)
+
+
+def pack(day):
+    return np.ascontiguousarray(day, dtype=DTYPE).tobytes()
+
+
+def unpack(data, level):
+    """
+    Read the packed bytes of one day without copying them.
+    """
+    return np.frombuffer(data, dtype=DTYPE).reshape(
+        buckets_per_day(level), 2)
+
+
+def minmax_buckets(data, starttime, sampling_rate, level=LEVELS[0]):
+    """
+    Compute the minimum and maximum of a trace in absolutely aligned time
+    buckets.
+
+    :param data: The data of the trace.
+    :param starttime: The time of the first sample as a POSIX timestamp.
+    :param sampling_rate: The sampling rate of the trace.
+    :param level: The length of each bucket in seconds.
+
+    Returns the absolute bucket indices, i.e. the bucket start time divided
+    by the bucket length, and the corresponding minima and maxima.
+    """
+    data = np.asanyarray(data)
+    npts = len(data)
+    if not npts or not sampling_rate:
+        empty = np.array([], dtype=DTYPE)
+        return np.array([], dtype=np.int64), empty, empty
+    endtime = starttime + (npts - 1) / sampling_rate
+
+    first = int(np.floor(starttime / level))
+    last = int(np.floor(endtime / level))
+    indices = np.arange(first, last + 1, dtype=np.int64)
+
+    # Index of the first sample in each bucket.
+    starts = np.ceil(
+        (indices * float(level) - starttime) * sampling_rate - 1E-6)
+    starts = np.clip(starts, 0, npts).astype(np.int64)
+    starts[0] = 0
+    # Buckets might not contain any sample for low sampling rates.
+    keep = np.concatenate([starts[1:], [npts]]) > starts
+    indices = indices[keep]
+    starts = starts[keep]
+
+    mins = np.minimum.reduceat(data, starts).astype(DTYPE)
+    maxs = np.maximum.reduceat(data, starts).astype(DTYPE)
+    return indices, mins, maxs
+
+
+def coarsen(indices, mins, maxs, from_level, to_level):
+    """
+    Aggregate absolute buckets of one level to a coarser level.
+    """
+    if not len(indices) or from_level == to_level:
+        return indices, mins, maxs
+    new_indices = indices // (to_level // from_level)
+    starts = np.concatenate([
+        [0], np.nonzero(new_indices[1:] != new_indices[:-1])[0] + 1])
+    return (new_indices[starts],
+            np.fmin.reduceat(mins, starts),
+            np.fmax.reduceat(maxs, starts))
+
+
+def split_days(indices, mins, maxs, level):
+    """
+    Split absolute buckets into days.
+
+    Yields the day (as the number of days since 1970-01-01) and the
+    bucket indices within that day and the values.
+    """
+    per_day = buckets_per_day(level)
+    days = indices // per_day
+    for day in np.unique(days):
+        mask = days == day
+        yield int(day), indices[mask] - day * per_day, mins[mask], maxs[mask]
+
+
+def merge(day, positions, mins, maxs):
+    """
+    Merge new buckets into the array of one day. Returns a new array.
+    """
+    day = np.array(day, dtype=DTYPE)
+    day[positions, 0] = np.fmin(day[positions, 0], mins)
+    day[positions, 1] = np.fmax(day[positions, 1], maxs)
+    return day
+
+
+def pyramid_for_trace(data, starttime, sampling_rate):
+    """
+    Compute all levels of the pyramid for a single trace.
+
+    Returns a dictionary mapping each level to a list of
+    ``(day, positions, mins, maxs)`` tuples.
+    """
+    base = minmax_buckets(data, starttime, sampling_rate, LEVELS[0])
+    pyramid = {}
+    for level in LEVELS:
+        buckets = coarsen(*base, from_level=LEVELS[0], to_level=level)
+        pyramid[level] = list(split_days(*buckets, level=level))
+    return pyramid
+
+
+def choose_level(duration, width):
+    """
+    Choose the coarsest level that still yields at least ``width`` buckets
+    for the given duration in seconds.
+    """
+    ideal = float(duration) / max(width, 1)
+    candidates = [_i for _i in LEVELS if _i <= ideal]
+    if not candidates:
+        return LEVELS[0]
+    return max(candidates)
+
+
+def assemble(days, first_day, last_day, level, starttime, endtime, width):
+    """
+    Assemble the stored days of one level into the minima and maxima for a
+    time window at the requested number of pixels.
+
+    :param days: Dictionary mapping the day number to the unpacked day
+        arrays. Missing days have no data.
+    :param first_day: First day number of the window.
+    :param last_day: Last day number of the window.
+    :param starttime: Start of the window as a POSIX timestamp.
+    :param endtime: End of the window as a POSIX timestamp.
+    :param width: The number of requested pixels.
+
+    Returns the start time of the first bucket, the length of each output
+    bucket in seconds, and the minima and maxima.
+    """
+    per_day = buckets_per_day(level)
+    full = np.full(((last_day - first_day + 1) * per_day, 2), np.nan,
+                   dtype=DTYPE)
+    for day, values in days.items():
+        offset = (day - first_day) * per_day
+        full[offset:offset + per_day] = values
+
+    first = int(np.floor(starttime / level)) - first_day * per_day
+    last = int(np.ceil(endtime / level)) - first_day * per_day
+    first = max(first, 0)
+    last = min(max(last, first + 1), len(full))
+    full = full[first:last]
+
+    bucket_length = float(level)
+    if len(full) > width:
+        starts = np.unique(
+            np.linspace(0, len(full), width + 1)[:-1].astype(np.int64))
+        bucket_length = level * len(full) / float(len(starts))
+        full = np.stack([np.fmin.reduceat(full[:, 0], starts),
+                         np.fmax.reduceat(full[:, 1], starts)], axis=1)
+
+    return ((first_day * per_day + first) * level, bucket_length,
+            full[:, 0], full[:, 1])
@@ -7,6 +7,8 @@ from jane.waveforms import models
 class WaveformSerializer(serializers.HyperlinkedModelSerializer):
     containing_file = serializers.HyperlinkedIdentityField(
         view_name='rest_waveforms-file', format='binary')
+    preview = serializers.HyperlinkedIdentityField(
+        view_name='rest_waveforms-preview')
     url = serializers.HyperlinkedIdentityField(
         view_name='rest_waveforms-detail',
         lookup_field='pk'
@@ -21,7 +23,7 @@ class WaveformSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = models.ContinuousTrace
-        fields = ['url', 'containing_file',
+        fields = ['url', 'containing_file', 'preview',
                   'network', 'station', 'location', 'channel',
                   'original_network', 'original_station', 'original_location',
                   'original_channel', 'starttime', 'endtime', 'duration',
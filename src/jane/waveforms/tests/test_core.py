@@ -5,11 +5,13 @@ import os
 
 from django.core.exceptions import ValidationError
 from django.test.testcases import TestCase
+import numpy as np
 from psycopg2._range import DateTimeTZRange
 import obspy
 
 from jane.waveforms import models
-from jane.waveforms.process_waveforms import process_file
+from jane.waveforms.process_waveforms import (create_previews, delete_files,
+                                              process_file)
 
 
 class CoreTestCase(TestCase):
@@ -125,6 +127,94 @@ class CoreTestCase(TestCase):
         self.assertEqual(expected_ids, ids)
         delete_indexed_waveforms()
 
+    def test_deferred_preview_generation(self):
+        filename = os.path.join(os.path.dirname(os.path.dirname(self.path)),
+                                "fdsnws", "tests", "data", "TA.A25A.mseed")
+        process_file(filename)
+
+        # Indexing does not create the previews.
+        traces = models.ContinuousTrace.objects.all()
+        self.assertEqual(traces.filter(preview_pending=False).count(), 0)
+        self.assertEqual(traces.exclude(preview_data=None).count(), 0)
+
+        file = models.File.objects.get()
+        self.assertEqual(create_previews(file), traces.count())
+        self.assertEqual(traces.filter(preview_pending=True).count(), 0)
+        self.assertTrue(traces.exclude(preview_data=None).count())
+
+        # Nothing left to do.
+        self.assertEqual(create_previews(file), 0)
+
+        # Reindexing the file marks the previews as pending again.
+        file.delete()
+        process_file(filename)
+        tr = models.ContinuousTrace.objects.filter(channel="BHZ").first()
+        self.assertTrue(tr.preview_pending)
+        # They are generated upon first access.
+        preview = tr.timed_preview_trace()
+        self.assertTrue(preview)
+        self.assertFalse(tr.preview_pending)
+        # The times are explicitly in UTC.
+        self.assertEqual(preview[0][0],
+                         tr.timerange.lower.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+
+    def test_preview_route(self):
+        filename = os.path.join(os.path.dirname(os.path.dirname(self.path)),
+                                "fdsnws", "tests", "data", "TA.A25A.mseed")
+        process_file(filename)
+        tr = models.ContinuousTrace.objects.filter(channel="BHZ").first()
+
+        # Created upon first access.
+        r = self.client.get("/rest/waveforms/%i/preview" % tr.pk)
+        self.assertEqual(r.status_code, 200)
+        data = r.json()
+        self.assertEqual(data["starttime"], "2010-03-24T23:59:30.000000Z")
+        tr.refresh_from_db()
+        self.assertFalse(tr.preview_pending)
+        np.testing.assert_allclose(data["data"], tr.preview_trace)
+
+        r = self.client.get("/rest/waveforms/%i/preview" % tr.pk,
+                            {"format": "binary"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["X-Jane-Preview-Dtype"], "<f4")
+        self.assertEqual(int(r["X-Jane-Preview-Npts"]), len(data["data"]))
+        np.testing.assert_equal(
+            np.frombuffer(r.content, dtype="<f4"), tr.preview_trace)
+
+    def test_preview_pyramid(self):
+        filename = os.path.join(os.path.dirname(os.path.dirname(self.path)),
+                                "fdsnws", "tests", "data", "TA.A25A.mseed")
+        process_file(filename)
+        create_previews(models.File.objects.get())
+
+        # The BHZ trace crosses midnight - one row per level and day.
+        rows = models.PreviewPyramid.objects.filter(channel="BHZ")
+        self.assertEqual(rows.count(), 8)
+
+        tr = obspy.read(filename).select(channel="BHZ")[0]
+        r = self.client.get("/rest/waveforms/previews", {
+            "network": "TA", "station": "A25A", "location": "",
+            "channel": "BHZ", "starttime": "2010-03-24T23:59:00",
+            "endtime": "2010-03-25T00:02:00", "width": 3})
+        self.assertEqual(r.status_code, 200)
+        data = r.json()
+        self.assertEqual(data["level"], 60)
+        self.assertEqual(data["starttime"], "2010-03-24T23:59:00.000000Z")
+        self.assertEqual(len(data["min"]), 3)
+        self.assertEqual(min(data["min"]), tr.data.min())
+        self.assertEqual(max(data["max"]), tr.data.max())
+
+        # Unknown channels have no preview.
+        r = self.client.get("/rest/waveforms/previews", {
+            "network": "TA", "station": "A25A", "location": "",
+            "channel": "XXX", "starttime": "2010-03-24T23:59:00",
+            "endtime": "2010-03-25T00:02:00", "width": 3})
+        self.assertEqual(r.status_code, 404)
+
+        # Deleting the file removes its data from the pyramid.
+        delete_files(models.File.objects.all())
+        self.assertEqual(models.PreviewPyramid.objects.count(), 0)
+
     def test_creation_of_mappings(self):
         # First create two compatible ones.
         models.Mapping(
@@ -3,6 +3,7 @@
 Base utilities.
 """
 
+import calendar
 import datetime
 
 
@@ -10,3 +11,10 @@ def to_datetime(timestamp):
     if not timestamp:
         return None
     return datetime.datetime.fromtimestamp(float(timestamp))
+
+
+def to_timestamp(value):
+    """
+    POSIX timestamp of a naive datetime object in UTC.
+    """
+    return calendar.timegm(value.timetuple()) + value.microsecond / 1E6
@@ -1,11 +1,24 @@
 # -*- coding: utf-8 -*-
+import collections
+import datetime
+import math
 import os
 
+from django.http import Http404
+import numpy as np
+import obspy
 from rest_framework import viewsets, renderers, filters
 from rest_framework.response import Response
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 
-from jane.waveforms import models, serializer
+from jane.exceptions import JaneInvalidRequestException
+from jane.jane.pagination import KeysetPagination
+from jane.jane.utils import file_response
+from jane.waveforms import models, pyramid, serializer
+
+
+# Upper limit for the number of pixels of the preview pyramid route.
+MAX_PREVIEW_WIDTH = 10000
 
 
 class PNGRenderer(renderers.BaseRenderer):
@@ -29,22 +42,23 @@ class WaveformView(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         query = models.ContinuousTrace.objects
 
+        for restriction in self._get_restrictions():
+            query = query.exclude(network=restriction.network,
+                                  station=restriction.station)
+
+        return query.all()
+
+    def _get_restrictions(self):
         # Limit the queryset depending on the user. If no user is given,
         # all restrictions apply, otherwise only the ones which don't have
         # the user apply.
         user = self.request.user
         if user.is_anonymous():
-            restrictions = models.Restriction.objects.all()
-        else:
-            restrictions = models.Restriction.objects.exclude(users=user)
-
-        for restriction in restrictions:
-            query = query.exclude(network=restriction.network,
-                                  station=restriction.station)
-
-        return query.all()
+            return models.Restriction.objects.all()
+        return models.Restriction.objects.exclude(users=user)
 
     serializer_class = serializer.WaveformSerializer
+    pagination_class = KeysetPagination
     filter_backends = (filters.OrderingFilter,)
     ordering_fields = '__all__'
 
@@ -55,11 +69,118 @@ class WaveformView(viewsets.ReadOnlyModelViewSet):
 
     @detail_route(renderer_classes=[BinaryRenderer])
     def file(self, request, *args, **kwargs):
+        """
+        Streams the waveform file with support for range and conditional
+        requests. The ETag is derived from the modification time and size
+        of the file.
+        """
         file_obj = self.get_object().file
         filename = os.path.join(file_obj.path.name, file_obj.name)
-        headers = {
-            "Content-Disposition":
-                'attachment; filename="%s"' % os.path.basename(filename)
-        }
-        with open(filename, "rb") as fh:
-            return Response(fh.read(), headers=headers)
+        stats = os.stat(filename)
+        return file_response(
+            request, lambda: open(filename, "rb"), size=stats.st_size,
+            content_type=BinaryRenderer.media_type,
+            etag="%x-%x" % (stats.st_mtime_ns, stats.st_size),
+            filename=os.path.basename(filename))
+
+    @detail_route(renderer_classes=[renderers.JSONRenderer,
+                                    renderers.BrowsableAPIRenderer,
+                                    BinaryRenderer])
+    def preview(self, request, *args, **kwargs):
+        """
+        Preview trace of a single waveform trace.
+
+        Returned as JSON or, with ``?format=binary``, as the raw little
+        endian float32 values with the time information in the headers.
+        """
+        obj = self.get_object()
+        if obj.preview_pending:
+            obj.create_preview()
+        if obj.preview_data is None:
+            raise Http404
+
+        starttime = obspy.UTCDateTime(obj.timerange.lower)
+        endtime = obspy.UTCDateTime(obj.timerange.upper)
+
+        if request.accepted_renderer.format == "binary":
+            headers = {
+                "X-Jane-Preview-Starttime": str(starttime),
+                "X-Jane-Preview-Endtime": str(endtime),
+                "X-Jane-Preview-Dtype": models.PREVIEW_DTYPE.str,
+                "X-Jane-Preview-Npts": str(len(obj.preview_trace))}
+            return Response(bytes(obj.preview_data), headers=headers)
+
+        data = collections.OrderedDict()
+        data["starttime"] = str(starttime)
+        data["endtime"] = str(endtime)
+        data["data"] = obj.preview_trace.astype(np.float64).tolist()
+        return Response(data)
+
+    @list_route()
+    def previews(self, request, *args, **kwargs):
+        """
+        Min/max overview of a single channel for an arbitrary time window.
+
+        Served from the preview pyramid with a single query. Pass
+        ``network``, ``station``, ``location``, ``channel``, ``starttime``,
+        ``endtime``, and the number of pixels as ``width``.
+        """
+        params = request.query_params
+        try:
+            starttime = obspy.UTCDateTime(params["starttime"])
+            endtime = obspy.UTCDateTime(params["endtime"])
+            width = int(params.get("width", 1000))
+        except Exception as e:
+            raise JaneInvalidRequestException(
+                "'starttime' and 'endtime' must be given as valid times and "
+                "'width' as an integer: %s" % str(e))
+        if endtime <= starttime:
+            raise JaneInvalidRequestException(
+                "'endtime' must be after 'starttime'.")
+        if not 0 < width <= MAX_PREVIEW_WIDTH:
+            raise JaneInvalidRequestException(
+                "'width' must be between 1 and %i." % MAX_PREVIEW_WIDTH)
+
+        nslc = collections.OrderedDict(
+            (_i, params.get(_i, "").upper())
+            for _i in ("network", "station", "location", "channel"))
+
+        level = pyramid.choose_level(endtime - starttime, width)
+        first_day = int(math.floor(starttime.timestamp /
+                                   pyramid.SECONDS_PER_DAY))
+        last_day = int(math.floor(endtime.timestamp /
+                                  pyramid.SECONDS_PER_DAY))
+        epoch = datetime.date(1970, 1, 1)
+
+        # Restricted channels appear to not have any data.
+        if self._get_restrictions().filter(
+                network=nslc["network"], station=nslc["station"]).exists():
+            raise Http404
+
+        # All required days in a single query.
+        values = models.PreviewPyramid.objects.filter(
+            level=level,
+            day__gte=epoch + datetime.timedelta(days=first_day),
+            day__lte=epoch + datetime.timedelta(days=last_day),
+            **nslc).values_list("day", "data")
+        days = {(_i[0] - epoch).days: pyramid.unpack(_i[1], level)
+                for _i in values}
+        if not days:
+            raise Http404
+
+        start, bucket_length, mins, maxs = pyramid.assemble(
+            days, first_day=first_day, last_day=last_day, level=level,
+            starttime=starttime.timestamp, endtime=endtime.timestamp,
+            width=width)
+
+        def _to_list(values):
+            values = values.astype(np.float64)
+            return [None if math.isnan(_i) else _i for _i in values.tolist()]
+
+        data = collections.OrderedDict(nslc)
+        data["starttime"] = str(obspy.UTCDateTime(start))
+        data["level"] = level
+        data["bucket_length"] = bucket_length
+        data["min"] = _to_list(mins)
+        data["max"] = _to_list(maxs)
+        return Response(data)